@@ -2,9 +2,14 @@ package aiapp.controller;
 
 import aiapp.dto.UploadResponse;
 import aiapp.service.AiService;
+import org.springframework.http.CacheControl;
+import org.springframework.http.MediaType;
+import org.springframework.http.ResponseEntity;
 import org.springframework.web.bind.annotation.*;
 import org.springframework.web.multipart.MultipartFile;
 
+import java.util.concurrent.TimeUnit;
+
 @RestController
 @RequestMapping("/api")
 public class UploadController {
@@ -15,7 +20,31 @@ public class UploadController {
     }
 
     @PostMapping("/upload")
-    public UploadResponse upload(@RequestParam("file") MultipartFile file) throws Exception {
-        return aiService.analyzeImage(file.getBytes());
+    public UploadResponse upload(@RequestParam("file") MultipartFile file,
+                                 @RequestParam(value = "userId", required = false) String userId) throws Exception {
+        return aiService.analyzeImage(file.getBytes(), userId);
+    }
+
+    @GetMapping("/trends/{userId}")
+    public ResponseEntity<String> trends(@PathVariable String userId) {
+        String trend = aiService.fetchTrend(userId);
+        if (trend == null) {
+            return ResponseEntity.notFound().build();
+        }
+        return ResponseEntity.ok()
+                .contentType(MediaType.APPLICATION_JSON)
+                .body(trend);
+    }
+
+    @GetMapping("/overlay/{analysisId}")
+    public ResponseEntity<byte[]> overlay(@PathVariable String analysisId) {
+        byte[] jpeg = aiService.fetchOverlay(analysisId);
+        if (jpeg == null) {
+            return ResponseEntity.notFound().build();
+        }
+        return ResponseEntity.ok()
+                .contentType(MediaType.IMAGE_JPEG)
+                .cacheControl(CacheControl.maxAge(1, TimeUnit.HOURS).cachePrivate())
+                .body(jpeg);
     }
 }
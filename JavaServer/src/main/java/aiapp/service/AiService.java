@@ -23,7 +23,7 @@ public class AiService {
         this.restTemplate = new RestTemplate();
     }
 
-    public UploadResponse analyzeImage(byte[] image) {
+    public UploadResponse analyzeImage(byte[] image, String userId) {
         try {
             // Prepare headers
             HttpHeaders headers = new HttpHeaders();
@@ -38,6 +38,10 @@ public class AiService {
                 }
             };
             body.add("file", resource);
+            // ML service accumulates the user's trend state as analyses arrive
+            if (userId != null && !userId.isBlank()) {
+                body.add("user_id", userId);
+            }
 
             // Create request entity
             HttpEntity<MultiValueMap<String, Object>> requestEntity =
@@ -63,6 +67,34 @@ public class AiService {
         }
     }
 
+    public byte[] fetchOverlay(String analysisId) {
+        try {
+            ResponseEntity<byte[]> response = restTemplate.getForEntity(
+                    mlServiceUrl + "/overlay/{id}",
+                    byte[].class,
+                    analysisId
+            );
+            return response.getBody();
+        } catch (Exception e) {
+            // Overlay evicted from the ML cache or service unavailable
+            return null;
+        }
+    }
+
+    public String fetchTrend(String userId) {
+        try {
+            ResponseEntity<String> response = restTemplate.getForEntity(
+                    mlServiceUrl + "/trends/{userId}",
+                    String.class,
+                    userId
+            );
+            return response.getBody();
+        } catch (Exception e) {
+            // No analyses for this user yet or service unavailable
+            return null;
+        }
+    }
+
     public String checkStatus() {
         try {
             ResponseEntity<String> response = restTemplate.getForEntity(
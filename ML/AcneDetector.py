@@ -1,110 +1,232 @@
 import numpy as np
 import cv2
-from typing import Optional, Dict
+from typing import Optional, Dict, Tuple
 from scipy import ndimage
 from skimage.feature.texture import local_binary_pattern
 from skimage import morphology
 from skimage import filters
 from ImageProcessor import ImageProcessor
+from QualityTiers import QualityTier, TIERS
+from Workspace import Workspace, current_workspace
 
 class AcneDetector:
+    CLOSING_KERNEL = morphology.disk(3).astype(np.uint8)
+    # Предфильтр пятен по эксцентриситету моментов: у контуров, прошедших точную проверку
+    # (fitEllipse < 0.9), на эталонных масках он не превышал 0.94 - запас до 0.97
+    PREFILTER_ECCENTRICITY = 0.97
+    
+    @staticmethod
+    def local_variance(gray: np.ndarray, exact: bool = True, size: int = 9,
+                       ws: Optional[Workspace] = None) -> np.ndarray:
+        ws = ws if ws is not None else current_workspace()
+        out = ws.get('variance.out', gray.shape, gray.dtype)
+        if exact:
+            return ndimage.generic_filter(gray, np.var, size=size, output=out)
+        # Дисперсия через box-фильтры; BORDER_REFLECT совпадает с mode='reflect' в scipy.
+        # generic_filter пишет результат в dtype входа, поэтому для uint8 повторяется то же
+        # усечение с переполнением по модулю 256
+        n = size * size
+        if gray.dtype == np.uint8:
+            # Для uint8 - в целых: n^2 * var = n * S(x^2) - S(x)^2, в int32 без переполнения до size=13.
+            # Результат почти совпадает с exact: np.var в float даёт для целой дисперсии 3.999...,
+            # и generic_filter усекает её до 3, а здесь получается 4 (~0.02% пикселей)
+            sums = cv2.boxFilter(gray, cv2.CV_32S, (size, size), dst=ws.get('variance.sum', gray.shape, np.int32),
+                                 normalize=False, borderType=cv2.BORDER_REFLECT)
+            squares = np.multiply(gray, gray, out=ws.get('variance.squares', gray.shape, np.uint16), dtype=np.uint16)
+            scaled = cv2.boxFilter(squares, cv2.CV_32S, (size, size),
+                                   dst=ws.get('variance.sq_sum', gray.shape, np.int32),
+                                   normalize=False, borderType=cv2.BORDER_REFLECT)
+            np.multiply(scaled, n, out=scaled)
+            np.subtract(scaled, np.multiply(sums, sums, out=sums), out=scaled)
+            np.floor_divide(scaled, n * n, out=scaled)
+            np.copyto(out, scaled, casting='unsafe')
+            return out
+        # Остальные типы - E[x^2] - E[x]^2 в float32
+        values = ws.get('variance.values', gray.shape, np.float32)
+        np.copyto(values, gray, casting='unsafe')
+        mean = cv2.boxFilter(values, cv2.CV_32F, (size, size), dst=ws.get('variance.mean', gray.shape, np.float32),
+                             borderType=cv2.BORDER_REFLECT)
+        squares = np.multiply(values, values, out=values)
+        var = cv2.boxFilter(squares, cv2.CV_32F, (size, size),
+                            dst=ws.get('variance.mean_sq', gray.shape, np.float32), borderType=cv2.BORDER_REFLECT)
+        np.subtract(var, np.multiply(mean, mean, out=mean), out=var)
+        np.maximum(var, 0.0, out=var)
+        np.copyto(out, var, casting='unsafe')
+        return out
+    
     @staticmethod
-    def detect_spots_and_acne(roi_bgr: np.ndarray, skin_mask: Optional[np.ndarray] = None) -> float:
-        gray = cv2.cvtColor(roi_bgr, cv2.COLOR_BGR2GRAY)
+    def _equalized_gray(roi_bgr: np.ndarray, ws: Workspace) -> np.ndarray:
+        shape = roi_bgr.shape[:2]
+        gray = cv2.cvtColor(roi_bgr, cv2.COLOR_BGR2GRAY, dst=ws.get('acne.gray', shape))
+        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        return clahe.apply(gray, ws.get('acne.gray_eq', shape))
+    
+    @staticmethod
+    def _red_index(roi_bgr: np.ndarray, ws: Workspace) -> np.ndarray:
+        # r - (g + b) / 2 по представлениям каналов, без копий плоскостей. Значения кратны 0.5
+        # и по модулю не больше 255, поэтому float32 представляет их точно
+        red_index = ws.get('acne.red_index', roi_bgr.shape[:2], np.float32)
+        np.add(roi_bgr[..., 1], roi_bgr[..., 0], out=red_index, dtype=np.float32)
+        np.multiply(red_index, 0.5, out=red_index)
+        return np.subtract(roi_bgr[..., 2], red_index, out=red_index, dtype=np.float32)
+    
+    @staticmethod
+    def detect_spots_and_acne(roi_bgr: np.ndarray, skin_mask: Optional[np.ndarray] = None,
+                              tier: QualityTier = TIERS['full']) -> float:
+        ws = current_workspace()
         h, w = roi_bgr.shape[:2]
         
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        gray_eq = clahe.apply(gray)
+        gray_eq = AcneDetector._equalized_gray(roi_bgr, ws)
         
         if skin_mask is not None:
-            mask_bool = skin_mask.astype(bool)
-            median_val = np.median(gray_eq[mask_bool]) if mask_bool.sum() > 0 else 127
-            gray_eq_skin = gray_eq.copy()
-            gray_eq_skin[~mask_bool] = median_val
+            mask_bool = ws.mask('acne.mask', skin_mask)
+            median_val = np.median(gray_eq[mask_bool]) if mask_bool.any() else 127
+            gray_eq_skin = ws.get('acne.gray_skin', (h, w))
+            np.copyto(gray_eq_skin, gray_eq)
+            outside = np.logical_not(mask_bool, out=ws.get('acne.outside', (h, w), np.bool_))
+            np.copyto(gray_eq_skin, median_val, casting='unsafe', where=outside)
         else:
             gray_eq_skin = gray_eq
         
-        local_var = ndimage.generic_filter(gray_eq_skin, np.var, size=9)
-        Q1, Q3 = np.percentile(local_var, 25), np.percentile(local_var, 75)
+        local_var = AcneDetector.local_variance(gray_eq_skin, tier.exact_local_variance, ws=ws)
+        Q1, Q3 = tier.percentile(local_var, [25, 75])
         IQR = Q3 - Q1
         var_thresh = Q3 + 1.5 * IQR
-        candidate_var = local_var > var_thresh
+        spots = np.greater(local_var, var_thresh, out=ws.get('acne.spots', (h, w), np.bool_))
         
-        b, g, r = cv2.split(roi_bgr)
-        red_index = r.astype(float) - (g.astype(float) + b.astype(float)) / 2
-        red_thresh = np.percentile(red_index.flatten(), 80)
-        red_prom = red_index > red_thresh
+        red_index = AcneDetector._red_index(roi_bgr, ws)
+        red_thresh = tier.percentile(red_index, 80)
+        red_prom = np.greater(red_index, red_thresh, out=ws.get('acne.red_prom', (h, w), np.bool_))
         
-        lbp = local_binary_pattern(gray_eq_skin, P=8, R=1, method='uniform')
-        lbp_thresh = np.percentile(lbp.flatten(), 80)
-        lbp_mask = lbp > lbp_thresh
+        # Коды uniform LBP - целые 0..P+1
+        lbp = local_binary_pattern(gray_eq_skin, P=8, R=1, method='uniform').astype(np.uint8)
+        lbp_thresh = tier.percentile(lbp, 80)
+        lbp_mask = np.greater(lbp, lbp_thresh, out=ws.get('acne.lbp_mask', (h, w), np.bool_))
         
         small_gray = cv2.resize(gray_eq_skin, (w // 4, h // 4))
-        entropy = filters.rank.entropy(small_gray, morphology.disk(5))
+        entropy = filters.rank.entropy(small_gray, morphology.disk(5)).astype(np.float32)
         entropy_resized = cv2.resize(entropy, (w, h), interpolation=cv2.INTER_LINEAR)
-        entropy_mask = entropy_resized > np.percentile(entropy_resized.flatten(), 85)
+        entropy_mask = np.greater(entropy_resized, tier.percentile(entropy_resized, 85),
+                                  out=ws.get('acne.entropy_mask', (h, w), np.bool_))
+        np.logical_or(lbp_mask, entropy_mask, out=lbp_mask)
         
-        spots = candidate_var & red_prom & (lbp_mask | entropy_mask)
+        np.logical_and(spots, red_prom, out=spots)
+        np.logical_and(spots, lbp_mask, out=spots)
         
         if skin_mask is not None:
-            spots = spots & skin_mask.astype(bool)
+            np.logical_and(spots, mask_bool, out=spots)
         
         min_size = max(5, int(0.0001 * h * w))
-        spots = morphology.remove_small_objects(spots, min_size=min_size)
-        spots = morphology.binary_closing(spots, morphology.disk(3))
-        spots = morphology.remove_small_objects(spots, min_size=min_size)
-        
-        contours, _ = cv2.findContours(spots.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        spots_filtered = np.zeros_like(spots, dtype=np.uint8)
-        
-        for cnt in contours:
-            area = cv2.contourArea(cnt)
-            perimeter = cv2.arcLength(cnt, True)
-            
-            if perimeter == 0 or area < min_size:
-                continue
-            
-            circularity = 4 * np.pi * area / (perimeter ** 2)
-            
-            if len(cnt) >= 5:
-                (x, y), (MA, ma), angle = cv2.fitEllipse(cnt)
-                eccentricity = np.sqrt(1 - (min(MA, ma) / max(MA, ma)) ** 2) if max(MA, ma) > 0 else 1.0
-            else:
-                eccentricity = 1.0
-            
-            if 0.4 <= circularity <= 1.0 and eccentricity < 0.9 and area < 0.05 * h * w:
-                cv2.drawContours(spots_filtered, [cnt], -1, 1, -1)
+        spots_filtered = AcneDetector._filter_spots(spots.view(np.uint8), min_size)
         
         score = spots_filtered.sum() / float(h * w)
         return ImageProcessor.normalize01(score / 0.015)
     
     @staticmethod
-    def analyze_acne_severity(roi_bgr: np.ndarray, skin_mask: Optional[np.ndarray] = None) -> Dict[str, float]:
-        gray = cv2.cvtColor(roi_bgr, cv2.COLOR_BGR2GRAY)
+    def _components(mask: np.ndarray, connectivity: int) -> Tuple[int, np.ndarray, np.ndarray, np.ndarray]:
+        # Кандидаты разрежены (порядка 1% пикселей) - признаки компонент считаются через bincount
+        # только по ненулевым пикселям, без статистик по всему кадру
+        n, labels = cv2.connectedComponents(mask, connectivity=connectivity)
+        points = cv2.findNonZero(mask)
+        if points is None:
+            empty = np.empty(0, dtype=np.intp)
+            return n, labels, empty, empty
+        points = points.reshape(-1, 2)
+        return n, labels, points[:, 1], points[:, 0]
+    
+    @staticmethod
+    def _remove_small_components(mask: np.ndarray, min_size: int) -> np.ndarray:
+        n, labels, ys, xs = AcneDetector._components(mask, 4)
+        component = labels[ys, xs]
+        small = np.bincount(component, minlength=n)[component] < min_size
+        result = (mask != 0).view(np.uint8)
+        result[ys[small], xs[small]] = 0
+        return result
+    
+    @staticmethod
+    def _moment_eccentricity(n: int, component: np.ndarray, ys: np.ndarray, xs: np.ndarray) -> np.ndarray:
+        """Эксцентриситет эллипса вторых центральных моментов для всех компонент сразу."""
+        count = np.maximum(np.bincount(component, minlength=n), 1).astype(np.float64)
+        dx = xs - (np.bincount(component, xs, n) / count)[component]
+        dy = ys - (np.bincount(component, ys, n) / count)[component]
+        mu20 = np.bincount(component, dx * dx, n) / count
+        mu02 = np.bincount(component, dy * dy, n) / count
+        mu11 = np.bincount(component, dx * dy, n) / count
+        half_diff = np.sqrt(((mu20 - mu02) / 2) ** 2 + mu11 ** 2)
+        major = (mu20 + mu02) / 2 + half_diff
+        minor = (mu20 + mu02) / 2 - half_diff
+        ratio = np.divide(minor, major, out=np.zeros(n), where=major > 0)
+        return np.sqrt(np.clip(1.0 - ratio, 0.0, 1.0))
+    
+    @staticmethod
+    def _contour_shapes(contours) -> Dict[str, np.ndarray]:
+        # Точные признаки прежнего цикла - вызываются только для контуров, прошедших предфильтр
+        area = np.array([cv2.contourArea(cnt) for cnt in contours], dtype=np.float64)
+        perimeter = np.array([cv2.arcLength(cnt, True) for cnt in contours], dtype=np.float64)
+        eccentricity = np.ones(len(contours))
+        for i, cnt in enumerate(contours):
+            if len(cnt) >= 5:
+                _, (MA, ma), _ = cv2.fitEllipse(cnt)
+                if max(MA, ma) > 0:
+                    eccentricity[i] = np.sqrt(1 - (min(MA, ma) / max(MA, ma)) ** 2)
+        return {'area': area, 'perimeter': perimeter, 'eccentricity': eccentricity}
+    
+    @staticmethod
+    def _filter_spots(spots: np.ndarray, min_size: int) -> np.ndarray:
+        h, w = spots.shape
+        spots = AcneDetector._remove_small_components(spots, min_size)
+        spots = cv2.morphologyEx(spots, cv2.MORPH_CLOSE, AcneDetector.CLOSING_KERNEL)
+        spots = AcneDetector._remove_small_components(spots, min_size)
+        
+        spots_filtered = np.zeros_like(spots)
+        contours, _ = cv2.findContours(spots, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if not contours:
+            return spots_filtered
+        
+        # Внешний контур - граница 8-связной компоненты и начинается с её пикселя
+        n, labels, ys, xs = AcneDetector._components(spots, 8)
+        elongated = AcneDetector._moment_eccentricity(n, labels[ys, xs], ys, xs) >= AcneDetector.PREFILTER_ECCENTRICITY
+        starts = np.array([cnt[0, 0] for cnt in contours])
+        candidates = [contours[i] for i in np.flatnonzero(~elongated[labels[starts[:, 1], starts[:, 0]]])]
+        if not candidates:
+            return spots_filtered
+        
+        shapes = AcneDetector._contour_shapes(candidates)
+        area, perimeter = shapes['area'], shapes['perimeter']
+        circularity = np.divide(4 * np.pi * area, perimeter ** 2, out=np.zeros_like(area), where=perimeter > 0)
+        
+        keep = ((perimeter > 0) & (area >= min_size) &
+                (circularity >= 0.4) & (circularity <= 1.0) &
+                (shapes['eccentricity'] < 0.9) & (area < 0.05 * h * w))
+        # Все оставшиеся контуры заливаются одним вызовом
+        cv2.drawContours(spots_filtered, [candidates[i] for i in np.flatnonzero(keep)], -1, 1, -1)
+        return spots_filtered
+    
+    @staticmethod
+    def analyze_acne_severity(roi_bgr: np.ndarray, skin_mask: Optional[np.ndarray] = None,
+                              tier: QualityTier = TIERS['full']) -> Dict[str, float]:
+        ws = current_workspace()
         h, w = roi_bgr.shape[:2]
         
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        gray_eq = clahe.apply(gray)
-        
-        b, g, r = cv2.split(roi_bgr)
-        red_index = r.astype(float) - (g.astype(float) + b.astype(float)) / 2
+        gray_eq = AcneDetector._equalized_gray(roi_bgr, ws)
+        red_index = AcneDetector._red_index(roi_bgr, ws)
+        local_var = AcneDetector.local_variance(gray_eq, tier.exact_local_variance, ws=ws)
         
-        local_var = ndimage.generic_filter(gray_eq, np.var, size=9)
-        
-        mild_mask = (red_index > np.percentile(red_index, 75)) & (local_var > np.percentile(local_var, 70))
-        moderate_mask = (red_index > np.percentile(red_index, 85)) & (local_var > np.percentile(local_var, 80))
-        severe_mask = (red_index > np.percentile(red_index, 92)) & (local_var > np.percentile(local_var, 90))
-        
-        if skin_mask is not None:
-            mask_bool = skin_mask.astype(bool)
-            mild_mask = mild_mask & mask_bool
-            moderate_mask = moderate_mask & mask_bool
-            severe_mask = severe_mask & mask_bool
+        red_q75, red_q85, red_q92 = tier.percentile(red_index, [75, 85, 92])
+        var_q70, var_q80, var_q90 = tier.percentile(local_var, [70, 80, 90])
+        mask_bool = ws.mask('acne.mask', skin_mask) if skin_mask is not None else None
         
+        # Маски уровней считаются по очереди в одних и тех же буферах
         total_pixels = h * w
-        mild_score = mild_mask.sum() / total_pixels
-        moderate_score = moderate_mask.sum() / total_pixels
-        severe_score = severe_mask.sum() / total_pixels
+        scores = []
+        for red_q, var_q in ((red_q75, var_q70), (red_q85, var_q80), (red_q92, var_q90)):
+            level = np.greater(red_index, red_q, out=ws.get('severity.red', (h, w), np.bool_))
+            high_var = np.greater(local_var, var_q, out=ws.get('severity.var', (h, w), np.bool_))
+            np.logical_and(level, high_var, out=level)
+            if mask_bool is not None:
+                np.logical_and(level, mask_bool, out=level)
+            scores.append(np.count_nonzero(level) / total_pixels)
+        mild_score, moderate_score, severe_score = scores
         
         return {
             'mild_acne': ImageProcessor.normalize01(mild_score / 0.05),
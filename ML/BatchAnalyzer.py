@@ -1,10 +1,57 @@
 from FaceAnalyzer import FaceAnalyzer
-from typing import List, Dict
+from TrendAccumulator import UserTrend
+from SharedFrames import AnalysisProcessPool
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional
 import cv2
 import numpy as np
 from typing import Dict, List
 
 class SkinHealthReport:
+    WEIGHTS = {
+        'paleness': 0.05,
+        'cyanosis': 0.08,
+        'jaundice': 0.08,
+        'redness': 0.07,
+        'acne_spots': 0.12,
+        'oiliness': 0.08,
+        'pigmentation': 0.09,
+        'vascularity': 0.06,
+        'puffiness': 0.07,
+        'dark_circles': 0.08,
+        'wrinkles': 0.10,
+        'texture_roughness': 0.06,
+        'pore_size': 0.06
+    }
+    
+    # (метрики с порогами, срабатывающие по "или"; рекомендации)
+    RECOMMENDATION_RULES = [
+        ((('acne_spots', 0.4), ('severe_acne', 0.3)),
+         ["Консультация дерматолога для лечения акне", "Использование некомедогенных продуктов"]),
+        ((('oiliness', 0.5),),
+         ["Матирующие средства и контроль жирности", "Регулярное очищение кожи"]),
+        ((('pigmentation', 0.5),),
+         ["SPF защита ежедневно", "Средства с витамином C и ниацинамидом"]),
+        ((('dark_circles', 0.5),),
+         ["Крем для области вокруг глаз с кофеином", "Контроль режима сна"]),
+        ((('wrinkles', 0.5),),
+         ["Антивозрастные средства с ретинолом", "Увлажнение и защита от солнца"]),
+        ((('puffiness', 0.5),),
+         ["Лимфодренажный массаж", "Контроль потребления соли"]),
+        ((('cyanosis', 0.3), ('jaundice', 0.3)),
+         ["Обратиться к врачу для обследования"]),
+        ((('texture_roughness', 0.5),),
+         ["Мягкие эксфолианты для выравнивания текстуры"]),
+        ((('pore_size', 0.5),),
+         ["Средства с BHA кислотами для очищения пор"])
+    ]
+    DEFAULT_RECOMMENDATION = "Кожа в хорошем состоянии"
+    
+    GOOD_KEYS = ['fatigue_low', 'fatigue_high', 'stress_low', 'stress_high', 'skin_good', 'color_good',
+                 'eyes_good', 'aging_low', 'puffiness_low', 'hydration_ok']
+    BAD_KEYS = ['skin_poor', 'skin_moderate', 'color_bad', 'eyes_bad', 'aging_high', 'puffiness_high',
+                'oiliness_high', 'dryness_high']
+    
     @staticmethod
     def generate_report(metrics: Dict[str, float]) -> Dict[str, any]:
         report = {
@@ -17,58 +64,57 @@ class SkinHealthReport:
     
     @staticmethod
     def _calculate_overall_score(metrics: Dict[str, float]) -> float:
-        weights = {
-            'paleness': 0.05,
-            'cyanosis': 0.08,
-            'jaundice': 0.08,
-            'redness': 0.07,
-            'acne_spots': 0.12,
-            'oiliness': 0.08,
-            'pigmentation': 0.09,
-            'vascularity': 0.06,
-            'puffiness': 0.07,
-            'dark_circles': 0.08,
-            'wrinkles': 0.10,
-            'texture_roughness': 0.06,
-            'pore_size': 0.06
-        }
-        
         total_score = 0.0
         total_weight = 0.0
         
-        for key, weight in weights.items():
+        for key, weight in SkinHealthReport.WEIGHTS.items():
             if key in metrics:
                 total_score += (1.0 - metrics[key]) * weight
                 total_weight += weight
         
         return total_score / total_weight if total_weight > 0 else 0.0
     
+    @staticmethod
+    def _composite_features(get) -> Dict[str, any]:
+        # get(key) возвращает скаляр или столбец метрик, формулы общие для обоих случаев
+        dark_circles = get('dark_circles')
+        puffiness = get('puffiness')
+        wrinkles = get('wrinkles')
+        redness = get('redness')
+        oiliness = get('oiliness')
+        paleness = get('paleness')
+        cyanosis = get('cyanosis')
+        jaundice = get('jaundice')
+        texture_roughness = get('texture_roughness')
+        pigmentation = get('pigmentation')
+        pore_size = get('pore_size')
+        acne_total = get('mild_acne') + get('moderate_acne') + get('severe_acne')
+        
+        return {
+            'fatigue': (dark_circles + puffiness + wrinkles) / 3.0,
+            'stress': (wrinkles + redness + oiliness) / 3.0,
+            'skin_health': 1 - (0.5*acne_total + 0.3*redness + 0.2*texture_roughness),
+            'color_balance': 1 - (0.5*paleness + 0.5*cyanosis),
+            'eye_condition': 1 - (0.5*dark_circles + 0.5*jaundice + 0.3*redness),
+            'aging_signs': (0.4*wrinkles + 0.3*pore_size + 0.3*pigmentation),
+            'puffiness_level': puffiness,
+            'oil_balance': oiliness,
+            'texture_roughness': texture_roughness
+        }
+    
     @staticmethod
     def _get_features(metrics: Dict[str, float]) -> List[str]:
-        dark_circles = metrics.get('dark_circles', 0.0)
-        puffiness = metrics.get('puffiness', 0.0)
-        wrinkles = metrics.get('wrinkles', 0.0)
-        redness = metrics.get('redness', 0.0)
-        oiliness = metrics.get('oiliness', 0.0)
-        paleness = metrics.get('paleness', 0.0)
-        cyanosis = metrics.get('cyanosis', 0.0)
-        jaundice = metrics.get('jaundice', 0.0)
-        mild_acne = metrics.get('mild_acne', 0.0)
-        moderate_acne = metrics.get('moderate_acne', 0.0)
-        severe_acne = metrics.get('severe_acne', 0.0)
-        texture_roughness = metrics.get('texture_roughness', 0.0)
-        pigmentation = metrics.get('pigmentation', 0.0)
-        pore_size = metrics.get('pore_size', 0.0)
-        vascularity = metrics.get('vascularity', 0.0)
             # === КОМПЛЕКСНЫЕ ХАРАКТЕРИСТИКИ ===
-        fatigue = (dark_circles + puffiness + wrinkles) / 3.0
-        stress = (wrinkles + redness + oiliness) / 3.0
-        skin_health = 1 - (0.5*(mild_acne + moderate_acne + severe_acne) + 0.3*redness + 0.2*texture_roughness)
-        color_balance = 1 - (0.5*paleness + 0.5*cyanosis)
-        eye_condition = 1 - (0.5*dark_circles + 0.5*jaundice + 0.3*redness)
-        aging_signs = (0.4*wrinkles + 0.3*pore_size + 0.3*pigmentation)
-        puffiness_level = puffiness
-        oil_balance = oiliness
+        composite = SkinHealthReport._composite_features(lambda key: metrics.get(key, 0.0))
+        fatigue = composite['fatigue']
+        stress = composite['stress']
+        skin_health = composite['skin_health']
+        color_balance = composite['color_balance']
+        eye_condition = composite['eye_condition']
+        aging_signs = composite['aging_signs']
+        puffiness_level = composite['puffiness_level']
+        oil_balance = composite['oil_balance']
+        texture_roughness = composite['texture_roughness']
 
         # === РЕЗУЛЬТАТЫ ===
         good_keys = []
@@ -125,111 +171,166 @@ class SkinHealthReport:
     def _generate_recommendations(metrics: Dict[str, float]) -> List[str]:
         recommendations = []
         
-        if metrics.get('acne_spots', 0) > 0.4 or metrics.get('severe_acne', 0) > 0.3:
-            recommendations.append("Консультация дерматолога для лечения акне")
-            recommendations.append("Использование некомедогенных продуктов")
+        for conditions, messages in SkinHealthReport.RECOMMENDATION_RULES:
+            if any(metrics.get(key, 0) > threshold for key, threshold in conditions):
+                recommendations.extend(messages)
         
-        if metrics.get('oiliness', 0) > 0.5:
-            recommendations.append("Матирующие средства и контроль жирности")
-            recommendations.append("Регулярное очищение кожи")
-        
-        if metrics.get('pigmentation', 0) > 0.5:
-            recommendations.append("SPF защита ежедневно")
-            recommendations.append("Средства с витамином C и ниацинамидом")
-        
-        if metrics.get('dark_circles', 0) > 0.5:
-            recommendations.append("Крем для области вокруг глаз с кофеином")
-            recommendations.append("Контроль режима сна")
+        return recommendations if recommendations else [SkinHealthReport.DEFAULT_RECOMMENDATION]
+    
+    @staticmethod
+    def score_batch(metric_matrix: np.ndarray, metric_names: List[str]) -> 'BatchScores':
+        """
+        Векторная оценка N анализов сразу: metric_matrix имеет форму N x M,
+        столбцы соответствуют metric_names, NaN означает отсутствующую метрику.
+        """
+        matrix = np.asarray(metric_matrix, dtype=np.float64)
+        if matrix.ndim == 1:
+            matrix = matrix[np.newaxis, :]
+        n = matrix.shape[0]
+        present = ~np.isnan(matrix)
+        values = np.where(present, matrix, 0.0)
+        columns = {name: j for j, name in enumerate(metric_names)}
+        zeros = np.zeros(n)
         
-        if metrics.get('wrinkles', 0) > 0.5:
-            recommendations.append("Антивозрастные средства с ретинолом")
-            recommendations.append("Увлажнение и защита от солнца")
+        def get(key):
+            j = columns.get(key)
+            return values[:, j] if j is not None else zeros
         
-        if metrics.get('puffiness', 0) > 0.5:
-            recommendations.append("Лимфодренажный массаж")
-            recommendations.append("Контроль потребления соли")
+        weights = np.array([SkinHealthReport.WEIGHTS.get(name, 0.0) for name in metric_names])
+        total_weight = present @ weights
+        total_score = ((1.0 - values) * present) @ weights
+        overall = np.divide(total_score, total_weight, out=np.zeros(n), where=total_weight > 0)
         
-        if metrics.get('cyanosis', 0) > 0.3 or metrics.get('jaundice', 0) > 0.3:
-            recommendations.append("Обратиться к врачу для обследования")
+        features = SkinHealthReport._composite_features(get)
+        fatigue_low = features['fatigue'] < 0.4
+        stress_low = features['stress'] < 0.4
+        skin_good = features['skin_health'] > 0.7
+        skin_poor = features['skin_health'] < 0.4
+        puffiness_high = features['puffiness_level'] > 0.6
+        oiliness_high = features['oil_balance'] > 0.6
+        dryness_high = ~oiliness_high & (features['oil_balance'] < 0.3) & (features['texture_roughness'] > 0.5)
         
-        if metrics.get('texture_roughness', 0) > 0.5:
-            recommendations.append("Мягкие эксфолианты для выравнивания текстуры")
+        good = np.column_stack([
+            fatigue_low, ~fatigue_low,
+            stress_low, ~stress_low,
+            skin_good,
+            features['color_balance'] > 0.7,
+            features['eye_condition'] > 0.7,
+            features['aging_signs'] < 0.4,
+            ~puffiness_high & (features['puffiness_level'] < 0.3),
+            ~oiliness_high & ~dryness_high
+        ])
+        bad = np.column_stack([
+            ~skin_good & skin_poor,
+            ~skin_good & ~skin_poor,
+            features['color_balance'] < 0.4,
+            features['eye_condition'] < 0.4,
+            ~(features['aging_signs'] < 0.4) & (features['aging_signs'] > 0.7),
+            puffiness_high,
+            oiliness_high,
+            dryness_high
+        ])
         
-        if metrics.get('pore_size', 0) > 0.5:
-            recommendations.append("Средства с BHA кислотами для очищения пор")
+        rules = np.column_stack([
+            np.logical_or.reduce([get(key) > threshold for key, threshold in conditions])
+            for conditions, _ in SkinHealthReport.RECOMMENDATION_RULES
+        ])
         
-        return recommendations if recommendations else ["Кожа в хорошем состоянии"]
+        return BatchScores(metric_names, matrix, overall, features, good, bad, rules)
+    
+    @staticmethod
+    def generate_reports(metrics_list: List[Dict[str, float]]) -> List[Dict[str, any]]:
+        names = sorted({key for metrics in metrics_list for key in metrics})
+        matrix = np.array([[metrics.get(name, np.nan) for name in names] for metrics in metrics_list],
+                          dtype=np.float64).reshape(len(metrics_list), len(names))
+        return SkinHealthReport.score_batch(matrix, names).reports()
+
+
+class BatchScores:
+    def __init__(self, metric_names: List[str], matrix: np.ndarray, overall_score: np.ndarray,
+                 features: Dict[str, np.ndarray], good: np.ndarray, bad: np.ndarray, rules: np.ndarray):
+        self.metric_names = list(metric_names)
+        self.matrix = matrix
+        self.overall_score = overall_score
+        self.features = features
+        self.good = good
+        self.bad = bad
+        self.rules = rules
+    
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+    
+    def recommendations(self, i: int) -> List[str]:
+        recommendations = []
+        for fired, (_, messages) in zip(self.rules[i], SkinHealthReport.RECOMMENDATION_RULES):
+            if fired:
+                recommendations.extend(messages)
+        return recommendations if recommendations else [SkinHealthReport.DEFAULT_RECOMMENDATION]
+    
+    def report(self, i: int) -> Dict[str, any]:
+        row = self.matrix[i]
+        metrics = {name: float(row[j]) for j, name in enumerate(self.metric_names) if not np.isnan(row[j])}
+        good_keys = [key for key, on in zip(SkinHealthReport.GOOD_KEYS, self.good[i]) if on]
+        bad_keys = [key for key, on in zip(SkinHealthReport.BAD_KEYS, self.bad[i]) if on]
+        return {
+            'overall_score': float(self.overall_score[i]),
+            'recommendations': self.recommendations(i),
+            'features': (good_keys, bad_keys),
+            'metrics_summary': metrics
+        }
+    
+    def reports(self) -> List[Dict[str, any]]:
+        return [self.report(i) for i in range(len(self))]
 
 
 class BatchAnalyzer:
     def __init__(self):
         self.analyzer = FaceAnalyzer()
     
-    def analyze_multiple(self, image_paths: List[str]) -> List[Dict]:
-        results = []
-        
-        for path in image_paths:
+    def analyze_multiple(self, image_paths: List[str], processes: int = 0) -> List[Dict]:
+        if processes > 0:
+            # Кадры передаются воркерам через разделяемую память, а не сериализацией
+            pool = AnalysisProcessPool(processes)
             try:
-                img = cv2.imread(path)
-                if img is None:
-                    results.append({'path': path, 'error': 'Не удалось загрузить изображение'})
-                    continue
-                
+                with ThreadPoolExecutor(max_workers=processes) as threads:
+                    return list(threads.map(lambda path: self._analyze_path(path, pool), image_paths))
+            finally:
+                pool.shutdown()
+        
+        return [self._analyze_path(path) for path in image_paths]
+    
+    def _analyze_path(self, path: str, pool: Optional[AnalysisProcessPool] = None) -> Dict:
+        try:
+            img = cv2.imread(path)
+            if img is None:
+                return {'path': path, 'error': 'Не удалось загрузить изображение'}
+            
+            if pool is not None:
+                metrics = pool.analyze(img)[0]
+            else:
                 metrics, _ = self.analyzer.analyze(img, visualize=False)
-                report = SkinHealthReport.generate_report(metrics)
-                
-                results.append({
-                    'path': path,
-                    'metrics': metrics,
-                    'report': report
-                })
-            except Exception as e:
-                results.append({'path': path, 'error': str(e)})
-        
-        return results
+            report = SkinHealthReport.generate_report(metrics)
+            
+            return {
+                'path': path,
+                'metrics': metrics,
+                'report': report
+            }
+        except Exception as e:
+            return {'path': path, 'error': str(e)}
     
-    def compare_analyses(self, results: List[Dict]) -> Dict[str, any]:
-        if not results or all('error' in r for r in results):
+    def compare_analyses(self, results: List[Dict], trend: Optional[UserTrend] = None) -> Dict[str, any]:
+        # Сохранённое состояние (UserTrend.from_json) дополняется только новыми результатами
+        trend = trend if trend is not None else UserTrend()
+        if trend.observations == 0 and (not results or all('error' in r for r in results)):
             return {'error': 'Нет валидных результатов для сравнения'}
         
         valid_results = [r for r in results if 'metrics' in r]
         
-        if len(valid_results) < 2:
+        if trend.observations + len(valid_results) < 2:
             return {'error': 'Недостаточно результатов для сравнения'}
         
-        metric_keys = valid_results[0]['metrics'].keys()
-        comparisons = {}
-        
-        for key in metric_keys:
-            values = [r['metrics'][key] for r in valid_results]
-            comparisons[key] = {
-                'mean': np.mean(values),
-                'std': np.std(values),
-                'min': np.min(values),
-                'max': np.max(values),
-                'trend': 'улучшение' if values[-1] < values[0] else 'ухудшение' if values[-1] > values[0] else 'стабильно'
-            }
+        for r in valid_results:
+            trend.update(r['metrics'], r['report']['overall_score'])
         
-        return {
-            'comparisons': comparisons,
-            'overall_trend': self._calculate_overall_trend(valid_results)
-        }
-    
-    @staticmethod
-    def _calculate_overall_trend(results: List[Dict]) -> str:
-        scores = [r['report']['overall_score'] for r in results]
-        
-        if len(scores) < 2:
-            return 'недостаточно данных'
-        
-        if scores[-1] > scores[0] + 0.05:
-            return 'значительное улучшение'
-        elif scores[-1] > scores[0]:
-            return 'улучшение'
-        elif scores[-1] < scores[0] - 0.05:
-            return 'значительное ухудшение'
-        elif scores[-1] < scores[0]:
-            return 'ухудшение'
-        else:
-            return 'стабильно'
-
+        return {**trend.report(), 'trend_state': trend.to_dict()}
@@ -1,20 +1,21 @@
 import cv2
 import numpy as np
+from typing import Optional
 
 class ColorConverter:
     @staticmethod
-    def to_rgb(img_bgr: np.ndarray) -> np.ndarray:
-        return cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+    def to_rgb(img_bgr: np.ndarray, dst: Optional[np.ndarray] = None) -> np.ndarray:
+        return cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB, dst=dst)
     
     @staticmethod
-    def to_lab(img_bgr: np.ndarray) -> np.ndarray:
-        return cv2.cvtColor(img_bgr, cv2.COLOR_BGR2LAB)
+    def to_lab(img_bgr: np.ndarray, dst: Optional[np.ndarray] = None) -> np.ndarray:
+        return cv2.cvtColor(img_bgr, cv2.COLOR_BGR2LAB, dst=dst)
     
     @staticmethod
-    def to_hsv(img_bgr: np.ndarray) -> np.ndarray:
-        return cv2.cvtColor(img_bgr, cv2.COLOR_BGR2HSV)
+    def to_hsv(img_bgr: np.ndarray, dst: Optional[np.ndarray] = None) -> np.ndarray:
+        return cv2.cvtColor(img_bgr, cv2.COLOR_BGR2HSV, dst=dst)
     
     @staticmethod
-    def to_ycrcb(img_bgr: np.ndarray) -> np.ndarray:
-        return cv2.cvtColor(img_bgr, cv2.COLOR_BGR2YCrCb)
+    def to_ycrcb(img_bgr: np.ndarray, dst: Optional[np.ndarray] = None) -> np.ndarray:
+        return cv2.cvtColor(img_bgr, cv2.COLOR_BGR2YCrCb, dst=dst)
 
@@ -0,0 +1,72 @@
+from functools import cached_property
+import numpy as np
+import cv2
+
+from Workspace import current_workspace
+
+
+class DerivativePlanes:
+    """
+    Общие производные плоскости одного кропа для текстурных метрик (морщины, поры,
+    сосудистость). Каждая плоскость считается при первом обращении в float32 и
+    переиспользуется остальными метриками. Плоскости лежат в буферах текущего Workspace.
+    """
+    CANNY_SIGMA = 1.5
+    CANNY_LOW = 10
+    CANNY_HIGH = 30
+    # Градиенты для cv2.Canny передаются в int16, масштаб сохраняет дробную часть
+    CANNY_SCALE = 8
+
+    def __init__(self, roi_bgr: np.ndarray):
+        self.roi_bgr = roi_bgr
+        self.shape = roi_bgr.shape[:2]
+        self.ws = current_workspace()
+
+    def _buffer(self, name: str, dtype=np.uint8) -> np.ndarray:
+        return self.ws.get('planes.' + name, self.shape, dtype)
+
+    @cached_property
+    def gray(self) -> np.ndarray:
+        return cv2.cvtColor(self.roi_bgr, cv2.COLOR_BGR2GRAY, dst=self._buffer('gray'))
+
+    @cached_property
+    def gradient_magnitude(self) -> np.ndarray:
+        sobelx = cv2.Sobel(self.gray, cv2.CV_32F, 1, 0, dst=self._buffer('dx', np.float32), ksize=3)
+        sobely = cv2.Sobel(self.gray, cv2.CV_32F, 0, 1, dst=self._buffer('dy', np.float32), ksize=3)
+        return cv2.magnitude(sobelx, sobely, magnitude=self._buffer('gradient_magnitude', np.float32))
+
+    @cached_property
+    def smoothed(self) -> np.ndarray:
+        gray = self._buffer('gray_float', np.float32)
+        np.copyto(gray, self.gray)
+        return cv2.GaussianBlur(gray, (0, 0), self.CANNY_SIGMA, dst=self._buffer('smoothed', np.float32))
+
+    @cached_property
+    def edges(self) -> np.ndarray:
+        scale = self.CANNY_SCALE
+        dx = cv2.Sobel(self.smoothed, cv2.CV_32F, 1, 0, dst=self._buffer('canny_dx', np.float32), ksize=3,
+                       scale=scale)
+        dy = cv2.Sobel(self.smoothed, cv2.CV_32F, 0, 1, dst=self._buffer('canny_dy', np.float32), ksize=3,
+                       scale=scale)
+        dx16, dy16 = self._buffer('dx16', np.int16), self._buffer('dy16', np.int16)
+        np.copyto(dx16, np.rint(dx, out=dx), casting='unsafe')
+        np.copyto(dy16, np.rint(dy, out=dy), casting='unsafe')
+        edges = cv2.Canny(dx16, dy16, self.CANNY_LOW * scale, self.CANNY_HIGH * scale,
+                          edges=self._buffer('canny'), L2gradient=True)
+        return np.greater(edges, 0, out=self._buffer('edges', np.bool_))
+
+    @cached_property
+    def morph_gradient(self) -> np.ndarray:
+        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+        enhanced = clahe.apply(self.gray, self._buffer('clahe'))
+        blurred = cv2.GaussianBlur(enhanced, (5, 5), 0, dst=self._buffer('clahe_blurred'))
+        return cv2.morphologyEx(blurred, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)),
+                                dst=self._buffer('morph_gradient'))
+
+    @cached_property
+    def red_green_laplacian(self) -> np.ndarray:
+        r = cv2.extractChannel(self.roi_bgr, 2, dst=self._buffer('r'))
+        g = cv2.extractChannel(self.roi_bgr, 1, dst=self._buffer('g'))
+        red_minus_green = cv2.subtract(r, g, dst=self._buffer('red_minus_green', np.float32), dtype=cv2.CV_32F)
+        return cv2.Laplacian(red_minus_green, cv2.CV_32F, dst=self._buffer('red_green_laplacian', np.float32),
+                             ksize=3)
@@ -2,18 +2,51 @@ import cv2
 from AcneDetector import AcneDetector
 from FaceRegions import FaceRegions
 from ColorConverter import ColorConverter
-from SkinMetrics import SkinMetrics
+from SkinMetrics import SkinMetrics, ColorStats
 from SkinSegmentation import SkinSegmentation
 from ImageProcessor import ImageProcessor
 from FacialFeatureAnalyzer import FacialFeatureAnalyzer
+from DerivativePlanes import DerivativePlanes
+from Instrumentation import stage, current_recorder
+from MemoryBudget import MemoryBudget
+from QualityTiers import QualityTier, get_tier
+from Workspace import workspace
 from typing import Tuple, Optional, Dict
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import threading
+import os
 import numpy as np
 import mediapipe as mp
 
 mp_face = mp.solutions.face_mesh
 
+# Параллельный расчёт групп метрик внутри одного запроса: 0 или 1 - последовательно.
+# Больше воркеров снижает задержку одного запроса, но конкурирует с параллельными запросами.
+METRIC_WORKERS = int(os.environ.get('ML_METRIC_WORKERS', '0'))
+# Число потоков OpenCV на процесс; по умолчанию делится между воркерами метрик
+CV_THREADS = int(os.environ['ML_CV_THREADS']) if os.environ.get('ML_CV_THREADS') else None
+
+if CV_THREADS is not None:
+    cv2.setNumThreads(CV_THREADS)
+
 class FaceAnalyzer:
-    def __init__(self):
+    # Версия алгоритма метрик: увеличивается при любом изменении формул, чтобы
+    # переобработка архива (Reprocess.py) пересчитала ранее проанализированные снимки
+    ALGORITHM_VERSION = 3
+    METRIC_ORDER = ['paleness', 'cyanosis', 'jaundice', 'redness', 'acne_spots', 'oiliness', 'pigmentation',
+                    'vascularity', 'puffiness', 'dark_circles', 'wrinkles', 'texture_roughness', 'pore_size',
+                    'mild_acne', 'moderate_acne', 'severe_acne']
+    
+    # Области кожи, пересекаемые с маской сегментации; области глаз строятся по ориентирам
+    SKIN_REGIONS = ['left_cheek', 'right_cheek', 'nose', 'forehead', 'chin', 'face']
+    # Если цветом кожи признано меньше этой доли лица (освещение, баланс белого), маски не сужаются
+    MIN_SKIN_FRACTION = 0.3
+    
+    _executors: Dict[int, ThreadPoolExecutor] = {}
+    _executor_lock = threading.Lock()
+    
+    def __init__(self, metric_workers: Optional[int] = None):
         self.regions = FaceRegions()
         self.color_converter = ColorConverter()
         self.processor = ImageProcessor()
@@ -21,30 +54,56 @@ class FaceAnalyzer:
         self.metrics = SkinMetrics()
         self.acne_detector = AcneDetector()
         self.feature_analyzer = FacialFeatureAnalyzer()
+        self.metric_workers = METRIC_WORKERS if metric_workers is None else metric_workers
+    
+    def analyze(self, img_bgr: np.ndarray, visualize: bool = False,
+                memory_budget: Optional[MemoryBudget] = None,
+                quality: Optional[str] = None) -> Tuple[Dict[str, float], Optional[np.ndarray]]:
+        metrics_dict, landmarks_xy, img_bgr = self.analyze_with_landmarks(img_bgr, memory_budget, quality)
+        
+        vis = None
+        if visualize:
+            with stage('visualization'):
+                vis = self.render_overlay(img_bgr, landmarks_xy, metrics_dict)
+        
+        return metrics_dict, vis
     
-    def analyze(self, img_bgr: np.ndarray, visualize: bool = False) -> Tuple[Dict[str, float], Optional[np.ndarray]]:
+    def analyze_with_landmarks(self, img_bgr: np.ndarray, memory_budget: Optional[MemoryBudget] = None,
+                               quality: Optional[str] = None) -> Tuple[Dict[str, float], np.ndarray, np.ndarray]:
+        """
+        Метрики, нормированные координаты ориентиров (N, 2) и кадр, на котором шёл анализ.
+        quality - уровень качества из QualityTiers.TIERS (full, balanced, fast); по умолчанию ML_QUALITY_TIER.
+        """
+        tier = get_tier(quality)
+        if memory_budget is not None:
+            with stage('resize'):
+                img_bgr = memory_budget.fit(img_bgr)
+        
         h, w = img_bgr.shape[:2]
         
-        with mp_face.FaceMesh(static_image_mode=True,
-                            max_num_faces=1,
-                            refine_landmarks=False,
-                            min_detection_confidence=0.5) as face_mesh:
+        with stage('face_mesh'), mp_face.FaceMesh(static_image_mode=True,
+                                                  max_num_faces=1,
+                                                  refine_landmarks=False,
+                                                  min_detection_confidence=0.5) as face_mesh:
             img_rgb = self.color_converter.to_rgb(img_bgr)
             results = face_mesh.process(img_rgb)
+            del img_rgb
             
             if not results.multi_face_landmarks:
                 raise RuntimeError("Лицо не обнаружено")
             
             landmarks = results.multi_face_landmarks[0].landmark
         
-        masks = self._create_region_masks(img_bgr, landmarks, w, h)
-        crops = self._create_crops(img_bgr, masks)
-        
-        metrics_dict = self._compute_all_metrics(img_bgr, landmarks, w, h, crops, masks)
+        with stage('regions'):
+            masks = self._create_region_masks(img_bgr, landmarks, w, h)
+            self._apply_skin_mask(img_bgr, masks)
+            crops = self._create_crops(img_bgr, masks)
         
-        vis = self._create_visualization(img_bgr, landmarks, w, h, metrics_dict) if visualize else None
+        with stage('metrics'):
+            metrics_dict = self._compute_all_metrics(img_bgr, landmarks, w, h, crops, masks, tier)
         
-        return metrics_dict, vis
+        landmarks_xy = np.array([(lm.x, lm.y) for lm in landmarks], np.float32)
+        return metrics_dict, landmarks_xy, img_bgr
     
     def _create_region_masks(self, img_bgr: np.ndarray, landmarks, w: int, h: int) -> Dict[str, np.ndarray]:
         masks = {}
@@ -58,6 +117,19 @@ class FaceAnalyzer:
         
         return masks
     
+    def _apply_skin_mask(self, img_bgr: np.ndarray, masks: Dict[str, np.ndarray]) -> None:
+        """Исключает из областей кожи волосы, брови и фон: сегментация только в рамке лица."""
+        bbox = self.processor.mask_bbox(masks['face'])
+        if bbox is None:
+            return
+        x0, x1, y0, y1 = bbox
+        skin = self.skin_seg.skin_mask(img_bgr[y0:y1+1, x0:x1+1]).astype(bool)
+        face = masks['face'][y0:y1+1, x0:x1+1]
+        if np.count_nonzero(skin & face) < self.MIN_SKIN_FRACTION * np.count_nonzero(face):
+            return
+        for name in self.SKIN_REGIONS:
+            masks[name][y0:y1+1, x0:x1+1] &= skin
+    
     def _create_crops(self, img_bgr: np.ndarray, masks: Dict[str, np.ndarray]) -> Dict[str, Tuple]:
         crops = {}
         for name, mask in masks.items():
@@ -65,49 +137,116 @@ class FaceAnalyzer:
         return crops
     
     def _compute_all_metrics(self, img_bgr: np.ndarray, landmarks, w: int, h: int, 
-                           crops: Dict, masks: Dict) -> Dict[str, float]:
+                           crops: Dict, masks: Dict, tier: QualityTier) -> Dict[str, float]:
         face_crop, face_mask = crops['face']
         
         if face_crop is None:
             raise RuntimeError("Не удалось извлечь область лица")
         
-        metrics_dict = {
-            'paleness': self._compute_paleness_combined(crops),
-            'cyanosis': self.metrics.compute_cyanosis(face_crop, face_mask),
-            'jaundice': self.metrics.compute_jaundice(face_crop, face_mask),
-            'redness': self.metrics.compute_redness(face_crop, face_mask),
-            'acne_spots': self.acne_detector.detect_spots_and_acne(face_crop, face_mask),
-            'oiliness': self.metrics.compute_oiliness(face_crop, face_mask),
-            'pigmentation': self.metrics.compute_pigmentation(face_crop, face_mask),
-            'vascularity': self.metrics.compute_vascularity(face_crop, face_mask),
-            'puffiness': self.feature_analyzer.compute_puffiness(landmarks, w, h),
-            'dark_circles': self.feature_analyzer.compute_dark_circles(img_bgr, landmarks, w, h, self.regions),
-            'wrinkles': self.feature_analyzer.compute_wrinkles(face_crop, face_mask),
-            'texture_roughness': self.feature_analyzer.compute_texture_roughness(face_crop, face_mask),
-            'pore_size': self.feature_analyzer.compute_pore_size(face_crop, face_mask)
+        groups = {
+            'color': lambda: self._compute_color_group(face_crop, face_mask, masks),
+            'acne': lambda: self._compute_acne_group(face_crop, face_mask, tier),
+            'texture': lambda: self._compute_texture_group(face_crop, face_mask, tier),
+            'eye': lambda: self._compute_eye_group(img_bgr, landmarks, w, h)
         }
         
-        acne_severity = self.acne_detector.analyze_acne_severity(face_crop, face_mask)
-        metrics_dict.update(acne_severity)
+        def run(name):
+            # Каждая группа берёт свой набор буферов промежуточных плоскостей из пула процесса
+            with stage(name), workspace():
+                return groups[name]()
+        
+        # Пики памяти по стадиям имеют смысл только при одном потоке анализа
+        recorder = current_recorder()
+        if self.metric_workers > 1 and not (recorder is not None and recorder.track_memory):
+            executor = self._get_executor(self.metric_workers)
+            futures = [executor.submit(contextvars.copy_context().run, run, name) for name in groups]
+            results = [future.result() for future in futures]
+        else:
+            results = [run(name) for name in groups]
         
+        computed = {}
+        for result in results:
+            computed.update(result)
+        
+        return {key: computed[key] for key in self.METRIC_ORDER}
+    
+    def _compute_color_group(self, face_crop: np.ndarray, face_mask: np.ndarray,
+                             masks: Dict[str, np.ndarray]) -> Dict[str, float]:
+        color_stats = self._compute_color_statistics(face_crop, face_mask, masks)
+        return {
+            'paleness': self._compute_paleness_combined(color_stats),
+            'cyanosis': self.metrics.cyanosis_from_stats(color_stats['face']),
+            'jaundice': self.metrics.jaundice_from_stats(color_stats['face']),
+            'redness': self.metrics.redness_from_stats(color_stats['face']),
+            'oiliness': self.metrics.compute_oiliness(face_crop, face_mask),
+            'pigmentation': self.metrics.compute_pigmentation(face_crop, face_mask)
+        }
+    
+    def _compute_acne_group(self, face_crop: np.ndarray, face_mask: np.ndarray,
+                            tier: QualityTier) -> Dict[str, float]:
+        metrics_dict = {'acne_spots': self.acne_detector.detect_spots_and_acne(face_crop, face_mask, tier)}
+        metrics_dict.update(self.acne_detector.analyze_acne_severity(face_crop, face_mask, tier))
         return metrics_dict
     
-    def _compute_paleness_combined(self, crops: Dict) -> float:
-        lc_crop, lc_mask = crops['left_cheek']
-        rc_crop, rc_mask = crops['right_cheek']
-        face_crop, face_mask = crops['face']
+    def _compute_texture_group(self, face_crop: np.ndarray, face_mask: np.ndarray,
+                               tier: QualityTier) -> Dict[str, float]:
+        planes = DerivativePlanes(face_crop)
+        return {
+            'vascularity': self.metrics.compute_vascularity(face_crop, face_mask, planes),
+            'wrinkles': self.feature_analyzer.compute_wrinkles(face_crop, face_mask, planes),
+            'texture_roughness': self.feature_analyzer.compute_texture_roughness(face_crop, face_mask, planes, tier),
+            'pore_size': self.feature_analyzer.compute_pore_size(face_crop, face_mask, planes)
+        }
+    
+    def _compute_eye_group(self, img_bgr: np.ndarray, landmarks, w: int, h: int) -> Dict[str, float]:
+        eye_regions = self.feature_analyzer.extract_eye_regions(img_bgr, landmarks, w, h, self.regions)
+        return {
+            'puffiness': self.feature_analyzer.compute_puffiness(landmarks, w, h),
+            'dark_circles': self.feature_analyzer.compute_dark_circles(img_bgr, landmarks, w, h, self.regions, eye_regions)
+        }
+    
+    @classmethod
+    def _get_executor(cls, workers: int) -> ThreadPoolExecutor:
+        # Пул на каждое число воркеров: экземпляры с разным metric_workers не делят один пул
+        with cls._executor_lock:
+            executor = cls._executors.get(workers)
+            if executor is None:
+                executor = cls._executors[workers] = ThreadPoolExecutor(max_workers=workers,
+                                                                        thread_name_prefix=f'metrics{workers}')
+                if CV_THREADS is None:
+                    # Число потоков OpenCV общее на процесс - делится по самому большому пулу,
+                    # чтобы не было переподписки
+                    cv2.setNumThreads(max(1, (os.cpu_count() or 1) // max(cls._executors)))
+            return executor
+    
+    def _compute_color_statistics(self, face_crop: np.ndarray, face_mask: np.ndarray,
+                                  masks: Dict[str, np.ndarray]) -> Dict[str, ColorStats]:
+        x0, x1, y0, y1 = self.processor.mask_bbox(masks['face'])
+        cheeks = {name: masks[name][y0:y1+1, x0:x1+1] for name in ['left_cheek', 'right_cheek']}
+        return self.metrics.region_color_statistics(face_crop, face_mask, cheeks)
+    
+    def _compute_paleness_combined(self, color_stats: Dict[str, ColorStats]) -> float:
+        lc_stats = color_stats['left_cheek']
+        rc_stats = color_stats['right_cheek']
+        face_stats = color_stats['face']
         
-        if lc_crop is not None and rc_crop is not None:
-            pallor_l = self.metrics.compute_paleness_lab(lc_crop, lc_mask)
-            pallor_r = self.metrics.compute_paleness_lab(rc_crop, rc_mask)
+        if lc_stats.count > 0 and rc_stats.count > 0:
+            pallor_l = self.metrics.paleness_from_stats(lc_stats)
+            pallor_r = self.metrics.paleness_from_stats(rc_stats)
             return (pallor_l + pallor_r) / 2.0
-        elif face_crop is not None:
-            return self.metrics.compute_paleness_lab(face_crop, face_mask)
+        elif face_stats.count > 0:
+            return self.metrics.paleness_from_stats(face_stats)
         return 0.0
     
-    def _create_visualization(self, img_bgr: np.ndarray, landmarks, w: int, h: int, 
-                            metrics_dict: Dict[str, float]) -> np.ndarray:
-        vis = img_bgr.copy()
+    def render_overlay(self, img_bgr: np.ndarray, landmarks_xy: np.ndarray, metrics_dict: Dict[str, float],
+                       max_side: Optional[int] = None) -> np.ndarray:
+        h, w = img_bgr.shape[:2]
+        if max_side is not None and max(h, w) > max_side:
+            scale = max_side / float(max(h, w))
+            vis = cv2.resize(img_bgr, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+            h, w = vis.shape[:2]
+        else:
+            vis = img_bgr.copy()
         
         region_colors = {
             'LEFT_CHEEK': (0, 255, 0),
@@ -121,8 +260,7 @@ class FaceAnalyzer:
         
         for region_name, color in region_colors.items():
             indices = getattr(self.regions, region_name)
-            pts = self.processor.get_landmark_points(landmarks, w, h, indices)
-            pts_arr = np.array(pts, np.int32).reshape((-1, 1, 2))
+            pts_arr = (landmarks_xy[indices] * (w, h)).astype(np.int32).reshape((-1, 1, 2))
             cv2.polylines(vis, [pts_arr], True, color, 2)
         
         y_offset = 30
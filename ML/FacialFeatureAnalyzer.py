@@ -1,9 +1,11 @@
 import numpy as np
 from ImageProcessor import ImageProcessor
 from ColorConverter import ColorConverter
+from DerivativePlanes import DerivativePlanes
+from QualityTiers import QualityTier, TIERS
+from Workspace import current_workspace
 import cv2
 from typing import Optional, Dict
-from skimage import feature
 import FaceRegions
 from skimage.feature.texture import local_binary_pattern
 
@@ -35,87 +37,115 @@ class FacialFeatureAnalyzer:
         return float(score)
     
     @staticmethod
-    def compute_dark_circles(image_bgr: np.ndarray, landmarks, img_w: int, img_h: int, regions: FaceRegions) -> float:
+    def extract_eye_regions(image_bgr: np.ndarray, landmarks, img_w: int, img_h: int,
+                            regions: FaceRegions) -> Dict[str, Dict]:
         left_eye_pts = ImageProcessor.get_landmark_points(landmarks, img_w, img_h, regions.LEFT_EYE)
         right_eye_pts = ImageProcessor.get_landmark_points(landmarks, img_w, img_h, regions.RIGHT_EYE)
         
         def expand_pts(pts, dy=40):
             return [(x, y + dy) for (x, y) in pts]
         
-        le_below = ImageProcessor.polygon_mask(image_bgr.shape, expand_pts(left_eye_pts, dy=10))
-        re_below = ImageProcessor.polygon_mask(image_bgr.shape, expand_pts(right_eye_pts, dy=10))
-        
-        left_cheek = ImageProcessor.polygon_mask(image_bgr.shape, 
-                                                ImageProcessor.get_landmark_points(landmarks, img_w, img_h, regions.LEFT_CHEEK))
-        right_cheek = ImageProcessor.polygon_mask(image_bgr.shape,
-                                                 ImageProcessor.get_landmark_points(landmarks, img_w, img_h, regions.RIGHT_CHEEK))
-        
-        mask_eye = le_below.astype(bool) | re_below.astype(bool)
-        mask_cheek = left_cheek.astype(bool) | right_cheek.astype(bool)
+        # Пары полигонов объединяются в одну маску: пиксель на пересечении учитывается один раз
+        polygons = {
+            'eye_below': (expand_pts(left_eye_pts, dy=10), expand_pts(right_eye_pts, dy=10)),
+            'cheeks': (ImageProcessor.get_landmark_points(landmarks, img_w, img_h, regions.LEFT_CHEEK),
+                       ImageProcessor.get_landmark_points(landmarks, img_w, img_h, regions.RIGHT_CHEEK))
+        }
+        
+        eye_regions = {}
+        for name, pts in polygons.items():
+            crop, mask = ImageProcessor.polygon_crop(image_bgr, *pts)
+            eye_regions[name] = {'points': pts, 'crop': crop, 'mask': mask}
+        return eye_regions
+    
+    @staticmethod
+    def region_lab_pixels(region: Dict) -> np.ndarray:
+        # LAB считается только для пикселей внутри маски области и кэшируется для остальных метрик области глаз
+        if 'lab' not in region:
+            if region['crop'] is None:
+                region['lab'] = np.empty((0, 3), dtype=np.uint8)
+            else:
+                pixels = region['crop'][region['mask'].astype(bool)]
+                region['lab'] = ColorConverter.to_lab(pixels.reshape(1, -1, 3)).reshape(-1, 3)
+        return region['lab']
+    
+    @staticmethod
+    def compute_dark_circles(image_bgr: np.ndarray, landmarks, img_w: int, img_h: int, regions: FaceRegions,
+                             eye_regions: Optional[Dict[str, Dict]] = None) -> float:
+        if eye_regions is None:
+            eye_regions = FacialFeatureAnalyzer.extract_eye_regions(image_bgr, landmarks, img_w, img_h, regions)
         
-        lab = ColorConverter.to_lab(image_bgr)
-        L = lab[:,:,0].astype(np.float32)
+        def mean_L(name):
+            L = FacialFeatureAnalyzer.region_lab_pixels(eye_regions[name])[:, 0]
+            return float(L.mean(dtype=np.float64)) if L.size > 0 else 255.0
         
-        mean_eye_L = L[mask_eye].mean() if mask_eye.sum() > 0 else 255.0
-        mean_cheek_L = L[mask_cheek].mean() if mask_cheek.sum() > 0 else 255.0
+        mean_eye_L = mean_L('eye_below')
+        mean_cheek_L = mean_L('cheeks')
         
         diff = (mean_cheek_L - mean_eye_L) / 255.0
         return ImageProcessor.normalize01(diff * 2.0)
     
     @staticmethod
-    def compute_wrinkles(roi_bgr: np.ndarray, skin_mask: Optional[np.ndarray] = None) -> float:
-        gray = cv2.cvtColor(roi_bgr, cv2.COLOR_BGR2GRAY)
-        
-        sobelx = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-        sobely = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-        gradient_magnitude = np.sqrt(sobelx**2 + sobely**2)
-        
-        edges = feature.canny(gray, sigma=1.5, low_threshold=10, high_threshold=30)
+    def compute_wrinkles(roi_bgr: np.ndarray, skin_mask: Optional[np.ndarray] = None,
+                         planes: Optional[DerivativePlanes] = None) -> float:
+        planes = planes if planes is not None else DerivativePlanes(roi_bgr)
+        gradient_magnitude = planes.gradient_magnitude
+        edges = planes.edges
         
         if skin_mask is not None:
-            mask_bool = skin_mask.astype(bool)
-            gradient_magnitude = gradient_magnitude * mask_bool
-            edges = edges & mask_bool
+            ws = current_workspace()
+            mask_bool = ws.mask('wrinkles.mask', skin_mask)
+            grad_sum = np.sum(gradient_magnitude, where=mask_bool, dtype=np.float64)
+            edges = np.logical_and(edges, mask_bool, out=ws.get('wrinkles.edges', edges.shape, np.bool_))
+        else:
+            grad_sum = np.sum(gradient_magnitude, dtype=np.float64)
         
-        grad_score = gradient_magnitude.mean() / 255.0
-        edge_score = edges.sum() / (roi_bgr.shape[0] * roi_bgr.shape[1])
+        grad_score = grad_sum / gradient_magnitude.size / 255.0
+        edge_score = np.count_nonzero(edges) / (roi_bgr.shape[0] * roi_bgr.shape[1])
         
         wrinkle_score = (grad_score * 0.6 + edge_score * 0.4)
         return ImageProcessor.normalize01(wrinkle_score * 3.0)
     
     @staticmethod
-    def compute_texture_roughness(roi_bgr: np.ndarray, skin_mask: Optional[np.ndarray] = None) -> float:
-        gray = cv2.cvtColor(roi_bgr, cv2.COLOR_BGR2GRAY)
+    def compute_texture_roughness(roi_bgr: np.ndarray, skin_mask: Optional[np.ndarray] = None,
+                                  planes: Optional[DerivativePlanes] = None,
+                                  tier: QualityTier = TIERS['full']) -> float:
+        gray = planes.gray if planes is not None else cv2.cvtColor(roi_bgr, cv2.COLOR_BGR2GRAY)
+        gray, skin_mask = tier.scale_plane(gray, skin_mask, tier.lbp_scale)
         
-        lbp = local_binary_pattern(gray, P=24, R=3, method='uniform')
+        points = tier.lbp_points
+        # Коды uniform LBP - целые 0..P+1, гистограмма единичных бинов через bincount
+        lbp = local_binary_pattern(gray, P=points, R=tier.lbp_radius, method='uniform').astype(np.uint8)
         
         if skin_mask is not None:
-            lbp_vals = lbp[skin_mask.astype(bool)]
+            lbp_vals = lbp[current_workspace().mask('texture.mask', skin_mask)]
         else:
             lbp_vals = lbp.reshape(-1)
         
         if lbp_vals.size == 0:
             return 0.0
         
-        hist, _ = np.histogram(lbp_vals, bins=26, range=(0, 26), density=True)
+        hist = np.bincount(lbp_vals, minlength=points + 2) / lbp_vals.size
         roughness = -np.sum(hist * np.log2(hist + 1e-10))
         
         return ImageProcessor.normalize01(roughness / 5.0)
     
     @staticmethod
-    def compute_pore_size(roi_bgr: np.ndarray, skin_mask: Optional[np.ndarray] = None) -> float:
-        gray = cv2.cvtColor(roi_bgr, cv2.COLOR_BGR2GRAY)
-        
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-        enhanced = clahe.apply(gray)
-        
-        blurred = cv2.GaussianBlur(enhanced, (5, 5), 0)
-        morph_grad = cv2.morphologyEx(blurred, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    def compute_pore_size(roi_bgr: np.ndarray, skin_mask: Optional[np.ndarray] = None,
+                          planes: Optional[DerivativePlanes] = None) -> float:
+        planes = planes if planes is not None else DerivativePlanes(roi_bgr)
+        morph_grad = planes.morph_gradient
         
-        _, thresh = cv2.threshold(morph_grad, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        ws = current_workspace()
+        _, thresh = cv2.threshold(morph_grad, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU,
+                                  dst=ws.get('pores.thresh', morph_grad.shape))
         
         if skin_mask is not None:
-            thresh = thresh & (skin_mask * 255)
+            # bitwise_and с маской не трогает пиксели вне маски - буфер обнуляется заранее
+            skin_thresh = ws.get('pores.skin', morph_grad.shape)
+            skin_thresh.fill(0)
+            thresh = cv2.bitwise_and(thresh, thresh, dst=skin_thresh,
+                                     mask=ws.mask('pores.mask', skin_mask).view(np.uint8))
         
         pore_density = thresh.sum() / (roi_bgr.shape[0] * roi_bgr.shape[1] * 255)
         return ImageProcessor.normalize01(pore_density * 8.0)
@@ -23,16 +23,41 @@ class ImageProcessor:
         cv2.fillConvexPoly(mask, pts_arr, 255)
         return mask
     
+    @staticmethod
+    def polygon_crop(img: np.ndarray, *polygons: List[Tuple[int, int]]
+                     ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """Кроп по общей рамке полигонов и маска их объединения (0/1) в координатах кропа."""
+        pts_arrs = [np.array(pts, dtype=np.int32) for pts in polygons]
+        all_pts = np.concatenate(pts_arrs)
+        h, w = img.shape[:2]
+        x0, y0 = max(int(all_pts[:, 0].min()), 0), max(int(all_pts[:, 1].min()), 0)
+        x1, y1 = min(int(all_pts[:, 0].max()), w - 1), min(int(all_pts[:, 1].max()), h - 1)
+        if x0 > x1 or y0 > y1:
+            return None, None
+        mask = np.zeros((y1 - y0 + 1, x1 - x0 + 1), dtype=np.uint8)
+        offset = np.array([x0, y0], dtype=np.int32)
+        for pts_arr in pts_arrs:
+            cv2.fillConvexPoly(mask, pts_arr - offset, 1)
+        return img[y0:y1+1, x0:x1+1], mask
+    
     @staticmethod
     def get_landmark_points(landmarks, img_w: int, img_h: int, idx_list: List[int]) -> List[Tuple[int, int]]:
         return [(int(landmarks[idx].x * img_w), int(landmarks[idx].y * img_h)) for idx in idx_list]
     
+    @staticmethod
+    def mask_bbox(mask_bool: np.ndarray) -> Optional[Tuple[int, int, int, int]]:
+        # boundingRect по маске вместо np.where - без массивов координат int64
+        x, y, w, h = cv2.boundingRect(mask_bool.view(np.uint8) if mask_bool.dtype == bool else mask_bool)
+        if w == 0:
+            return None
+        return x, x + w - 1, y, y + h - 1
+    
     @staticmethod
     def crop_with_mask(img: np.ndarray, mask_bool: np.ndarray) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
-        ys, xs = np.where(mask_bool)
-        if ys.size == 0:
+        bbox = ImageProcessor.mask_bbox(mask_bool)
+        if bbox is None:
             return None, None
-        x0, x1, y0, y1 = xs.min(), xs.max(), ys.min(), ys.max()
+        x0, x1, y0, y1 = bbox
         crop = img[y0:y1+1, x0:x1+1].copy()
         mask_crop = mask_bool[y0:y1+1, x0:x1+1].astype(np.uint8)
         return crop, mask_crop
@@ -0,0 +1,380 @@
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Dict, List, Any
+import atexit
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+# Модули пайплайна, вызовы которых попадают в дерево стадий при trace_calls
+TRACED_MODULES = {'FaceAnalyzer', 'SkinMetrics', 'AcneDetector', 'FacialFeatureAnalyzer',
+                  'ImageProcessor', 'DerivativePlanes', 'SkinSegmentation', 'ColorConverter'}
+# Библиотеки, время которых учитывается по точке входа без внутренних вызовов
+LIBRARY_PACKAGES = {'cv2', 'skimage', 'scipy'}
+PIPELINE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class StageNode:
+    def __init__(self, name: str, parent: Optional['StageNode'] = None):
+        self.name = name
+        self.parent = parent
+        self.children: List['StageNode'] = []
+        self.calls = 0
+        self.duration = 0.0
+        self.mem_base = 0
+        self.mem_peak = 0
+        self._peak_acc = 0
+
+    def child(self, name: str) -> 'StageNode':
+        for node in self.children:
+            if node.name == name:
+                return node
+        node = StageNode(name, self)
+        self.children.append(node)
+        return node
+
+    def to_dict(self, track_memory: bool) -> Dict[str, Any]:
+        result = {'name': self.name, 'calls': self.calls, 'ms': round(self.duration * 1000, 3)}
+        if track_memory:
+            result['peak_mb'] = round(max(self.mem_peak - self.mem_base, 0) / 2**20, 3)
+        if self.children:
+            result['children'] = [node.to_dict(track_memory) for node in self.children]
+        return result
+
+
+_current: ContextVar[Optional['StageRecorder']] = ContextVar('stage_recorder', default=None)
+_node: ContextVar[Optional[StageNode]] = ContextVar('stage_node', default=None)
+
+
+class StageRecorder:
+    """
+    Иерархические замеры времени и пикового объёма памяти (tracemalloc) по стадиям
+    одного запроса. Стадии размечаются функцией stage() в любом модуле пайплайна;
+    без активного рекордера она ничего не делает. tracemalloc и его пик общие на
+    процесс, поэтому запросы с track_memory выполняются по одному: иначе пик
+    стадии включал бы выделения соседних запросов и сбрасывался бы ими. Режим
+    предназначен для диагностики, а не для работы под нагрузкой.
+    """
+
+    _memory_lock = threading.Lock()
+
+    def __init__(self, name: str = 'request', track_memory: bool = False,
+                 trace_calls: bool = False, sampler: Optional['StackSampler'] = None):
+        self.root = StageNode(name)
+        self.track_memory = track_memory
+        self.trace_calls = trace_calls
+        self.sampler = sampler
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def activate(self):
+        if self.track_memory:
+            self._start_memory_tracking()
+        recorder_token = _current.set(self)
+        node_token = _node.set(self.root)
+        start = time.perf_counter()
+        self._enter(self.root)
+        try:
+            with self._thread_hooks():
+                yield self
+        finally:
+            self._exit(self.root, time.perf_counter() - start)
+            _node.reset(node_token)
+            _current.reset(recorder_token)
+            if self.track_memory:
+                self._stop_memory_tracking()
+
+    @contextmanager
+    def stage(self, name: str):
+        with self._thread_hooks():
+            node, token = self._open(name)
+            start = time.perf_counter()
+            try:
+                yield node
+            finally:
+                self._close(node, token, start)
+
+    def _open(self, name: str):
+        parent = _node.get() or self.root
+        with self._lock:
+            node = parent.child(name)
+        token = _node.set(node)
+        self._enter(node)
+        return node, token
+
+    def _close(self, node: StageNode, token, start: float) -> None:
+        self._exit(node, time.perf_counter() - start)
+        _node.reset(token)
+
+    @contextmanager
+    def _thread_hooks(self):
+        # Стадии могут выполняться в потоках пула метрик - хук трассировки и
+        # регистрация в сэмплере ставятся на каждый поток отдельно
+        tracer = None
+        if self.trace_calls and not isinstance(sys.getprofile(), _CallTracer):
+            tracer = _CallTracer(self)
+            sys.setprofile(tracer)
+        ident = threading.get_ident()
+        if self.sampler is not None:
+            self.sampler.register(ident, self.root.name)
+        try:
+            yield
+        finally:
+            if self.sampler is not None:
+                self.sampler.unregister(ident)
+            if tracer is not None:
+                sys.setprofile(None)
+                tracer.close()
+
+    def _enter(self, node: StageNode) -> None:
+        node.calls += 1
+        if not self.track_memory:
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        if node.parent is not None:
+            node.parent._peak_acc = max(node.parent._peak_acc, peak)
+        node.mem_base = current if node.calls == 1 else min(node.mem_base, current)
+        node._peak_acc = current
+        tracemalloc.reset_peak()
+
+    def _exit(self, node: StageNode, elapsed: float) -> None:
+        node.duration += elapsed
+        if not self.track_memory:
+            return
+        peak = max(tracemalloc.get_traced_memory()[1], node._peak_acc)
+        node.mem_peak = max(node.mem_peak, peak)
+        if node.parent is not None:
+            node.parent._peak_acc = max(node.parent._peak_acc, peak)
+        tracemalloc.reset_peak()
+
+    def _start_memory_tracking(self) -> None:
+        self._memory_lock.acquire()
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+
+    def _stop_memory_tracking(self) -> None:
+        if self._started_tracing:
+            tracemalloc.stop()
+        self._memory_lock.release()
+
+    def report(self) -> Dict[str, Any]:
+        return self.root.to_dict(self.track_memory)
+
+    def flat(self) -> Dict[str, Dict[str, float]]:
+        result = {}
+
+        def walk(node: StageNode, prefix: str):
+            path = f"{prefix}/{node.name}" if prefix else node.name
+            entry = {'ms': round(node.duration * 1000, 3)}
+            if self.track_memory:
+                entry['peak_mb'] = round(max(node.mem_peak - node.mem_base, 0) / 2**20, 3)
+            result[path] = entry
+            for child in node.children:
+                walk(child, path)
+
+        walk(self.root, '')
+        return result
+
+
+def _module_name(frame) -> str:
+    return frame.f_globals.get('__name__', '')
+
+
+def _qualname(frame) -> str:
+    code = frame.f_code
+    qualname = getattr(code, 'co_qualname', None)
+    if qualname is not None:
+        return qualname
+    # Python 3.10: co_qualname нет - класс берётся из self/cls, у статических методов остаётся только имя
+    owner = frame.f_locals.get('self', frame.f_locals.get('cls')) if code.co_argcount else None
+    if owner is not None:
+        cls = owner if isinstance(owner, type) else type(owner)
+        return f"{cls.__name__}.{code.co_name}"
+    return code.co_name
+
+
+def _native_name(func) -> Optional[str]:
+    owner = getattr(func, '__self__', None)
+    if owner is None:
+        cv2 = sys.modules.get('cv2')
+        name = getattr(func, '__name__', '')
+        if cv2 is not None and getattr(cv2, name, None) is func:
+            return 'cv2.' + name
+        return None
+    if type(owner).__module__ == 'cv2':
+        return 'cv2.' + func.__qualname__
+    return None
+
+
+class _CallTracer:
+    """
+    Профилировочный хук (sys.setprofile) одного потока: каждый вызов модулей
+    пайплайна и каждая точка входа в OpenCV/skimage/scipy открывают стадию
+    активного рекордера.
+    """
+
+    def __init__(self, recorder: StageRecorder):
+        self.recorder = recorder
+        self.stack = []
+        self.library_depth = 0
+
+    def __call__(self, frame, event, arg):
+        if event == 'call':
+            module = _module_name(frame)
+            package = module.partition('.')[0]
+            if package in LIBRARY_PACKAGES:
+                if self.library_depth == 0:
+                    self._push(frame, f"{module}.{_qualname(frame)}", library=True)
+            elif module in TRACED_MODULES and self.library_depth == 0:
+                name = _qualname(frame)
+                if '<' not in name:
+                    self._push(frame, name)
+        elif event == 'return':
+            self._pop(frame)
+        elif event == 'c_call':
+            if self.library_depth == 0:
+                name = _native_name(arg)
+                if name is not None:
+                    self._push(arg, name, library=True)
+        elif event in ('c_return', 'c_exception'):
+            self._pop(arg)
+
+    def _push(self, key, name: str, library: bool = False) -> None:
+        node, token = self.recorder._open(name)
+        self.stack.append((key, node, token, time.perf_counter(), library))
+        if library:
+            self.library_depth += 1
+
+    def _pop(self, key) -> None:
+        if not self.stack or self.stack[-1][0] is not key:
+            return
+        _, node, token, start, library = self.stack.pop()
+        self.recorder._close(node, token, start)
+        if library:
+            self.library_depth -= 1
+
+    def close(self) -> None:
+        while self.stack:
+            self._pop(self.stack[-1][0])
+
+
+class StackSampler:
+    """
+    Статистический профилировщик: фоновый поток раз в interval секунд снимает
+    стеки зарегистрированных потоков и агрегирует их в формате folded stacks
+    (flamegraph.pl, speedscope). Накопленное периодически дописывается в файл
+    stacks-<pid>.folded в output_dir.
+    """
+
+    def __init__(self, output_dir: str, interval: float = 0.01, flush_interval: float = 30.0):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.path = os.path.join(output_dir, f"stacks-{os.getpid()}.folded")
+        self.counts: Counter = Counter()
+        self._threads: Dict[int, List] = {}
+        self._cond = threading.Condition()
+        self._last_flush = time.monotonic()
+        self._thread = None
+
+    def register(self, ident: int, root: str) -> None:
+        with self._cond:
+            entry = self._threads.setdefault(ident, [root, 0])
+            entry[1] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+            self._cond.notify()
+
+    def unregister(self, ident: int) -> None:
+        with self._cond:
+            entry = self._threads.get(ident)
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del self._threads[ident]
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._threads:
+                    self._cond.wait(self.flush_interval)
+                    if not self._threads and self.counts:
+                        self._flush_locked()
+                threads = {ident: entry[0] for ident, entry in self._threads.items()}
+            frames = sys._current_frames()
+            samples = [self._fold(frames[ident], root) for ident, root in threads.items() if ident in frames]
+            with self._cond:
+                self.counts.update(samples)
+                if time.monotonic() - self._last_flush >= self.flush_interval:
+                    self._flush_locked()
+            time.sleep(self.interval)
+
+    @staticmethod
+    def _fold(frame, root: str) -> str:
+        frames = []
+        while frame is not None:
+            frames.append(frame)
+            frame = frame.f_back
+        frames.reverse()
+        stack = [root]
+        started = False
+        for frame in frames:
+            code = frame.f_code
+            pipeline = os.path.dirname(os.path.abspath(code.co_filename)) == PIPELINE_DIR
+            # Фреймы сервера (werkzeug, flask) до первого вызова пайплайна отбрасываются
+            if not started:
+                started = pipeline and code.co_name != '<module>'
+                if not started:
+                    continue
+            if pipeline:
+                module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            else:
+                module = _module_name(frame)
+            stack.append(f"{module}.{_qualname(frame)}")
+            if module.partition('.')[0] in LIBRARY_PACKAGES:
+                break
+        return ';'.join(stack)
+
+    def flush(self) -> None:
+        with self._cond:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self.counts:
+            return
+        merged = Counter()
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    stack, _, count = line.rstrip('\n').rpartition(' ')
+                    if stack and count.isdigit():
+                        merged[stack] += int(count)
+        merged.update(self.counts)
+        self.counts.clear()
+        os.makedirs(self.output_dir, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for stack, count in merged.most_common():
+                f.write(f"{stack} {count}\n")
+        os.replace(tmp_path, self.path)
+
+
+@contextmanager
+def stage(name: str):
+    recorder = _current.get()
+    if recorder is None:
+        yield None
+        return
+    with recorder.stage(name) as node:
+        yield node
+
+
+def current_recorder() -> Optional[StageRecorder]:
+    return _current.get()
@@ -0,0 +1,371 @@
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import urllib.request
+import uuid
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    options TEXT NOT NULL,
+    callback_url TEXT,
+    image BLOB,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    finished_at REAL,
+    result TEXT,
+    result_status INTEGER,
+    error TEXT,
+    callback_status TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, available_at);
+"""
+
+FINISHED_STATUSES = ('done', 'failed')
+
+
+class QueueFull(Exception):
+    pass
+
+
+class LeaseLost(Exception):
+    """Задание уже забрано другой попыткой после истечения аренды или завершено."""
+    pass
+
+
+class JobQueue:
+    """
+    Персистентная очередь заданий анализа в SQLite. Задание хранит байты снимка
+    и параметры анализа до завершения, затем - только результат. Обработчик
+    забирает задание с арендой на lease_seconds и продлевает её, пока задание
+    в работе: если процесс упал посреди анализа, по истечении аренды задание
+    снова становится доступным. Итог записывается только той попыткой, которая
+    держит аренду (attempts совпадает) - опоздавшая попытка получает LeaseLost. Число
+    попыток ограничено max_attempts, повторы идут с экспоненциальной задержкой.
+    Завершённые задания удаляются через retention_hours.
+    """
+    RETRY_BACKOFF_S = 5.0
+    PURGE_INTERVAL_S = 60.0
+
+    def __init__(self, path: Optional[str] = None, max_attempts: Optional[int] = None,
+                 lease_seconds: Optional[float] = None, retention_hours: Optional[float] = None,
+                 max_pending: Optional[int] = None):
+        if path is None:
+            path = os.environ.get('ML_JOBS_DB') or os.path.join(os.path.dirname(__file__), 'jobs', 'jobs.sqlite3')
+        if max_attempts is None:
+            max_attempts = int(os.environ.get('ML_JOB_MAX_ATTEMPTS', '3'))
+        if lease_seconds is None:
+            lease_seconds = float(os.environ.get('ML_JOB_LEASE_S', '300'))
+        if retention_hours is None:
+            retention_hours = float(os.environ.get('ML_JOB_RETENTION_H', '24'))
+        if max_pending is None:
+            max_pending = int(os.environ.get('ML_JOB_MAX_PENDING', '1000'))
+        self.path = path
+        self.max_attempts = max(1, max_attempts)
+        self.lease_seconds = lease_seconds
+        self.retention_seconds = retention_hours * 3600
+        self.max_pending = max_pending
+        self._local = threading.local()
+        self._last_purge = 0.0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection().executescript(_SCHEMA)
+
+    def submit(self, image: bytes, options: Dict[str, Any], callback_url: Optional[str] = None) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        db = self._connection()
+        with _transaction(db):
+            if self.max_pending > 0:
+                pending = db.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+                if pending >= self.max_pending:
+                    raise QueueFull(f"{pending} jobs pending")
+            db.execute("INSERT INTO jobs (id, status, options, callback_url, image, available_at, created_at, "
+                       "updated_at) VALUES (?, 'queued', ?, ?, ?, ?, ?, ?)",
+                       (job_id, json.dumps(options), callback_url, sqlite3.Binary(image), now, now, now))
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute(
+            "SELECT id, status, options, callback_url, attempts, created_at, updated_at, finished_at, result, "
+            "result_status, error, callback_status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['options'] = json.loads(job['options'])
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        return job
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """Следующее готовое задание (вместе с байтами снимка) или None; attempts уже увеличен."""
+        now = time.time()
+        if now - self._last_purge > self.PURGE_INTERVAL_S:
+            self._last_purge = now
+            self._purge(now)
+        db = self._connection()
+        with _transaction(db):
+            # Задания в работе с истёкшей арендой - от упавшего или перезапущенного обработчика
+            row = db.execute(
+                "SELECT id, options, callback_url, image, attempts FROM jobs "
+                "WHERE (status = 'queued' AND available_at <= ?) OR (status = 'running' AND lease_until <= ?) "
+                "ORDER BY available_at LIMIT 1", (now, now)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, "
+                       "updated_at = ? WHERE id = ?", (now + self.lease_seconds, now, row['id']))
+        job = dict(row)
+        job['attempts'] += 1
+        job['options'] = json.loads(job['options'])
+        return job
+
+    def renew(self, job_id: str, attempts: int) -> bool:
+        """Продлевает аренду попытки attempts; False - задание ей больше не принадлежит."""
+        db = self._connection()
+        with _transaction(db):
+            cursor = db.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND attempts = ? AND status = 'running'",
+                                (time.time() + self.lease_seconds, job_id, attempts))
+        return cursor.rowcount > 0
+
+    def finish(self, job_id: str, attempts: int, status: str, result: Optional[Dict[str, Any]] = None,
+               result_status: Optional[int] = None, error: Optional[str] = None) -> None:
+        now = time.time()
+        db = self._connection()
+        with _transaction(db):
+            cursor = db.execute(
+                "UPDATE jobs SET status = ?, result = ?, result_status = ?, error = ?, image = NULL, "
+                "lease_until = NULL, updated_at = ?, finished_at = ? WHERE id = ? AND attempts = ? AND status = 'running'",
+                (status, json.dumps(result) if result is not None else None, result_status, error,
+                 now, now, job_id, attempts))
+        if cursor.rowcount == 0:
+            raise LeaseLost(job_id)
+
+    def retry(self, job_id: str, attempts: int, error: str) -> bool:
+        """Возвращает задание в очередь с задержкой; False - попытки исчерпаны и задание завершено."""
+        if attempts >= self.max_attempts:
+            self.finish(job_id, attempts, 'failed', error=error)
+            return False
+        now = time.time()
+        db = self._connection()
+        with _transaction(db):
+            cursor = db.execute("UPDATE jobs SET status = 'queued', error = ?, lease_until = NULL, available_at = ?, "
+                                "updated_at = ? WHERE id = ? AND attempts = ? AND status = 'running'",
+                                (error, now + self.RETRY_BACKOFF_S * 2 ** (attempts - 1), now, job_id, attempts))
+        if cursor.rowcount == 0:
+            raise LeaseLost(job_id)
+        return True
+
+    def set_callback_status(self, job_id: str, callback_status: str) -> None:
+        db = self._connection()
+        with _transaction(db):
+            db.execute("UPDATE jobs SET callback_status = ? WHERE id = ?", (callback_status, job_id))
+
+    def stats(self) -> Dict[str, int]:
+        rows = self._connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {status: 0 for status in ('queued', 'running') + FINISHED_STATUSES}
+        counts.update({row[0]: row[1] for row in rows})
+        return counts
+
+    def _purge(self, now: float) -> None:
+        db = self._connection()
+        with _transaction(db):
+            db.execute("DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                       FINISHED_STATUSES + (now - self.retention_seconds,))
+
+    def _connection(self) -> sqlite3.Connection:
+        # Соединение sqlite3 нельзя использовать из нескольких потоков - по соединению на поток
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+@contextmanager
+def _transaction(db: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    # BEGIN IMMEDIATE берёт блокировку на запись сразу - выбор и захват задания атомарны
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield db
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+
+
+def iso_time(timestamp: Optional[float]) -> Optional[str]:
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec='seconds')
+
+
+def validate_callback_url(url: str, allowed_hosts: Optional[List[str]] = None) -> Optional[str]:
+    """Текст ошибки или None, если адрес обратного вызова допустим."""
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        return "Callback URL must be an absolute http(s) URL"
+    if allowed_hosts is None:
+        allowed_hosts = [h.strip().lower() for h in os.environ.get('ML_JOB_CALLBACK_HOSTS', '').split(',') if h.strip()]
+    # Без списка хостов обратные вызовы выключены: иначе сервис можно заставить слать запросы по любому адресу
+    if not allowed_hosts:
+        return "Callbacks are disabled (ML_JOB_CALLBACK_HOSTS is not set)"
+    if parsed.hostname.lower() not in allowed_hosts:
+        return "Callback host is not allowed"
+    return None
+
+
+class _RefuseRedirects(urllib.request.HTTPRedirectHandler):
+    # Переадресация увела бы POST на хост вне ML_JOB_CALLBACK_HOSTS - 3xx считается ошибкой доставки
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class JobWorkers:
+    """
+    Потоки-обработчики очереди. handler(job) возвращает (payload, http_status)
+    так же, как синхронный /analyze: 2xx и 4xx - окончательный результат,
+    5xx и исключения - повтор в пределах max_attempts. После завершения задания
+    с callback_url туда отправляется POST с JSON из describe(job_id) без
+    следования переадресациям; исход доставки записывается в callback_status,
+    повторов доставки нет - результат
+    всегда можно забрать через GET.
+    """
+    POLL_INTERVAL_S = 1.0
+
+    def __init__(self, queue: JobQueue, handler: Callable[[Dict[str, Any]], Tuple[Dict[str, Any], int]],
+                 describe: Callable[[str], Optional[Dict[str, Any]]], workers: Optional[int] = None,
+                 callback_timeout: Optional[float] = None):
+        if workers is None:
+            workers = int(os.environ.get('ML_JOB_WORKERS', '1'))
+        if callback_timeout is None:
+            callback_timeout = float(os.environ.get('ML_JOB_CALLBACK_TIMEOUT_S', '10'))
+        self.queue = queue
+        self.handler = handler
+        self.describe = describe
+        self.workers = workers
+        self.callback_timeout = callback_timeout
+        self._opener = urllib.request.build_opener(_RefuseRedirects)
+        self._wake = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        print(f"🧵 Started {self.workers} job worker(s), queue: {self.queue.path}")
+
+    def notify(self) -> None:
+        """Будит обработчики сразу после постановки задания, не дожидаясь опроса."""
+        self._wake.set()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                job = self.queue.claim()
+            except sqlite3.Error as e:
+                print(f"❌ Job queue error: {e}")
+                job = None
+            if job is None:
+                self._wake.wait(self.POLL_INTERVAL_S)
+                self._wake.clear()
+                continue
+            try:
+                self._process(job)
+            except Exception:
+                # Задание останется running и вернётся в очередь по истечении аренды
+                traceback.print_exc()
+
+    def _process(self, job: Dict[str, Any]) -> None:
+        job_id, attempts = job['id'], job['attempts']
+        if attempts > self.queue.max_attempts:
+            # Аренда истекла на последней попытке - обработчик падал на этом снимке
+            print(f"❌ Job {job_id}: attempt limit reached")
+            try:
+                self.queue.finish(job_id, attempts, 'failed', error="Attempt limit reached")
+            except LeaseLost:
+                return
+            self._send_callback(job)
+            return
+
+        print(f"🔄 Job {job_id}: attempt {attempts}/{self.queue.max_attempts}")
+        try:
+            with self._lease(job):
+                payload, status = self.handler(job)
+            error = payload.get('error') if status >= 500 else None
+        except Exception as e:
+            traceback.print_exc()
+            payload, status, error = None, None, str(e)
+
+        try:
+            if status is not None and status < 500:
+                self.queue.finish(job_id, attempts, 'done' if status < 400 else 'failed', payload, status,
+                                  payload.get('error') if status >= 400 else None)
+                print(f"✅ Job {job_id} finished ({status})")
+            elif self.queue.retry(job_id, attempts, error or f"HTTP {status}"):
+                print(f"⚠️ Job {job_id} will be retried: {error}")
+                return
+            else:
+                print(f"❌ Job {job_id} failed after {attempts} attempts: {error}")
+        except LeaseLost:
+            # Аренда не продлилась (например, база была недоступна) и задание забрала другая попытка
+            print(f"⚠️ Job {job_id}: attempt {attempts} lost its lease, result discarded")
+            return
+        self._send_callback(job)
+
+    @contextmanager
+    def _lease(self, job: Dict[str, Any]) -> Iterator[None]:
+        # Аренда продлевается, пока работает обработчик - в том числе пока он ждёт слот полного анализа
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(self.queue.lease_seconds / 3):
+                try:
+                    if not self.queue.renew(job['id'], job['attempts']):
+                        return
+                except sqlite3.Error as e:
+                    print(f"❌ Job {job['id']}: lease renewal failed: {e}")
+
+        thread = threading.Thread(target=renew, name=f"job-lease-{job['id'][:8]}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def _send_callback(self, job: Dict[str, Any]) -> None:
+        url = job.get('callback_url')
+        if not url:
+            return
+        # Список хостов мог измениться после постановки задания (перезапуск с другим окружением)
+        callback_error = validate_callback_url(url)
+        if callback_error is not None:
+            callback_status = f"refused: {callback_error}"
+        else:
+            body = json.dumps(self.describe(job['id']), ensure_ascii=False).encode('utf-8')
+            req = urllib.request.Request(url, data=body, method='POST',
+                                         headers={'Content-Type': 'application/json'})
+            try:
+                with self._opener.open(req, timeout=self.callback_timeout) as resp:
+                    callback_status = f"delivered ({resp.status})"
+            except Exception as e:
+                callback_status = f"failed: {e}"
+        print(f"📮 Job {job['id']} callback {callback_status}")
+        self.queue.set_callback_status(job['id'], callback_status)
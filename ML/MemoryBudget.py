@@ -0,0 +1,85 @@
+from typing import Optional, Tuple, Dict, Any
+import io
+import os
+import numpy as np
+import cv2
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class MemoryBudget:
+    """
+    Бюджет памяти на один запрос. Масштаб декодирования и разрешение анализа
+    выбираются заранее по размеру кадра, а не после нехватки памяти посреди пайплайна.
+    """
+    # Пик по StageRecorder(track_memory=True) - около 36-43 байт на пиксель кадра;
+    # запас покрывает сам декодированный кадр и нативные буферы OpenCV/MediaPipe
+    BYTES_PER_PIXEL = 64
+    DECODE_FLAGS = [
+        (8, cv2.IMREAD_REDUCED_COLOR_8),
+        (4, cv2.IMREAD_REDUCED_COLOR_4),
+        (2, cv2.IMREAD_REDUCED_COLOR_2)
+    ]
+
+    def __init__(self, budget_mb: Optional[float] = None):
+        if budget_mb is None:
+            budget_mb = float(os.environ.get('ML_MEMORY_BUDGET_MB', '0'))
+        self.budget_bytes = int(budget_mb * 2**20) if budget_mb > 0 else 0
+
+    @property
+    def max_pixels(self) -> Optional[int]:
+        return self.budget_bytes // self.BYTES_PER_PIXEL if self.budget_bytes else None
+
+    def estimate_bytes(self, w: int, h: int) -> int:
+        return w * h * self.BYTES_PER_PIXEL
+
+    def analysis_scale(self, w: int, h: int) -> float:
+        max_pixels = self.max_pixels
+        if max_pixels is None or w * h <= max_pixels:
+            return 1.0
+        return float(np.sqrt(max_pixels / float(w * h)))
+
+    def decode_reduction(self, w: int, h: int) -> Tuple[int, int]:
+        # Самое сильное уменьшение при декодировании, после которого кадр всё ещё не меньше целевого
+        max_pixels = self.max_pixels
+        if max_pixels is not None:
+            for factor, flag in self.DECODE_FLAGS:
+                if (w // factor) * (h // factor) >= max_pixels:
+                    return factor, flag
+        return 1, cv2.IMREAD_COLOR
+
+    @staticmethod
+    def image_size(data: bytes) -> Optional[Tuple[int, int]]:
+        if Image is None:
+            return None
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                return img.size
+        except Exception:
+            return None
+
+    def decode(self, data: bytes) -> Optional[np.ndarray]:
+        size = self.image_size(data)
+        flag = self.decode_reduction(*size)[1] if size is not None else cv2.IMREAD_COLOR
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+        if img is None:
+            return None
+        return self.fit(img)
+
+    def fit(self, img_bgr: np.ndarray) -> np.ndarray:
+        h, w = img_bgr.shape[:2]
+        scale = self.analysis_scale(w, h)
+        if scale >= 1.0:
+            return img_bgr
+        size = (max(1, int(w * scale)), max(1, int(h * scale)))
+        return cv2.resize(img_bgr, size, interpolation=cv2.INTER_AREA)
+
+    def describe(self, w: int, h: int) -> Dict[str, Any]:
+        return {
+            'budget_mb': round(self.budget_bytes / 2**20, 1) if self.budget_bytes else None,
+            'estimated_mb': round(self.estimate_bytes(w, h) / 2**20, 1),
+            'analysis_size': [w, h]
+        }
@@ -0,0 +1,85 @@
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+import os
+import threading
+import numpy as np
+import cv2
+
+
+class OverlayCache:
+    """
+    LRU-хранилище для отложенной отрисовки разметки по analysis_id. После анализа
+    сохраняются уменьшенный кадр, ориентиры и метрики. Первый запрос разметки
+    рисует её и кодирует в JPEG один раз, после чего кадр освобождается и в кэше
+    остаётся только JPEG. Вытеснение идёт по суммарному объёму в байтах.
+    """
+    MAX_SIDE = 640
+    JPEG_QUALITY = 85
+
+    def __init__(self, max_mb: Optional[float] = None):
+        if max_mb is None:
+            max_mb = float(os.environ.get('ML_OVERLAY_CACHE_MB', '64'))
+        self.max_bytes = int(max_mb * 2**20)
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, analysis_id: str, img_bgr: np.ndarray, landmarks_xy: np.ndarray,
+            metrics: Dict[str, float]) -> None:
+        if self.max_bytes <= 0:
+            return
+        h, w = img_bgr.shape[:2]
+        if max(h, w) > self.MAX_SIDE:
+            scale = self.MAX_SIDE / float(max(h, w))
+            frame = cv2.resize(img_bgr, (max(1, int(w * scale)), max(1, int(h * scale))),
+                               interpolation=cv2.INTER_AREA)
+        else:
+            frame = img_bgr.copy()
+        entry = {'frame': frame, 'landmarks': landmarks_xy, 'metrics': dict(metrics), 'jpeg': None}
+        with self._lock:
+            self._store(analysis_id, entry)
+
+    def get_jpeg(self, analysis_id: str,
+                 render: Callable[[np.ndarray, np.ndarray, Dict[str, float]], np.ndarray]) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(analysis_id)
+            if entry is None:
+                return None
+            self._entries.move_to_end(analysis_id)
+            if entry['jpeg'] is not None:
+                return entry['jpeg']
+            frame, landmarks, metrics = entry['frame'], entry['landmarks'], entry['metrics']
+
+        # Отрисовка вне блокировки; при гонке двух запросов лишний JPEG просто отбрасывается
+        vis = render(frame, landmarks, metrics)
+        ok, buf = cv2.imencode('.jpg', vis, [cv2.IMWRITE_JPEG_QUALITY, self.JPEG_QUALITY])
+        if not ok:
+            return None
+        jpeg = buf.tobytes()
+
+        with self._lock:
+            entry = self._entries.get(analysis_id)
+            if entry is not None and entry['jpeg'] is None:
+                self._store(analysis_id, {'frame': None, 'landmarks': None, 'metrics': None, 'jpeg': jpeg})
+        return jpeg
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {'entries': len(self._entries), 'mb': round(self._bytes / 2**20, 2),
+                    'max_mb': round(self.max_bytes / 2**20, 2)}
+
+    @staticmethod
+    def _size(entry: Dict) -> int:
+        if entry['jpeg'] is not None:
+            return len(entry['jpeg'])
+        return entry['frame'].nbytes + entry['landmarks'].nbytes
+
+    def _store(self, analysis_id: str, entry: Dict) -> None:
+        old = self._entries.pop(analysis_id, None)
+        if old is not None:
+            self._bytes -= self._size(old)
+        self._entries[analysis_id] = entry
+        self._bytes += self._size(entry)
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= self._size(evicted)
@@ -0,0 +1,161 @@
+from typing import Dict, List, Optional, Tuple, Any
+import math
+import os
+import threading
+import time
+import numpy as np
+import cv2
+
+try:
+    from mediapipe.solutions import face_detection as mp_face_detection
+except ImportError:
+    mp_face_detection = None
+
+
+class QualityGate:
+    """
+    Дешёвая проверка качества снимка до полного анализа. Все проверки выполняются
+    на миниатюре (~256 px) и занимают единицы миллисекунд.
+
+    Коды причин (reasons[].code): too_dark, overexposed, blurry, no_face,
+    face_too_small, multiple_faces. Severity 'reject' - снимок непригоден для анализа,
+    'warn' - анализ выполняется, но результат может быть неточным.
+    """
+    THUMBNAIL_SIDE = 256
+    DARK_LEVEL = 16
+    BRIGHT_LEVEL = 240
+
+    # (метрика, порог отклонения, порог предупреждения)
+    MIN_BRIGHTNESS = (40.0, 70.0)
+    MAX_DARK_FRACTION = (0.5, 0.25)
+    MAX_BRIGHTNESS = (225.0, 200.0)
+    MAX_BRIGHT_FRACTION = (0.35, 0.15)
+    # Дисперсия лапласиана после растяжения контраста, чтобы тёмные снимки не считались размытыми
+    MIN_SHARPNESS = (15.0, 40.0)
+    MIN_FACE_FRACTION = (0.02, 0.06)
+
+    MODES = ('reject', 'flag', 'off')
+
+    def __init__(self, mode: Optional[str] = None):
+        # По умолчанию flag: пороги освещённости отклоняли обычные селфи в помещении
+        mode = mode or os.environ.get('ML_QUALITY_GATE', 'flag')
+        self.mode = mode if mode in self.MODES else 'flag'
+        self._local = threading.local()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != 'off'
+
+    def check(self, img_bgr: np.ndarray) -> Dict[str, Any]:
+        start = time.perf_counter()
+        thumb = self.thumbnail(img_bgr)
+        gray = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY)
+
+        checks = self._exposure(gray)
+        checks['sharpness'] = self._sharpness(gray, checks.pop('_p1'), checks.pop('_p99'))
+
+        reasons = []
+        self._check_min(reasons, 'too_dark', 'brightness', checks['brightness'], self.MIN_BRIGHTNESS)
+        self._check_max(reasons, 'too_dark', 'dark_fraction', checks['dark_fraction'], self.MAX_DARK_FRACTION)
+        self._check_max(reasons, 'overexposed', 'brightness', checks['brightness'], self.MAX_BRIGHTNESS)
+        self._check_max(reasons, 'overexposed', 'bright_fraction', checks['bright_fraction'],
+                        self.MAX_BRIGHT_FRACTION)
+        self._check_min(reasons, 'blurry', 'sharpness', checks['sharpness'], self.MIN_SHARPNESS)
+
+        # Детектор лица - самая дорогая проверка, для уже отклонённого снимка не нужен
+        if not any(r['severity'] == 'reject' for r in reasons):
+            faces = self._detect_faces(thumb, gray)
+            if faces is not None:
+                checks['faces'] = len(faces)
+                checks['face_fraction'] = round(max(faces, default=0.0), 4)
+                if not faces:
+                    reasons.append({'code': 'no_face', 'severity': 'reject', 'metric': 'faces',
+                                    'value': 0, 'threshold': 1})
+                else:
+                    self._check_min(reasons, 'face_too_small', 'face_fraction', checks['face_fraction'],
+                                    self.MIN_FACE_FRACTION)
+                    if len(faces) > 1:
+                        reasons.append({'code': 'multiple_faces', 'severity': 'warn', 'metric': 'faces',
+                                        'value': len(faces), 'threshold': 1})
+
+        rejected = any(r['severity'] == 'reject' for r in reasons)
+        return {
+            'passed': not rejected,
+            'mode': self.mode,
+            'reasons': reasons,
+            'checks': checks,
+            'ms': round((time.perf_counter() - start) * 1000, 2)
+        }
+
+    def should_reject(self, result: Dict[str, Any]) -> bool:
+        return self.mode == 'reject' and not result['passed']
+
+    def thumbnail(self, img_bgr: np.ndarray) -> np.ndarray:
+        h, w = img_bgr.shape[:2]
+        factor = math.ceil(max(h, w) / self.THUMBNAIL_SIDE)
+        if factor <= 1:
+            return img_bgr
+        # Целый коэффициент - быстрый путь INTER_AREA
+        return cv2.resize(img_bgr, None, fx=1.0 / factor, fy=1.0 / factor, interpolation=cv2.INTER_AREA)
+
+    def _exposure(self, gray: np.ndarray) -> Dict[str, float]:
+        hist = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel() / gray.size
+        cdf = np.cumsum(hist)
+        return {
+            'brightness': round(float(np.dot(hist, np.arange(256))), 2),
+            'dark_fraction': round(float(cdf[self.DARK_LEVEL - 1]), 4),
+            'bright_fraction': round(max(float(1.0 - cdf[self.BRIGHT_LEVEL - 1]), 0.0), 4),
+            '_p1': int(np.searchsorted(cdf, 0.01)),
+            '_p99': int(np.searchsorted(cdf, 0.99))
+        }
+
+    @staticmethod
+    def _sharpness(gray: np.ndarray, p1: int, p99: int) -> float:
+        stretch = 255.0 / max(p99 - p1, 1)
+        variance = float(cv2.Laplacian(gray, cv2.CV_32F).var()) * stretch ** 2
+        return round(variance, 2)
+
+    @staticmethod
+    def _check_min(reasons: List[Dict], code: str, metric: str, value: float, limits: Tuple[float, float]):
+        reject, warn = limits
+        if value < reject:
+            reasons.append({'code': code, 'severity': 'reject', 'metric': metric, 'value': value, 'threshold': reject})
+        elif value < warn:
+            reasons.append({'code': code, 'severity': 'warn', 'metric': metric, 'value': value, 'threshold': warn})
+
+    @staticmethod
+    def _check_max(reasons: List[Dict], code: str, metric: str, value: float, limits: Tuple[float, float]):
+        reject, warn = limits
+        if value > reject:
+            reasons.append({'code': code, 'severity': 'reject', 'metric': metric, 'value': value, 'threshold': reject})
+        elif value > warn:
+            reasons.append({'code': code, 'severity': 'warn', 'metric': metric, 'value': value, 'threshold': warn})
+
+    def _detect_faces(self, thumb_bgr: np.ndarray, gray: np.ndarray) -> Optional[List[float]]:
+        """Доли площади миниатюры под найденными лицами; None, если детектор недоступен."""
+        detector = self._detector()
+        if detector is None:
+            return None
+        if mp_face_detection is not None:
+            results = detector.process(cv2.cvtColor(thumb_bgr, cv2.COLOR_BGR2RGB))
+            return [d.location_data.relative_bounding_box.width * d.location_data.relative_bounding_box.height
+                    for d in (results.detections or [])]
+        faces = detector.detectMultiScale(cv2.equalizeHist(gray), scaleFactor=1.1, minNeighbors=4, minSize=(20, 20))
+        return [float(fw * fh) / gray.size for _, _, fw, fh in faces]
+
+    def _detector(self):
+        # Детекторы MediaPipe и каскады OpenCV не потокобезопасны - по экземпляру на поток
+        if not hasattr(self._local, 'detector'):
+            self._local.detector = self._create_detector()
+        return self._local.detector
+
+    @staticmethod
+    def _create_detector():
+        if mp_face_detection is not None:
+            return mp_face_detection.FaceDetection(model_selection=1, min_detection_confidence=0.5)
+        cascade_dir = getattr(getattr(cv2, 'data', None), 'haarcascades', '')
+        cascade_path = os.path.join(cascade_dir, 'haarcascade_frontalface_default.xml')
+        if not os.path.exists(cascade_path):
+            return None
+        cascade = cv2.CascadeClassifier(cascade_path)
+        return None if cascade.empty() else cascade
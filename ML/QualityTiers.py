@@ -0,0 +1,84 @@
+from dataclasses import dataclass, asdict
+from typing import Dict, Optional, Tuple, Union, Sequence, Any
+import json
+import os
+import numpy as np
+import cv2
+
+
+@dataclass(frozen=True)
+class QualityTier:
+    """
+    Набор вариантов алгоритмов для одного уровня качества анализа.
+    full     - эталонные реализации;
+    balanced - локальная дисперсия через box-фильтры вместо generic_filter (почти тот же результат:
+               расходятся единичные пиксели, где generic_filter усекает 3.999... до 3);
+    fast     - как balanced, плюс LBP текстуры P=24 R=2 в половинном разрешении и квантили
+               по прореженной выборке. Кропы акне и остальной текстуры остаются в полном
+               разрешении: в половинном ошибка acne_spots и pore_size доходила до 0.3-0.7.
+    """
+    name: str
+    exact_local_variance: bool = True
+    lbp_points: int = 24
+    lbp_radius: int = 3
+    lbp_scale: float = 1.0
+    quantile_stride: int = 1
+
+    def percentile(self, values: np.ndarray, q: Union[float, Sequence[float]]):
+        if self.quantile_stride > 1 and values.size > self.quantile_stride * 64:
+            values = values.reshape(-1)[::self.quantile_stride]
+        return np.percentile(values, q)
+
+    def scale_plane(self, plane: np.ndarray, mask: Optional[np.ndarray],
+                    scale: float) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        if scale >= 1.0:
+            return plane, mask
+        h, w = plane.shape[:2]
+        size = (max(1, int(w * scale)), max(1, int(h * scale)))
+        plane_small = cv2.resize(plane, size, interpolation=cv2.INTER_AREA)
+        mask_small = cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST) if mask is not None else None
+        return plane_small, mask_small
+
+
+TIERS: Dict[str, QualityTier] = {
+    'full': QualityTier('full'),
+    'balanced': QualityTier('balanced', exact_local_variance=False),
+    'fast': QualityTier('fast', exact_local_variance=False, lbp_radius=2, lbp_scale=0.5, quantile_stride=4)
+}
+
+DEFAULT_TIER = os.environ.get('ML_QUALITY_TIER', 'full')
+if DEFAULT_TIER not in TIERS:
+    DEFAULT_TIER = 'full'
+
+
+def get_tier(name: Optional[str] = None) -> QualityTier:
+    name = name or DEFAULT_TIER
+    if name not in TIERS:
+        raise ValueError(f"Неизвестный уровень качества: {name}. Допустимые: {', '.join(TIERS)}")
+    return TIERS[name]
+
+
+# Таблица ошибки уровней относительно full, сохранённая TierBenchmark.py --json
+TIER_ERROR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tier_error.json')
+
+
+def load_tier_error(path: str = TIER_ERROR_PATH) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def describe_tiers() -> Dict[str, Any]:
+    error = load_tier_error()
+    tiers = {}
+    for name, tier in TIERS.items():
+        tiers[name] = asdict(tier)
+        if error is not None and name in error.get('tiers', {}):
+            tiers[name]['error_vs_full'] = error['tiers'][name]
+    return {
+        'default': DEFAULT_TIER,
+        'measured': error.get('measured') if error is not None else None,
+        'tiers': tiers
+    }
@@ -0,0 +1,239 @@
+"""
+Инкрементальная переобработка архива снимков.
+
+    python Reprocess.py ../frontend/backend/uploads --out reprocess --workers 4
+
+В каталоге --out ведутся два append-only файла:
+  manifest.jsonl - по строке на обработанный снимок: путь, размер, mtime, sha256,
+                   версия алгоритма и смещение результата в results.jsonl;
+  results.jsonl  - метрики и отчёт (или ошибка) по каждому снимку.
+Запись в манифест делается после записи результата, поэтому после падения
+повторный запуск продолжает с того же места. Снимки с неизменными содержимым и
+версией алгоритма пропускаются, так что ночной прогон стоит пропорционально
+числу изменившихся файлов, а не размеру архива.
+"""
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Iterator, Optional, Tuple, Any
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+MANIFEST_FILE = 'manifest.jsonl'
+RESULTS_FILE = 'results.jsonl'
+
+_worker = {}
+
+
+def _init_worker(budget_mb: Optional[float]) -> None:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from FaceAnalyzer import FaceAnalyzer
+    from BatchAnalyzer import SkinHealthReport
+    from MemoryBudget import MemoryBudget
+    # Параллелизм - на уровне процессов, внутри процесса метрики считаются последовательно
+    _worker['analyzer'] = FaceAnalyzer(metric_workers=0)
+    _worker['report'] = SkinHealthReport
+    _worker['budget'] = MemoryBudget(budget_mb)
+
+
+def _process(root: str, rel_path: str, known_sha: Optional[str], version: int) -> Dict[str, Any]:
+    with open(os.path.join(root, rel_path), 'rb') as f:
+        data = f.read()
+    sha = hashlib.sha256(data).hexdigest()
+    if sha == known_sha:
+        # Изменился только mtime - пересчёт не нужен
+        return {'path': rel_path, 'sha256': sha, 'unchanged': True}
+
+    result = {'path': rel_path, 'sha256': sha, 'version': version}
+    try:
+        img = _worker['budget'].decode(data)
+        del data
+        if img is None:
+            result['error'] = 'Не удалось загрузить изображение'
+        else:
+            metrics, _ = _worker['analyzer'].analyze(img, visualize=False)
+            result['metrics'] = metrics
+            result['report'] = _worker['report'].generate_report(metrics)
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+
+class ReprocessManifest:
+    def __init__(self, out_dir: str):
+        self.out_dir = out_dir
+        self.manifest_path = os.path.join(out_dir, MANIFEST_FILE)
+        self.results_path = os.path.join(out_dir, RESULTS_FILE)
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        os.makedirs(out_dir, exist_ok=True)
+        self._load()
+        self._manifest = self._open_append(self.manifest_path)
+        self._results = self._open_append(self.results_path)
+
+    def _load(self) -> None:
+        if not os.path.exists(self.manifest_path):
+            return
+        lines = 0
+        with open(self.manifest_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # недописанная строка после падения
+                self.entries[entry['path']] = entry
+                lines += 1
+        if lines > 2 * len(self.entries) + 100:
+            self._compact()
+
+    def _compact(self) -> None:
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, self.manifest_path)
+
+    @staticmethod
+    def _open_append(path: str):
+        f = open(path, 'ab')
+        # Обрезанная при падении последняя строка закрывается переводом строки
+        if f.tell() > 0:
+            with open(path, 'rb') as r:
+                r.seek(-1, os.SEEK_END)
+                if r.read(1) != b'\n':
+                    f.write(b'\n')
+        return f
+
+    def is_current(self, rel_path: str, stat: os.stat_result, version: int, retry_errors: bool) -> bool:
+        entry = self.entries.get(rel_path)
+        if entry is None or entry['version'] != version:
+            return False
+        if retry_errors and entry.get('error'):
+            return False
+        return entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns
+
+    def known_sha(self, rel_path: str, version: int) -> Optional[str]:
+        entry = self.entries.get(rel_path)
+        if entry is None or entry['version'] != version or entry.get('error'):
+            return None
+        return entry['sha256']
+
+    def record(self, result: Dict[str, Any], stat: os.stat_result, version: int) -> None:
+        rel_path = result['path']
+        if result.get('unchanged'):
+            entry = dict(self.entries[rel_path])
+        else:
+            offset = self._results.tell()
+            self._results.write((json.dumps(result, ensure_ascii=False) + '\n').encode('utf-8'))
+            self._results.flush()
+            entry = {
+                'path': rel_path,
+                'sha256': result['sha256'],
+                'version': version,
+                'results_file': RESULTS_FILE,
+                'offset': offset,
+                'error': result.get('error')
+            }
+        entry['size'] = stat.st_size
+        entry['mtime_ns'] = stat.st_mtime_ns
+        self._manifest.write((json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8'))
+        self._manifest.flush()
+        self.entries[rel_path] = entry
+
+    def checkpoint(self) -> None:
+        for f in (self._results, self._manifest):
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self) -> None:
+        self.checkpoint()
+        self._results.close()
+        self._manifest.close()
+
+
+def iter_images(root: str) -> Iterator[Tuple[str, os.stat_result]]:
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                path = os.path.join(dirpath, name)
+                yield os.path.relpath(path, root).replace(os.sep, '/'), os.stat(path)
+
+
+def reprocess(root: str, out_dir: str, workers: int = 1, budget_mb: Optional[float] = None,
+              retry_errors: bool = False, checkpoint_every: int = 50) -> Dict[str, int]:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from FaceAnalyzer import FaceAnalyzer
+    version = FaceAnalyzer.ALGORITHM_VERSION
+
+    manifest = ReprocessManifest(out_dir)
+    counts = {'skipped': 0, 'unchanged': 0, 'processed': 0, 'errors': 0}
+    # Ограничение числа задач в полёте держит память пропорциональной числу воркеров
+    max_in_flight = max(1, workers) * 2
+    pending = {}
+    since_checkpoint = 0
+    started = time.time()
+
+    def collect(done):
+        nonlocal since_checkpoint
+        for future in done:
+            stat = pending.pop(future)
+            result = future.result()
+            manifest.record(result, stat, version)
+            if result.get('unchanged'):
+                counts['unchanged'] += 1
+            else:
+                counts['processed'] += 1
+                if result.get('error'):
+                    counts['errors'] += 1
+                    print(f"⚠️ {result['path']}: {result['error']}")
+            since_checkpoint += 1
+            if since_checkpoint >= checkpoint_every:
+                manifest.checkpoint()
+                since_checkpoint = 0
+
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, workers), initializer=_init_worker,
+                                 initargs=(budget_mb,)) as executor:
+            for rel_path, stat in iter_images(root):
+                if manifest.is_current(rel_path, stat, version, retry_errors):
+                    counts['skipped'] += 1
+                    continue
+                if len(pending) >= max_in_flight:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                future = executor.submit(_process, root, rel_path,
+                                         manifest.known_sha(rel_path, version), version)
+                pending[future] = stat
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+    finally:
+        manifest.close()
+
+    counts['seconds'] = round(time.time() - started, 1)
+    return counts
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Инкрементальная переобработка архива снимков')
+    parser.add_argument('root', help='Каталог со снимками (обходится рекурсивно)')
+    parser.add_argument('--out', default='reprocess', help='Каталог для manifest.jsonl и results.jsonl')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Число процессов анализа')
+    parser.add_argument('--memory-budget-mb', type=float, default=None,
+                        help='Бюджет памяти на один снимок в воркере (0 - без ограничения); '
+                             'по умолчанию ML_MEMORY_BUDGET_MB, как у сервиса')
+    parser.add_argument('--retry-errors', action='store_true', help='Повторить снимки, завершившиеся ошибкой')
+    parser.add_argument('--checkpoint-every', type=int, default=50, help='fsync манифеста каждые N снимков')
+    args = parser.parse_args(argv)
+
+    counts = reprocess(args.root, args.out, workers=args.workers, budget_mb=args.memory_budget_mb,
+                       retry_errors=args.retry_errors, checkpoint_every=args.checkpoint_every)
+    print(f"✅ Готово: {json.dumps(counts, ensure_ascii=False)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
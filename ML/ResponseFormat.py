@@ -0,0 +1,101 @@
+from typing import Dict, List, Optional, Any
+import json
+import math
+
+from flask import Response
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Версия схемы массива metric_values: меняется при изменении состава или порядка метрик
+SCHEMA_VERSION = 1
+# Порядок совпадает с FaceAnalyzer.METRIC_ORDER, новые метрики добавляются только в конец
+METRIC_NAMES = ['paleness', 'cyanosis', 'jaundice', 'redness', 'acne_spots', 'oiliness', 'pigmentation',
+                'vascularity', 'puffiness', 'dark_circles', 'wrinkles', 'texture_roughness', 'pore_size',
+                'mild_acne', 'moderate_acne', 'severe_acne']
+
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+
+# Поля ответа /analyze по умолчанию и в компактном режиме; status и schema_version есть всегда
+DEFAULT_FIELDS = ['analysis_type', 'analysis_id', 'quality_tier', 'degraded_reason', 'metrics', 'report',
+                  'overall_score', 'memory', 'quality', 'note', 'message']
+COMPACT_FIELDS = ['analysis_type', 'analysis_id', 'quality_tier', 'degraded_reason', 'metric_values', 'report',
+                  'overall_score', 'quality']
+ALWAYS_FIELDS = ['status', 'schema_version', 'error', 'profile', 'coalesced']
+
+
+class ResponseFormat:
+    """
+    Согласование формата ответа /analyze: fields=a,b,c выбирает поля верхнего уровня,
+    compact=1 заменяет словарь metrics массивом metric_values в порядке METRIC_NAMES,
+    format=msgpack или Accept: application/msgpack включает MessagePack.
+    formatted_report строится только если он явно запрошен в fields.
+    """
+
+    def __init__(self, fields: Optional[List[str]] = None, compact: bool = False, encoding: str = 'json'):
+        self.compact = compact
+        self.fields = set(fields) if fields else set(COMPACT_FIELDS if compact else DEFAULT_FIELDS)
+        self.encoding = encoding if encoding == 'json' or msgpack is not None else 'json'
+
+    @classmethod
+    def from_request(cls, req) -> 'ResponseFormat':
+        def param(name: str) -> str:
+            return (req.args.get(name) or req.form.get(name) or '').strip()
+
+        fields = [f.strip() for f in param('fields').split(',') if f.strip()]
+        compact = param('compact').lower() in ('1', 'true')
+        fmt = param('format').lower()
+        if not fmt and req.accept_mimetypes.best_match(('application/json',) + MSGPACK_MIMETYPES) in MSGPACK_MIMETYPES:
+            fmt = 'msgpack'
+        return cls(fields=fields, compact=compact, encoding='msgpack' if fmt == 'msgpack' else 'json')
+
+    def wants(self, field: str) -> bool:
+        return field in self.fields
+
+    def select(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        fields = self.fields
+        if self.wants('metric_values') and 'metrics' in payload:
+            if payload.get('analysis_type') == 'full_analysis':
+                payload['metric_values'] = self.metric_values(payload['metrics'])
+            else:
+                # У упрощённого анализа свой набор метрик - отдаются словарём
+                fields = fields | {'metrics'}
+        report = payload.get('report')
+        if isinstance(report, dict) and 'metrics_summary' in report and not self.wants('metrics_summary'):
+            # metrics_summary дублирует metrics
+            payload['report'] = {k: v for k, v in report.items() if k != 'metrics_summary'}
+        result = {key: value for key, value in payload.items()
+                  if key in ALWAYS_FIELDS or key in fields}
+        result['schema_version'] = SCHEMA_VERSION
+        return result
+
+    @staticmethod
+    def metric_values(metrics: Dict[str, float]) -> List[Optional[float]]:
+        values = []
+        for name in METRIC_NAMES:
+            value = metrics.get(name)
+            values.append(None if value is None or math.isnan(value) else round(float(value), 6))
+        return values
+
+    def render(self, payload: Dict[str, Any], status: int = 200) -> Response:
+        return self.encode(self.select(payload), status)
+
+    def encode(self, body: Dict[str, Any], status: int = 200) -> Response:
+        """Тело ответа без выбора полей - для ответов, в которые результат анализа вложен."""
+        if self.encoding == 'msgpack':
+            return Response(msgpack.packb(body, use_bin_type=True), status=status,
+                            mimetype='application/msgpack')
+        return Response(json.dumps(body, ensure_ascii=False, separators=(',', ':')), status=status,
+                        mimetype='application/json')
+
+    @staticmethod
+    def schema() -> Dict[str, Any]:
+        return {
+            'schema_version': SCHEMA_VERSION,
+            'metric_names': METRIC_NAMES,
+            'fields': sorted(set(DEFAULT_FIELDS + COMPACT_FIELDS + ALWAYS_FIELDS +
+                                 ['formatted_report', 'metrics_summary'])),
+            'encodings': ['json'] + (['msgpack'] if msgpack is not None else [])
+        }
@@ -0,0 +1,198 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Dict, Optional, Tuple, Any
+import atexit
+import os
+import queue
+import sys
+import threading
+import numpy as np
+import cv2
+
+# Заголовок слота: номер поколения (int64), выровнено под данные
+HEADER_BYTES = 64
+
+
+@dataclass(frozen=True)
+class FrameRef:
+    """Дескриптор массива в слоте разделяемой памяти - передаётся между процессами вместо данных."""
+    name: str
+    slot: int
+    generation: int
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+class StaleFrameError(RuntimeError):
+    pass
+
+
+def _array(shm: shared_memory.SharedMemory, ref: FrameRef) -> np.ndarray:
+    generation = int(np.ndarray((1,), np.int64, buffer=shm.buf)[0])
+    if generation != ref.generation:
+        raise StaleFrameError(f"Слот {ref.slot} переиспользован: поколение {generation}, ожидалось {ref.generation}")
+    return np.ndarray(ref.shape, np.dtype(ref.dtype), buffer=shm.buf, offset=HEADER_BYTES)
+
+
+class SharedFrameRing:
+    """
+    Кольцо заранее выделенных слотов multiprocessing.shared_memory. Родительский
+    процесс владеет сегментами: занимает слот, пишет кадр и передаёт воркеру FrameRef.
+    Каждая запись увеличивает поколение слота, поэтому устаревший дескриптор после
+    переиспользования слота даёт StaleFrameError, а не чужие данные. Сегменты
+    удаляются при close() или atexit; при падении всего процесса их удаляет
+    resource_tracker, общий для родителя и воркеров.
+    """
+
+    def __init__(self, slots: int, slot_bytes: int):
+        self.slot_bytes = slot_bytes
+        self.segments = [shared_memory.SharedMemory(create=True, size=HEADER_BYTES + slot_bytes)
+                         for _ in range(slots)]
+        self._generations = [0] * slots
+        self._free: queue.Queue = queue.Queue()
+        for slot in range(slots):
+            self._free.put(slot)
+        self._closed = False
+        atexit.register(self.close)
+
+    def fits(self, array: np.ndarray) -> bool:
+        return array.nbytes <= self.slot_bytes
+
+    def acquire(self, timeout: Optional[float] = None) -> int:
+        return self._free.get(timeout=timeout)
+
+    def release(self, slot: int) -> None:
+        self._free.put(slot)
+
+    def write(self, slot: int, array: np.ndarray) -> FrameRef:
+        if not self.fits(array):
+            raise ValueError(f"Массив {array.nbytes} байт не помещается в слот {self.slot_bytes} байт")
+        shm = self.segments[slot]
+        self._generations[slot] += 1
+        generation = self._generations[slot]
+        np.ndarray((1,), np.int64, buffer=shm.buf)[0] = generation
+        ref = FrameRef(shm.name, slot, generation, tuple(array.shape), array.dtype.str)
+        np.copyto(_array(shm, ref), array)
+        return ref
+
+    def read(self, ref: FrameRef) -> np.ndarray:
+        return _array(self.segments[ref.slot], ref).copy()
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        for shm in self.segments:
+            shm.close()
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+# Сегменты, открытые в процессе воркера: подключаются один раз на слот
+_attached: Dict[str, shared_memory.SharedMemory] = {}
+
+
+def attach(ref: FrameRef) -> np.ndarray:
+    """Представление массива из слота без копирования (на стороне воркера)."""
+    shm = _attached.get(ref.name)
+    if shm is None:
+        shm = _attached[ref.name] = shared_memory.SharedMemory(name=ref.name)
+    return _array(shm, ref)
+
+
+def store(ref: FrameRef, array: np.ndarray) -> FrameRef:
+    """Запись результата воркера в тот же слот поверх входного кадра."""
+    if array.nbytes > _attached[ref.name].size - HEADER_BYTES:
+        raise ValueError("Результат не помещается в слот")
+    out = FrameRef(ref.name, ref.slot, ref.generation, tuple(array.shape), array.dtype.str)
+    np.copyto(_array(_attached[ref.name], out), array)
+    return out
+
+
+_worker = {}
+
+
+def _init_worker() -> None:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from FaceAnalyzer import FaceAnalyzer
+    _worker['analyzer'] = FaceAnalyzer(metric_workers=0)
+
+
+def _analyze_shared(ref: FrameRef, overlay_side: int, quality: Optional[str] = None):
+    img_bgr = attach(ref)
+    metrics, landmarks_xy, analyzed = _worker['analyzer'].analyze_with_landmarks(img_bgr, quality=quality)
+    h, w = analyzed.shape[:2]
+    scale = min(1.0, overlay_side / float(max(h, w)))
+    overlay = cv2.resize(analyzed, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    # Входной кадр больше не нужен - уменьшенная копия для разметки возвращается через тот же слот
+    del img_bgr, analyzed
+    return metrics, landmarks_xy, store(ref, overlay)
+
+
+def _analyze_pickled(img_bgr: np.ndarray, overlay_side: int, quality: Optional[str] = None):
+    metrics, landmarks_xy, analyzed = _worker['analyzer'].analyze_with_landmarks(img_bgr, quality=quality)
+    h, w = analyzed.shape[:2]
+    scale = min(1.0, overlay_side / float(max(h, w)))
+    overlay = cv2.resize(analyzed, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    return metrics, landmarks_xy, overlay
+
+
+class AnalysisProcessPool:
+    """
+    Пул процессов FaceAnalyzer, получающий кадры через SharedFrameRing. Число
+    слотов ограничивает число кадров в работе; кадр крупнее слота передаётся
+    обычной сериализацией. При падении воркера слот освобождается, а пул
+    пересоздаётся для следующих запросов.
+    """
+    OVERLAY_SIDE = 640
+
+    def __init__(self, processes: int, slots: Optional[int] = None, slot_mb: Optional[float] = None):
+        if slot_mb is None:
+            slot_mb = float(os.environ.get('ML_SHM_SLOT_MB', '32'))
+        self.processes = processes
+        self.ring = SharedFrameRing(slots or processes * 2, int(slot_mb * 2**20))
+        self._lock = threading.Lock()
+        self._executor = self._create_executor()
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.processes, initializer=_init_worker)
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            return self._executor.submit(fn, *args)
+
+    def _restart(self, broken: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._executor is broken:
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._create_executor()
+
+    def analyze(self, img_bgr: np.ndarray,
+                quality: Optional[str] = None) -> Tuple[Dict[str, float], np.ndarray, np.ndarray]:
+        """Метрики, нормированные ориентиры и уменьшенный кадр для разметки."""
+        executor = self._executor
+        try:
+            if not self.ring.fits(img_bgr):
+                return self._submit(_analyze_pickled, img_bgr, self.OVERLAY_SIDE, quality).result()
+            slot = self.ring.acquire()
+            try:
+                ref = self.ring.write(slot, img_bgr)
+                metrics, landmarks_xy, out_ref = self._submit(_analyze_shared, ref, self.OVERLAY_SIDE, quality).result()
+                return metrics, landmarks_xy, self.ring.read(out_ref)
+            finally:
+                self.ring.release(slot)
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise RuntimeError("Процесс анализа аварийно завершился")
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+        self.ring.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {'processes': self.processes, 'slots': len(self.ring.segments),
+                'free_slots': self.ring._free.qsize(), 'slot_mb': round(self.ring.slot_bytes / 2**20, 1)}
@@ -0,0 +1,151 @@
+from SkinMetrics import SkinMetrics, ColorStats
+from ImageProcessor import ImageProcessor
+from ColorConverter import ColorConverter
+from SkinSegmentation import SkinSegmentation
+from typing import Dict, Optional, Tuple
+import math
+import threading
+import os
+import numpy as np
+import cv2
+
+
+class SimpleFaceAnalyzer:
+    """
+    Упрощённый анализ только на OpenCV: рамка лица по каскаду Хаара, области -
+    по пропорциям рамки, цветовые метрики - теми же формулами SkinMetrics, что и
+    в полном анализе. Работает на кадре не больше 320 px и занимает единицы миллисекунд.
+    Используется, когда mediapipe недоступен, и для сброса нагрузки при
+    переполнении очереди полного анализа. Если каскад не найден или лицо не
+    обнаружено, за рамку лица берётся центральная часть кадра.
+    """
+    WORK_SIDE = 320
+    # Области в долях рамки лица: (x0, y0, x1, y1)
+    REGIONS = {
+        'forehead': (0.25, 0.08, 0.75, 0.28),
+        'left_cheek': (0.15, 0.45, 0.40, 0.70),
+        'right_cheek': (0.60, 0.45, 0.85, 0.70),
+        'nose': (0.42, 0.35, 0.58, 0.65),
+        'chin': (0.35, 0.80, 0.65, 0.95)
+    }
+
+    _local = threading.local()
+
+    def __init__(self):
+        self.metrics = SkinMetrics()
+        self.processor = ImageProcessor()
+        self.color_converter = ColorConverter()
+
+    def analyze(self, img_bgr: np.ndarray, visualize: bool = False) -> Tuple[Dict[str, float], Optional[np.ndarray]]:
+        img = self._resize(img_bgr)
+        box, detected = self.detect_face(img)
+        face_mask, regions = self._create_region_masks(img.shape, box)
+
+        skin = SkinSegmentation.lookup(img)
+        skin_mask = cv2.bitwise_and(face_mask, skin)
+        # Если цветовой фильтр отбросил почти всё (освещение, тон кожи) - считаем по всему овалу
+        if cv2.countNonZero(skin_mask) < 0.1 * cv2.countNonZero(face_mask):
+            skin_mask = face_mask
+
+        x, y, w, h = box
+        crop = img[y:y + h, x:x + w]
+        crop_mask = skin_mask[y:y + h, x:x + w]
+        crop_regions = {name: mask[y:y + h, x:x + w] for name, mask in regions.items()}
+        stats = self.metrics.region_color_statistics(crop, crop_mask, crop_regions)
+
+        metrics_dict = {
+            'face_detected': 1.0 if detected else 0.0,
+            'paleness': self._paleness(stats),
+            'cyanosis': self.metrics.cyanosis_from_stats(stats['face']),
+            'jaundice': self.metrics.jaundice_from_stats(stats['face']),
+            'redness': self.metrics.redness_from_stats(stats['face'])
+        }
+        metrics_dict.update(self._tone_metrics(crop, crop_mask))
+
+        vis = self._create_visualization(img, box, regions) if visualize else None
+        return metrics_dict, vis
+
+    def detect_face(self, img_bgr: np.ndarray) -> Tuple[Tuple[int, int, int, int], bool]:
+        """Рамка (x, y, w, h) самого крупного лица и признак того, что лицо найдено каскадом."""
+        h, w = img_bgr.shape[:2]
+        cascade = self._cascade()
+        if cascade is not None:
+            gray = cv2.equalizeHist(cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY))
+            min_side = max(24, min(h, w) // 8)
+            faces = cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(min_side, min_side))
+            if len(faces) > 0:
+                fx, fy, fw, fh = max(faces, key=lambda f: f[2] * f[3])
+                return (int(fx), int(fy), int(fw), int(fh)), True
+        # Не меньше пикселя - на крошечных кадрах пустой кроп ломал бы cvtColor
+        side = max(1, int(min(h, w) * 0.6))
+        return ((w - side) // 2, (h - side) // 2, side, side), False
+
+    def _resize(self, img_bgr: np.ndarray) -> np.ndarray:
+        h, w = img_bgr.shape[:2]
+        factor = math.ceil(max(h, w) / self.WORK_SIDE)
+        if factor <= 1:
+            return img_bgr
+        if round(min(h, w) / factor) == 0:
+            # Полоска в пиксель толщиной - короткая сторона не должна стать нулевой
+            size = (max(1, round(w / factor)), max(1, round(h / factor)))
+            return cv2.resize(img_bgr, size, interpolation=cv2.INTER_AREA)
+        # Целый коэффициент - быстрый путь INTER_AREA
+        return cv2.resize(img_bgr, None, fx=1.0 / factor, fy=1.0 / factor, interpolation=cv2.INTER_AREA)
+
+    def _create_region_masks(self, img_shape, box: Tuple[int, int, int, int]
+                             ) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        x, y, w, h = box
+        face_mask = np.zeros(img_shape[:2], dtype=np.uint8)
+        cv2.ellipse(face_mask, (x + w // 2, y + h // 2), (int(w * 0.42), int(h * 0.5)), 0, 0, 360, 255, -1)
+        regions = {}
+        for name, (rx0, ry0, rx1, ry1) in self.REGIONS.items():
+            mask = np.zeros(img_shape[:2], dtype=np.uint8)
+            cv2.rectangle(mask, (x + int(w * rx0), y + int(h * ry0)), (x + int(w * rx1), y + int(h * ry1)), 255, -1)
+            regions[name] = mask
+        return face_mask, regions
+
+    def _paleness(self, stats: Dict[str, ColorStats]) -> float:
+        cheeks = [stats[name] for name in ('left_cheek', 'right_cheek') if stats[name].count > 0]
+        if cheeks:
+            return sum(self.metrics.paleness_from_stats(s) for s in cheeks) / len(cheeks)
+        return self.metrics.paleness_from_stats(stats['face'])
+
+    def _tone_metrics(self, crop_bgr: np.ndarray, skin_mask: np.ndarray) -> Dict[str, float]:
+        gray = cv2.cvtColor(crop_bgr, cv2.COLOR_BGR2GRAY)
+        gray_mean, gray_std = cv2.meanStdDev(gray, mask=skin_mask)
+        lab = self.color_converter.to_lab(crop_bgr)
+        _, lab_std = cv2.meanStdDev(lab, mask=skin_mask)
+        # Разброс L, a, b по коже: 0 - ровный тон, ~25 и больше - сильно неоднородный
+        tone_spread = float(np.mean(lab_std))
+        return {
+            'brightness': self.processor.normalize01(float(gray_mean[0, 0]) / 255.0),
+            'contrast': self.processor.normalize01(float(gray_std[0, 0]) / 64.0),
+            'skin_tone_consistency': self.processor.normalize01(1.0 - tone_spread / 25.0)
+        }
+
+    @staticmethod
+    def _create_visualization(img_bgr: np.ndarray, box: Tuple[int, int, int, int],
+                              regions: Dict[str, np.ndarray]) -> np.ndarray:
+        vis = img_bgr.copy()
+        x, y, w, h = box
+        cv2.rectangle(vis, (x, y), (x + w, y + h), (0, 255, 0), 2)
+        for mask in regions.values():
+            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            cv2.drawContours(vis, contours, -1, (255, 200, 0), 1)
+        return vis
+
+    @classmethod
+    def _cascade(cls):
+        # CascadeClassifier не потокобезопасен - по экземпляру на поток
+        if not hasattr(cls._local, 'cascade'):
+            cls._local.cascade = cls._load_cascade()
+        return cls._local.cascade
+
+    @staticmethod
+    def _load_cascade():
+        cascade_dir = getattr(getattr(cv2, 'data', None), 'haarcascades', '')
+        cascade_path = os.path.join(cascade_dir, 'haarcascade_frontalface_default.xml')
+        if not os.path.exists(cascade_path):
+            return None
+        cascade = cv2.CascadeClassifier(cascade_path)
+        return None if cascade.empty() else cascade
@@ -0,0 +1,84 @@
+from typing import Any, Callable, Dict, Optional, Tuple
+import os
+import threading
+import time
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'expires')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.expires: Optional[float] = None
+
+
+class SingleFlight:
+    """
+    Объединение одновременных запросов с одинаковым ключом: первый запрос
+    выполняет вычисление, остальные ждут и получают тот же результат (или то же
+    исключение). Завершённый результат ещё grace_seconds отдаётся повторам -
+    двойным отправкам и ретраям клиента. Результат общий для всех получателей,
+    изменять его нельзя.
+    """
+
+    def __init__(self, grace_seconds: Optional[float] = None):
+        if grace_seconds is None:
+            grace_seconds = float(os.environ.get('ML_COALESCE_GRACE_S', '5'))
+        self.grace_seconds = grace_seconds
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self._counts = {'leaders': 0, 'shared_inflight': 0, 'shared_grace': 0, 'errors': 0}
+
+    def run(self, key: str, fn: Callable[[], Any],
+            keep: Callable[[Any], bool] = lambda result: True) -> Tuple[Any, Optional[str]]:
+        """
+        Результат fn() и способ его получения: None - вычислен этим вызовом,
+        'inflight' - общий с выполняющимся вызовом, 'grace' - недавно завершённый.
+        keep(result) решает, можно ли отдавать результат повторам в течение grace.
+        """
+        with self._lock:
+            self._expire(time.monotonic())
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self._counts['leaders'] += 1
+                shared = None
+            else:
+                shared = 'grace' if call.done.is_set() else 'inflight'
+                self._counts['shared_' + shared] += 1
+
+        if shared is not None:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, shared
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if call.error is None and self.grace_seconds > 0 and keep(call.result):
+                    call.expires = time.monotonic() + self.grace_seconds
+                else:
+                    if call.error is not None:
+                        self._counts['errors'] += 1
+                    if self._calls.get(key) is call:
+                        del self._calls[key]
+                call.done.set()
+        return call.result, None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            inflight = sum(1 for call in self._calls.values() if not call.done.is_set())
+            return dict(self._counts, inflight=inflight, grace_entries=len(self._calls) - inflight,
+                        grace_seconds=self.grace_seconds)
+
+    def _expire(self, now: float) -> None:
+        expired = [key for key, call in self._calls.items() if call.expires is not None and call.expires <= now]
+        for key in expired:
+            del self._calls[key]
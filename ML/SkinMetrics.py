@@ -1,103 +1,168 @@
 from ImageProcessor import ImageProcessor
 from ColorConverter import ColorConverter
-from typing import Optional
+from DerivativePlanes import DerivativePlanes
+from Workspace import current_workspace
+from dataclasses import dataclass, field
+from typing import Optional, Dict
 import numpy as np
 import cv2
 
+@dataclass
+class ColorStats:
+    count: int = 0
+    lab_sum: np.ndarray = field(default_factory=lambda: np.zeros(3))
+    rgb_sum: np.ndarray = field(default_factory=lambda: np.zeros(3))
+    red_excess_sum: float = 0.0
+    yellow_count: float = 0.0
+    
+    @property
+    def lab_mean(self) -> np.ndarray:
+        return self.lab_sum / self.count if self.count > 0 else np.zeros(3)
+    
+    @property
+    def rgb_mean(self) -> np.ndarray:
+        return self.rgb_sum / self.count if self.count > 0 else np.zeros(3)
+
 class SkinMetrics:
     @staticmethod
-    def compute_paleness_lab(roi_bgr: np.ndarray, skin_mask: Optional[np.ndarray] = None) -> float:
-        lab = ColorConverter.to_lab(roi_bgr)
-        meanL, meana, meanb = ImageProcessor.mean_channel(lab, skin_mask)
+    def region_color_statistics(roi_bgr: np.ndarray, skin_mask: Optional[np.ndarray] = None,
+                                regions: Optional[Dict[str, np.ndarray]] = None) -> Dict[str, ColorStats]:
+        """
+        Все цветовые суммы для кожи за один проход: LAB, HSV, превышение красного и
+        жёлтая маска считаются один раз на кроп, а по областям (маски той же формы,
+        что и roi_bgr) снимаются только маскированные суммы.
+        Ключ 'face' соответствует skin_mask целиком.
+        """
+        ws = current_workspace()
+        shape = roi_bgr.shape[:2]
+        lab = ColorConverter.to_lab(roi_bgr, dst=ws.get('color.lab', roi_bgr.shape))
+        hsv = ColorConverter.to_hsv(roi_bgr, dst=ws.get('color.hsv', roi_bgr.shape))
+        b, g, r = (cv2.extractChannel(roi_bgr, i, dst=ws.get(name, shape))
+                   for i, name in enumerate(('color.b', 'color.g', 'color.r')))
+        red_x2 = cv2.add(r, r, dst=ws.get('color.red_x2', shape, np.int16), dtype=cv2.CV_16S)
+        green_blue = cv2.add(g, b, dst=ws.get('color.green_blue', shape, np.int16), dtype=cv2.CV_16S)
+        red_excess_x2 = cv2.subtract(red_x2, green_blue, dst=red_x2, dtype=cv2.CV_16S)
+        # np.maximum, а не cv2.max: массив 1x1 OpenCV принял бы за скаляр и вернул бы 4x1
+        red_excess_x2 = np.maximum(red_excess_x2, 0, out=red_excess_x2)
+        yellow = cv2.inRange(hsv, (10, 31, 0), (35, 255, 255), dst=ws.get('color.yellow', shape))
+        
+        face_mask = skin_mask.astype(np.uint8) if skin_mask is not None else None
+        region_masks = {'face': face_mask}
+        for name, region_mask in (regions or {}).items():
+            region_mask = region_mask.astype(np.uint8)
+            region_masks[name] = cv2.bitwise_and(region_mask, face_mask) if face_mask is not None else region_mask
+        
+        stats = {}
+        for name, mask in region_masks.items():
+            count = cv2.countNonZero(mask) if mask is not None else roi_bgr.shape[0] * roi_bgr.shape[1]
+            if count == 0:
+                stats[name] = ColorStats()
+                continue
+            lab_mean = np.array(cv2.mean(lab, mask=mask)[:3])
+            bgr_mean = np.array(cv2.mean(roi_bgr, mask=mask)[:3])
+            red_mean = cv2.mean(red_excess_x2, mask=mask)[0] / 2.0
+            yellow_count = cv2.countNonZero(cv2.bitwise_and(yellow, yellow, mask=mask) if mask is not None else yellow)
+            stats[name] = ColorStats(count=count, lab_sum=lab_mean * count, rgb_sum=bgr_mean[::-1] * count,
+                                     red_excess_sum=red_mean * count, yellow_count=float(yellow_count))
+        return stats
+    
+    @staticmethod
+    def color_statistics(roi_bgr: np.ndarray, skin_mask: Optional[np.ndarray] = None) -> ColorStats:
+        return SkinMetrics.region_color_statistics(roi_bgr, skin_mask)['face']
+    
+    @staticmethod
+    def paleness_from_stats(stats: ColorStats) -> float:
+        meanL, meana, meanb = stats.lab_mean
         Ln = meanL / 255.0
         chroma = np.sqrt(meana**2 + meanb**2) / 255.0
         pallor = Ln * (1.0 - chroma)
         return ImageProcessor.normalize01(pallor)
     
     @staticmethod
-    def compute_cyanosis(roi_bgr: np.ndarray, skin_mask: Optional[np.ndarray] = None) -> float:
-        rgb = ColorConverter.to_rgb(roi_bgr)
-        vals = rgb[skin_mask.astype(bool)] if skin_mask is not None else rgb.reshape(-1, 3)
-        if vals.size == 0:
+    def cyanosis_from_stats(stats: ColorStats) -> float:
+        if stats.count == 0:
             return 0.0
-        r_mean, g_mean, b_mean = vals[:, 0].mean(), vals[:, 1].mean(), vals[:, 2].mean()
+        r_mean, g_mean, b_mean = stats.rgb_mean
         score = max(0.0, (b_mean - (r_mean + g_mean) / 2.0) / 255.0)
         return ImageProcessor.normalize01(score * 2.0)
     
     @staticmethod
-    def compute_jaundice(roi_bgr: np.ndarray, skin_mask: Optional[np.ndarray] = None) -> float:
-        hsv = ColorConverter.to_hsv(roi_bgr)
-        h, s, v = hsv[:,:,0].astype(np.float32), hsv[:,:,1].astype(np.float32), hsv[:,:,2].astype(np.float32)
-        
-        if skin_mask is not None:
-            mask_bool = skin_mask.astype(bool)
-            h_vals, s_vals = h[mask_bool], s[mask_bool]
-        else:
-            h_vals, s_vals = h.reshape(-1), s.reshape(-1)
-        
-        if h_vals.size == 0:
+    def jaundice_from_stats(stats: ColorStats) -> float:
+        if stats.count == 0:
             return 0.0
-        
-        yellow_mask = ((h_vals >= 10) & (h_vals <= 35)) & (s_vals > 30)
-        score = yellow_mask.mean()
+        score = stats.yellow_count / stats.count
         return ImageProcessor.normalize01(score * 1.5)
     
     @staticmethod
-    def compute_redness(roi_bgr: np.ndarray, skin_mask: Optional[np.ndarray] = None) -> float:
-        rgb = ColorConverter.to_rgb(roi_bgr).astype(np.float32)
-        r, g, b = rgb[:,:,0], rgb[:,:,1], rgb[:,:,2]
-        
-        if skin_mask is not None:
-            mask_bool = skin_mask.astype(bool)
-            r_vals, g_vals, b_vals = r[mask_bool], g[mask_bool], b[mask_bool]
-        else:
-            r_vals, g_vals, b_vals = r.reshape(-1), g.reshape(-1), b.reshape(-1)
-        
-        if r_vals.size == 0:
+    def redness_from_stats(stats: ColorStats) -> float:
+        if stats.count == 0:
             return 0.0
-        
-        score = np.maximum(0, (r_vals - (g_vals + b_vals) / 2.0)) / 255.0
-        return ImageProcessor.normalize01(score.mean() * 2.0)
+        score = stats.red_excess_sum / 255.0 / stats.count
+        return ImageProcessor.normalize01(score * 2.0)
+    
+    @staticmethod
+    def compute_paleness_lab(roi_bgr: np.ndarray, skin_mask: Optional[np.ndarray] = None) -> float:
+        return SkinMetrics.paleness_from_stats(SkinMetrics.color_statistics(roi_bgr, skin_mask))
+    
+    @staticmethod
+    def compute_cyanosis(roi_bgr: np.ndarray, skin_mask: Optional[np.ndarray] = None) -> float:
+        return SkinMetrics.cyanosis_from_stats(SkinMetrics.color_statistics(roi_bgr, skin_mask))
+    
+    @staticmethod
+    def compute_jaundice(roi_bgr: np.ndarray, skin_mask: Optional[np.ndarray] = None) -> float:
+        return SkinMetrics.jaundice_from_stats(SkinMetrics.color_statistics(roi_bgr, skin_mask))
+    
+    @staticmethod
+    def compute_redness(roi_bgr: np.ndarray, skin_mask: Optional[np.ndarray] = None) -> float:
+        return SkinMetrics.redness_from_stats(SkinMetrics.color_statistics(roi_bgr, skin_mask))
     
     @staticmethod
     def compute_oiliness(roi_bgr: np.ndarray, skin_mask: Optional[np.ndarray] = None) -> float:
-        hsv = ColorConverter.to_hsv(roi_bgr)
-        v, s = hsv[:,:,2].astype(np.float32), hsv[:,:,1].astype(np.float32)
+        ws = current_workspace()
+        shape = roi_bgr.shape[:2]
+        hsv = ColorConverter.to_hsv(roi_bgr, dst=ws.get('oiliness.hsv', roi_bgr.shape))
         
-        bright = v > 220
-        sat = s > 50
-        highlight = bright & ~sat
+        # Сравнения прямо по uint8-каналам дают тот же результат, что и в float32
+        v = cv2.extractChannel(hsv, 2, dst=ws.get('oiliness.v', shape))
+        s = cv2.extractChannel(hsv, 1, dst=ws.get('oiliness.s', shape))
+        highlight = np.greater(v, 220, out=ws.get('oiliness.bright', shape, np.bool_))
+        unsaturated = np.less_equal(s, 50, out=ws.get('oiliness.unsaturated', shape, np.bool_))
+        np.logical_and(highlight, unsaturated, out=highlight)
         
         if skin_mask is not None:
-            highlight = highlight & skin_mask.astype(bool)
+            np.logical_and(highlight, ws.mask('oiliness.mask', skin_mask), out=highlight)
         
-        frac = highlight.sum() / (roi_bgr.shape[0] * roi_bgr.shape[1])
+        frac = np.count_nonzero(highlight) / (roi_bgr.shape[0] * roi_bgr.shape[1])
         return ImageProcessor.normalize01(frac * 10.0)
     
     @staticmethod
     def compute_pigmentation(roi_bgr: np.ndarray, skin_mask: Optional[np.ndarray] = None) -> float:
-        lab = ColorConverter.to_lab(roi_bgr)
-        L = lab[:,:,0].astype(np.float32)
-        L_blur = cv2.GaussianBlur(L, (25, 25), 0)
-        diff = L_blur - L
-        mask = diff > 6
+        ws = current_workspace()
+        shape = roi_bgr.shape[:2]
+        lab = ColorConverter.to_lab(roi_bgr, dst=ws.get('pigmentation.lab', roi_bgr.shape))
+        L = ws.get('pigmentation.L', shape, np.float32)
+        np.copyto(L, cv2.extractChannel(lab, 0, dst=ws.get('pigmentation.L8', shape)))
+        diff = cv2.GaussianBlur(L, (25, 25), 0, dst=ws.get('pigmentation.L_blur', shape, np.float32))
+        np.subtract(diff, L, out=diff)
+        mask = np.greater(diff, 6, out=ws.get('pigmentation.mask', shape, np.bool_))
         
         if skin_mask is not None:
-            mask = mask & skin_mask.astype(bool)
+            np.logical_and(mask, ws.mask('pigmentation.skin', skin_mask), out=mask)
         
-        frac = mask.sum() / (roi_bgr.shape[0] * roi_bgr.shape[1])
+        frac = np.count_nonzero(mask) / (roi_bgr.shape[0] * roi_bgr.shape[1])
         return ImageProcessor.normalize01(frac / 0.03)
     
     @staticmethod
-    def compute_vascularity(roi_bgr: np.ndarray, skin_mask: Optional[np.ndarray] = None) -> float:
-        b, g, r = cv2.split(roi_bgr.astype(np.float32))
-        red_minus_green = r - g
-        hp = cv2.Laplacian(red_minus_green, cv2.CV_32F, ksize=3)
-        hp_pos = hp > np.percentile(hp, 90)
+    def compute_vascularity(roi_bgr: np.ndarray, skin_mask: Optional[np.ndarray] = None,
+                            planes: Optional[DerivativePlanes] = None) -> float:
+        planes = planes if planes is not None else DerivativePlanes(roi_bgr)
+        ws = current_workspace()
+        hp = planes.red_green_laplacian
+        hp_pos = np.greater(hp, np.percentile(hp, 90), out=ws.get('vascularity.mask', hp.shape, np.bool_))
         
         if skin_mask is not None:
-            hp_pos = hp_pos & skin_mask.astype(bool)
+            np.logical_and(hp_pos, ws.mask('vascularity.skin', skin_mask), out=hp_pos)
         
-        frac = hp_pos.sum() / (roi_bgr.shape[0] * roi_bgr.shape[1])
+        frac = np.count_nonzero(hp_pos) / (roi_bgr.shape[0] * roi_bgr.shape[1])
         return ImageProcessor.normalize01(frac * 5.0)
 
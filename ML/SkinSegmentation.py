@@ -1,31 +1,41 @@
-import ColorConverter
+from ColorConverter import ColorConverter
 import numpy as np
 import cv2
-from skimage import morphology
+
+
+def _build_cr_cb_lut(cr_range, cb_range) -> np.ndarray:
+    """Таблица 256×256 (Cr, Cb) -> 1 для цвета кожи, развёрнутая в вектор для индекса Cr * 256 + Cb."""
+    cr = np.arange(256)[:, None]
+    cb = np.arange(256)[None, :]
+    lut = (cr >= cr_range[0]) & (cr <= cr_range[1]) & (cb >= cb_range[0]) & (cb <= cb_range[1])
+    return lut.astype(np.uint8).ravel()
+
 
 class SkinSegmentation:
+    """
+    Сегментация кожи по предрассчитанной таблице Cr/Cb: на кроп - одно
+    преобразование в YCrCb и одна выборка из таблицы, затем морфология OpenCV.
+    Маски - uint8 со значениями 0/1.
+    """
+    # Включительные границы (прежнее правило 135 < Cr < 180, 85 < Cb < 135)
+    CR_RANGE = (136, 179)
+    CB_RANGE = (86, 134)
+    LUT = _build_cr_cb_lut(CR_RANGE, CB_RANGE)
+
+    _open_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+    _close_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7))
+
     @staticmethod
-    def simple_skin_mask(roi_bgr: np.ndarray) -> np.ndarray:
-        ycrcb = ColorConverter.to_ycrcb(roi_bgr)
-        Y, Cr, Cb = cv2.split(ycrcb)
-        mask = (Cr > 135) & (Cr < 180) & (Cb > 85) & (Cb < 135)
-        mask = morphology.remove_small_objects(mask, min_size=100)
-        return mask.astype(np.uint8)
-    
-    @staticmethod
-    def advanced_skin_mask(roi_bgr: np.ndarray) -> np.ndarray:
-        hsv = ColorConverter.to_hsv(roi_bgr)
-        ycrcb = ColorConverter.to_ycrcb(roi_bgr)
-        
-        h, s, v = cv2.split(hsv)
-        Y, Cr, Cb = cv2.split(ycrcb)
-        
-        mask1 = (Cr > 135) & (Cr < 180) & (Cb > 85) & (Cb < 135)
-        mask2 = (h >= 0) & (h <= 50) & (s > 30) & (v > 40)
-        
-        combined = mask1 | mask2
-        combined = morphology.remove_small_objects(combined, min_size=150)
-        combined = morphology.binary_closing(combined, morphology.disk(3))
-        
-        return combined.astype(np.uint8)
+    def lookup(roi_bgr: np.ndarray) -> np.ndarray:
+        """Попиксельная маска кожи без морфологии."""
+        _, cr, cb = cv2.split(ColorConverter.to_ycrcb(roi_bgr))
+        # Индекс сразу в intp: np.take не делает лишнего преобразования типа
+        index = (cr.astype(np.intp) << 8) | cb
+        return np.take(SkinSegmentation.LUT, index)
 
+    @staticmethod
+    def skin_mask(roi_bgr: np.ndarray) -> np.ndarray:
+        """Маска кожи: открытие убирает одиночные пиксели фона, закрытие - дыры от пор и бликов."""
+        mask = SkinSegmentation.lookup(roi_bgr)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, SkinSegmentation._open_kernel)
+        return cv2.morphologyEx(mask, cv2.MORPH_CLOSE, SkinSegmentation._close_kernel)
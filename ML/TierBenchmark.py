@@ -0,0 +1,139 @@
+"""
+Замер ошибки уровней качества относительно full на эталонном корпусе.
+
+    python TierBenchmark.py ../frontend/backend/uploads --limit 20 --json tiers.json
+
+Каждый снимок анализируется всеми уровнями из QualityTiers.TIERS в одном процессе
+(последовательно, чтобы время было сопоставимо). Для каждого уровня выводится
+таблица: средняя и максимальная абсолютная ошибка по каждой метрике и по
+overall_score, медианное время анализа и ускорение относительно full. Ошибка
+зависит от точек MediaPipe и маски кожи, поэтому замер повторяется на реальных
+снимках после каждого изменения пайплайна.
+
+Опубликованная таблица лежит в tier_error.json (отдаётся GET /tiers), в блоке
+measured - когда, на каком корпусе и с какими точками лица она снята:
+
+    python TierBenchmark.py ../frontend/backend/uploads --json tier_error.json --note "..."
+"""
+from typing import Dict, List, Optional, Any
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from Reprocess import iter_images
+from QualityTiers import TIERS
+
+
+def benchmark(root: str, limit: Optional[int] = None, budget_mb: Optional[float] = None) -> Dict[str, Any]:
+    from FaceAnalyzer import FaceAnalyzer
+    from BatchAnalyzer import SkinHealthReport
+    from MemoryBudget import MemoryBudget
+
+    analyzer = FaceAnalyzer(metric_workers=0)
+    budget = MemoryBudget(budget_mb)
+    metrics: Dict[str, List[Dict[str, float]]] = {name: [] for name in TIERS}
+    scores: Dict[str, List[float]] = {name: [] for name in TIERS}
+    times: Dict[str, List[float]] = {name: [] for name in TIERS}
+    images = 0
+
+    for rel_path, _ in iter_images(root):
+        if limit is not None and images >= limit:
+            break
+        with open(os.path.join(root, rel_path), 'rb') as f:
+            img = budget.decode(f.read())
+        if img is None:
+            continue
+        results = {}
+        try:
+            for name in TIERS:
+                start = time.perf_counter()
+                results[name], _ = analyzer.analyze(img, quality=name)
+                times[name].append(time.perf_counter() - start)
+        except Exception as e:
+            print(f"⚠️ {rel_path}: {e}")
+            continue
+        for name, values in results.items():
+            metrics[name].append(values)
+            scores[name].append(SkinHealthReport.generate_report(values)['overall_score'])
+        images += 1
+        print(f"🔍 {rel_path}: " + ', '.join(f"{name} {times[name][-1] * 1000:.0f} мс" for name in TIERS))
+
+    summary = {
+        'images': images,
+        'measured': {
+            'date': date.today().isoformat(),
+            'corpus': os.path.basename(os.path.normpath(root)),
+            'images': images,
+            'memory_budget_mb': round(budget.budget_bytes / 2**20, 1),
+            'algorithm_version': FaceAnalyzer.ALGORITHM_VERSION
+        },
+        'tiers': {}
+    }
+    if not images:
+        return summary
+    reference = metrics['full']
+    full_ms = float(np.median(times['full'])) * 1000
+    for name in TIERS:
+        errors = {}
+        for key in FaceAnalyzer.METRIC_ORDER:
+            diff = np.abs([m[key] - r[key] for m, r in zip(metrics[name], reference)])
+            errors[key] = {'mae': round(float(np.nanmean(diff)), 4), 'max': round(float(np.nanmax(diff)), 4)}
+        score_diff = np.abs(np.array(scores[name]) - np.array(scores['full']))
+        median_ms = float(np.median(times[name])) * 1000
+        summary['tiers'][name] = {
+            'median_ms': round(median_ms, 1),
+            'speedup': round(full_ms / median_ms, 2),
+            'overall_score': {'mae': round(float(score_diff.mean()), 3), 'max': round(float(score_diff.max()), 3)},
+            'metrics': errors
+        }
+    return summary
+
+
+def markdown_table(summary: Dict[str, Any]) -> str:
+    tiers = list(summary['tiers'])
+    lines = ['| | ' + ' | '.join(tiers) + ' |', '|---|' + '---|' * len(tiers)]
+    lines.append('| медиана, мс | ' + ' | '.join(
+        f"{summary['tiers'][t]['median_ms']} (×{summary['tiers'][t]['speedup']})" for t in tiers) + ' |')
+    lines.append('| overall_score | ' + ' | '.join(
+        f"{summary['tiers'][t]['overall_score']['mae']} / {summary['tiers'][t]['overall_score']['max']}"
+        for t in tiers) + ' |')
+    for key in summary['tiers'][tiers[0]]['metrics']:
+        lines.append(f'| {key} | ' + ' | '.join(
+            f"{summary['tiers'][t]['metrics'][key]['mae']} / {summary['tiers'][t]['metrics'][key]['max']}"
+            for t in tiers) + ' |')
+    return '\n'.join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Ошибка уровней качества относительно full')
+    parser.add_argument('root', help='Каталог эталонного корпуса (обходится рекурсивно)')
+    parser.add_argument('--limit', type=int, default=None, help='Не больше N снимков')
+    parser.add_argument('--memory-budget-mb', type=float, default=None,
+                        help='Бюджет памяти на один снимок (0 - без ограничения); '
+                             'по умолчанию ML_MEMORY_BUDGET_MB, как у сервиса')
+    parser.add_argument('--json', default=None, help='Сохранить сводку в JSON')
+    parser.add_argument('--note', default=None, help='Условия замера для блока measured (например, источник точек лица)')
+    args = parser.parse_args(argv)
+
+    summary = benchmark(args.root, limit=args.limit, budget_mb=args.memory_budget_mb)
+    if not summary['images']:
+        print("❌ Не удалось проанализировать ни одного снимка")
+        return 1
+    print(f"\nСнимков: {summary['images']}; ошибка относительно full: средняя / максимальная\n")
+    print(markdown_table(summary))
+    if args.note:
+        summary['measured']['note'] = args.note
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,183 @@
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional, Any
+import json
+import numpy as np
+
+# Изменения меньше этого считаются шумом округления, а не трендом
+STABLE_EPS = 1e-9
+
+
+@dataclass
+class MetricTrend:
+    window: int = 5
+    alpha: float = 0.3
+    count: int = 0
+    mean: float = 0.0
+    m2: float = 0.0
+    min: Optional[float] = None
+    max: Optional[float] = None
+    first: Optional[float] = None
+    last: Optional[float] = None
+    ewm_mean: Optional[float] = None
+    ewm_var: float = 0.0
+    recent: List[float] = field(default_factory=list)
+    mean_t: float = 0.0
+    m2_t: float = 0.0
+    c_ty: float = 0.0
+    first_t: Optional[float] = None
+    last_t: Optional[float] = None
+
+    def update(self, value: float, t: Optional[float] = None) -> None:
+        value = float(value)
+        t = float(self.count if t is None else t)
+
+        self.count += 1
+        dt = t - self.mean_t
+        self.mean_t += dt / self.count
+        dv = value - self.mean
+        self.mean += dv / self.count
+        self.m2 += dv * (value - self.mean)
+        self.m2_t += dt * (t - self.mean_t)
+        self.c_ty += dt * (value - self.mean)
+
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if self.first is None:
+            self.first = value
+            self.first_t = t
+        self.last = value
+        self.last_t = t
+
+        if self.ewm_mean is None:
+            self.ewm_mean = value
+        else:
+            diff = value - self.ewm_mean
+            self.ewm_mean += self.alpha * diff
+            self.ewm_var = (1.0 - self.alpha) * (self.ewm_var + self.alpha * diff ** 2)
+
+        self.recent.append(value)
+        if len(self.recent) > self.window:
+            del self.recent[0]
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / self.count if self.count > 0 else 0.0
+
+    @property
+    def std(self) -> float:
+        return float(np.sqrt(self.variance))
+
+    @property
+    def slope(self) -> float:
+        return self.c_ty / self.m2_t if self.m2_t > 0 else 0.0
+
+    @property
+    def fitted_change(self) -> float:
+        """Изменение по линии регрессии за всю историю: наклон, умноженный на охваченный интервал."""
+        if self.count < 2 or self.last_t is None:
+            return 0.0
+        first_t = self.first_t if self.first_t is not None else 0.0
+        return self.slope * (self.last_t - first_t)
+
+    @property
+    def rolling_mean(self) -> float:
+        return float(np.mean(self.recent)) if self.recent else 0.0
+
+    @property
+    def rolling_std(self) -> float:
+        return float(np.std(self.recent)) if self.recent else 0.0
+
+    def trend(self) -> str:
+        # По знаку наклона, а не по первому и последнему значению - один выброс на краю не меняет вывод
+        change = self.fitted_change
+        if abs(change) < STABLE_EPS:
+            return 'стабильно'
+        return 'улучшение' if change < 0 else 'ухудшение'
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'std': self.std,
+            'min': self.min,
+            'max': self.max,
+            'ewm_mean': self.ewm_mean,
+            'ewm_std': float(np.sqrt(self.ewm_var)),
+            'rolling_mean': self.rolling_mean,
+            'rolling_std': self.rolling_std,
+            'slope': self.slope,
+            'trend': self.trend()
+        }
+
+
+class UserTrend:
+    SCORE_KEY = 'overall_score'
+
+    def __init__(self, window: int = 5, alpha: float = 0.3):
+        self.window = window
+        self.alpha = alpha
+        self.observations = 0
+        self.metrics: Dict[str, MetricTrend] = {}
+
+    def update(self, metrics: Dict[str, float], overall_score: Optional[float] = None,
+               t: Optional[float] = None) -> None:
+        # Без явного времени - общий номер анализа для всех метрик: метрика, которой не было
+        # в части анализов, остаётся на той же оси, что и остальные
+        if t is None:
+            t = float(self.observations)
+        self.observations += 1
+        for key, value in metrics.items():
+            self._get(key).update(value, t)
+        if overall_score is not None:
+            self._get(self.SCORE_KEY).update(overall_score, t)
+
+    def _get(self, key: str) -> MetricTrend:
+        if key not in self.metrics:
+            self.metrics[key] = MetricTrend(window=self.window, alpha=self.alpha)
+        return self.metrics[key]
+
+    def comparisons(self) -> Dict[str, Dict[str, Any]]:
+        return {key: acc.summary() for key, acc in self.metrics.items() if key != self.SCORE_KEY}
+
+    def overall_trend(self) -> str:
+        score = self.metrics.get(self.SCORE_KEY)
+        if score is None or score.count < 2:
+            return 'недостаточно данных'
+
+        # Прежние пороги применяются к изменению по линии регрессии вместо last - first
+        change = score.fitted_change
+        if change > 0.05:
+            return 'значительное улучшение'
+        elif change >= STABLE_EPS:
+            return 'улучшение'
+        elif change < -0.05:
+            return 'значительное ухудшение'
+        elif change <= -STABLE_EPS:
+            return 'ухудшение'
+        else:
+            return 'стабильно'
+
+    def report(self) -> Dict[str, Any]:
+        return {'comparisons': self.comparisons(), 'overall_trend': self.overall_trend()}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'window': self.window,
+            'alpha': self.alpha,
+            'observations': self.observations,
+            'metrics': {key: asdict(acc) for key, acc in self.metrics.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict[str, Any]) -> 'UserTrend':
+        trend = cls(window=state.get('window', 5), alpha=state.get('alpha', 0.3))
+        trend.metrics = {key: MetricTrend(**acc) for key, acc in state.get('metrics', {}).items()}
+        trend.observations = state.get('observations', max((acc.count for acc in trend.metrics.values()), default=0))
+        return trend
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, payload: Optional[str]) -> 'UserTrend':
+        return cls.from_dict(json.loads(payload)) if payload else cls()
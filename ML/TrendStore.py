@@ -0,0 +1,85 @@
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from TrendAccumulator import UserTrend
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS trends (
+    user_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    recent_analysis_ids TEXT NOT NULL DEFAULT '[]',
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class TrendStore:
+    """
+    Состояние UserTrend по пользователям в SQLite. Каждый анализ обновляет только
+    строку своего пользователя (чтение, update за O(1), запись в одной транзакции),
+    запрос тренда читает одну строку - история анализов не перечитывается.
+    Повтор недавнего analysis_id (объединённые одинаковые запросы и повторы в пределах
+    ML_COALESCE_GRACE_S) не учитывается дважды.
+    """
+    RECENT_IDS = 16
+
+    def __init__(self, path: Optional[str] = None):
+        if path is None:
+            path = os.environ.get('ML_TRENDS_DB') or os.path.join(os.path.dirname(__file__), 'trends', 'trends.sqlite3')
+        self.path = path
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection().executescript(_SCHEMA)
+
+    def update(self, user_id: str, metrics: Dict[str, float], overall_score: Optional[float] = None,
+               analysis_id: Optional[str] = None) -> UserTrend:
+        db = self._connection()
+        with _transaction(db):
+            row = db.execute("SELECT state, recent_analysis_ids FROM trends WHERE user_id = ?",
+                             (user_id,)).fetchone()
+            trend = UserTrend.from_json(row['state'] if row is not None else None)
+            recent = json.loads(row['recent_analysis_ids']) if row is not None else []
+            if analysis_id is not None:
+                if analysis_id in recent:
+                    return trend
+                recent = (recent + [analysis_id])[-self.RECENT_IDS:]
+            trend.update(metrics, overall_score)
+            db.execute("INSERT OR REPLACE INTO trends (user_id, state, recent_analysis_ids, updated_at) "
+                       "VALUES (?, ?, ?, ?)", (user_id, trend.to_json(), json.dumps(recent), time.time()))
+        return trend
+
+    def get(self, user_id: str) -> Optional[UserTrend]:
+        row = self._connection().execute("SELECT state FROM trends WHERE user_id = ?", (user_id,)).fetchone()
+        return UserTrend.from_json(row['state']) if row is not None else None
+
+    def stats(self) -> Dict[str, Any]:
+        return {'users': self._connection().execute("SELECT COUNT(*) FROM trends").fetchone()[0]}
+
+    def _connection(self) -> sqlite3.Connection:
+        # Как и в JobQueue - по соединению на поток
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+
+@contextmanager
+def _transaction(db: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    # Чтение и запись состояния одного пользователя атомарны для параллельных запросов
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield db
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
@@ -0,0 +1,77 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+import os
+import threading
+import numpy as np
+
+# Буферы одного Workspace больше этого объёма не возвращаются в пул (кадр заметно крупнее обычного)
+MAX_WORKSPACE_BYTES = int(float(os.environ.get('ML_WORKSPACE_MB', '128')) * 2**20)
+
+
+class Workspace:
+    """
+    Набор переиспользуемых буферов промежуточных плоскостей метрик. Буфер
+    определяется ролью (name) и dtype; под ним лежит плоский массив, который
+    растёт с запасом и отдаётся непрерывным представлением нужной формы, поэтому
+    кропы лица разного размера используют одну и ту же память. Ядра метрик пишут
+    в буферы через dst= OpenCV и out= NumPy. Буфер с данной ролью действителен до
+    следующего get() с той же ролью - внутри одной функции роли не повторяются.
+    """
+    GROWTH = 1.25
+
+    def __init__(self):
+        self._buffers: Dict[Tuple[str, str], np.ndarray] = {}
+        self.nbytes = 0
+        self.allocations = 0
+
+    def get(self, name: str, shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape))
+        key = (name, dtype.str)
+        buf = self._buffers.get(key)
+        if buf is None or buf.size < size:
+            if buf is not None:
+                self.nbytes -= buf.nbytes
+                size_alloc = max(size, int(buf.size * self.GROWTH))
+            else:
+                size_alloc = size
+            buf = self._buffers[key] = np.empty(size_alloc, dtype)
+            self.nbytes += buf.nbytes
+            self.allocations += 1
+        return buf[:size].reshape(shape)
+
+    def mask(self, name: str, skin_mask: np.ndarray) -> np.ndarray:
+        """Булева маска ненулевых пикселей без отдельного astype."""
+        return np.not_equal(skin_mask, 0, out=self.get(name, skin_mask.shape, np.bool_))
+
+
+_current: ContextVar[Optional[Workspace]] = ContextVar('workspace', default=None)
+_pool: List[Workspace] = []
+_pool_lock = threading.Lock()
+
+
+@contextmanager
+def workspace() -> Iterator[Workspace]:
+    """Берёт Workspace из пула процесса и делает его текущим для вложенных вызовов."""
+    with _pool_lock:
+        ws = _pool.pop() if _pool else Workspace()
+    token = _current.set(ws)
+    try:
+        yield ws
+    finally:
+        _current.reset(token)
+        if ws.nbytes <= MAX_WORKSPACE_BYTES:
+            with _pool_lock:
+                _pool.append(ws)
+
+
+def current_workspace() -> Workspace:
+    """Текущий Workspace; вне workspace() - новый, буферы которого живут только до конца вызова."""
+    ws = _current.get()
+    return ws if ws is not None else Workspace()
+
+
+def pool_stats() -> Dict[str, float]:
+    with _pool_lock:
+        return {'idle': len(_pool), 'mb': round(sum(ws.nbytes for ws in _pool) / 2**20, 1)}
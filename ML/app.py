@@ -1,10 +1,15 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import cv2
 import numpy as np
 import os
 import sys
 import json
+import random
+import hashlib
+import sqlite3
+import threading
 import traceback
+import uuid
 
 # Add current directory to path for imports
 current_dir = os.path.dirname(__file__)
@@ -12,8 +17,96 @@ sys.path.insert(0, current_dir)
 print(f"✅ Current directory: {current_dir}")
 print(f"✅ Python path: {sys.path}")
 
+from Instrumentation import StageRecorder, StackSampler, stage
+from MemoryBudget import MemoryBudget
+from QualityGate import QualityGate
+from ResponseFormat import ResponseFormat
+from OverlayCache import OverlayCache
+from SharedFrames import AnalysisProcessPool
+from QualityTiers import TIERS, get_tier, describe_tiers
+from SingleFlight import SingleFlight
+from Workspace import pool_stats
+from JobQueue import JobQueue, JobWorkers, QueueFull, iso_time, validate_callback_url
+from TrendStore import TrendStore
+
 app = Flask(__name__)
 
+# Замер пиковой памяти по стадиям - только для диагностики по одному запросу: tracemalloc и его пик
+# общие на процесс, поэтому запросы с замером выполняются строго по очереди
+TRACK_MEMORY = os.environ.get('ML_TRACK_MEMORY', '0') == '1'
+memory_budget = MemoryBudget()
+# ML_QUALITY_GATE: flag (по умолчанию) - только причины в ответе, reject - непригодные снимки не анализируются, off
+quality_gate = QualityGate()
+overlay_cache = OverlayCache()
+
+# Анализ в отдельных процессах (кадры передаются через разделяемую память); 0 - в потоке запроса
+ANALYSIS_PROCESSES = int(os.environ.get('ML_ANALYSIS_PROCESSES', '0'))
+analysis_pool = None
+
+def _get_analysis_pool():
+    # Пул создаётся при первом запросе, а не при импорте - иначе перезапуск в debug-режиме плодит процессы
+    global analysis_pool
+    if analysis_pool is None:
+        analysis_pool = AnalysisProcessPool(ANALYSIS_PROCESSES)
+    return analysis_pool
+
+# Одновременные запросы с одинаковыми байтами снимка выполняются один раз; готовый результат
+# ещё ML_COALESCE_GRACE_S секунд отдаётся повторам (двойная отправка, ретраи). ML_COALESCE=0 - выключено
+single_flight = SingleFlight() if os.environ.get('ML_COALESCE', '1') == '1' else None
+# Результаты, которые можно отдавать повторам: ошибки и упрощённый анализ при перегрузке - нет
+COALESCE_KEEP_TYPES = ('full_analysis', 'quality_rejected')
+
+# Сброс нагрузки: одновременно выполняется не больше ML_MAX_FULL_ANALYSES полных анализов,
+# остальные запросы получают упрощённый анализ SimpleFaceAnalyzer; 0 - без ограничения
+MAX_FULL_ANALYSES = int(os.environ.get('ML_MAX_FULL_ANALYSES', '0'))
+full_analysis_slots = threading.BoundedSemaphore(MAX_FULL_ANALYSES) if MAX_FULL_ANALYSES > 0 else None
+
+# Асинхронные задания: POST /jobs кладёт снимок в очередь SQLite (ML_JOBS_DB) и сразу отвечает id,
+# ML_JOB_WORKERS потоков анализируют задания по очереди; 0 - интерфейс заданий выключен
+JOB_WORKERS = int(os.environ.get('ML_JOB_WORKERS', '1'))
+job_workers = None
+job_workers_lock = threading.Lock()
+
+def _get_job_workers():
+    # Как и пул процессов - создаётся при первом запросе, а не при импорте
+    global job_workers
+    if job_workers is None:
+        with job_workers_lock:
+            if job_workers is None:
+                workers = JobWorkers(JobQueue(), _run_job, lambda job_id: _job_body(workers.queue.get(job_id)),
+                                     workers=JOB_WORKERS)
+                workers.start()
+                job_workers = workers
+    return job_workers
+
+# Тренды по пользователям: анализ с user_id обновляет состояние UserTrend в SQLite (ML_TRENDS_DB),
+# GET /trends/<user_id> читает его без пересчёта истории
+trend_store = None
+trend_store_lock = threading.Lock()
+MAX_USER_ID_LENGTH = 128
+
+def _get_trend_store():
+    global trend_store
+    if trend_store is None:
+        with trend_store_lock:
+            if trend_store is None:
+                trend_store = TrendStore()
+    return trend_store
+
+# Профиль запроса по флагу profile доступен только с токеном из ML_PROFILE_TOKEN
+PROFILE_TOKEN = os.environ.get('ML_PROFILE_TOKEN', '')
+PROFILE_SAMPLE_RATE = float(os.environ.get('ML_PROFILE_SAMPLE_RATE', '0'))
+stack_sampler = StackSampler(
+    os.environ.get('ML_PROFILE_DIR') or os.path.join(current_dir, 'profiles'),
+    interval=float(os.environ.get('ML_PROFILE_INTERVAL_MS', '10')) / 1000.0
+) if PROFILE_SAMPLE_RATE > 0 else None
+
+@app.before_request
+def start_job_workers():
+    # Задания, оставшиеся в очереди после перезапуска, подхватываются с первым же запросом (healthcheck)
+    if JOB_WORKERS > 0:
+        _get_job_workers()
+
 @app.route('/health', methods=['GET'])
 def health():
     return jsonify({
@@ -21,8 +114,16 @@ def health():
         "service": "ML",
         "endpoints": {
             "health": "GET /health",
-            "analyze": "POST /analyze"
-        }
+            "analyze": "POST /analyze (profile=1 with X-Profile-Token for a timing breakdown)",
+            "schema": "GET /schema",
+            "tiers": "GET /tiers",
+            "overlay": "GET /overlay/<analysis_id>",
+            "jobs": "POST /jobs (same fields as /analyze plus callback_url), GET /jobs/<job_id>",
+            "trends": "GET /trends/<user_id> (analyses sent with user_id)"
+        },
+        "coalescing": single_flight.stats() if single_flight is not None else None,
+        "workspaces": pool_stats(),
+        "jobs": job_workers.queue.stats() if job_workers is not None else None
     })
 
 @app.route('/analyze', methods=['POST'])
@@ -32,28 +133,231 @@ def analyze():
     Expects multipart/form-data with 'file' field
     """
     print("📨 Received request to /analyze")
+    file, error = _uploaded_file()
+    if error is not None:
+        return error
+
+    profile = request.form.get('profile', '').lower() in ('1', 'true')
+    if profile and (not PROFILE_TOKEN or request.headers.get('X-Profile-Token') != PROFILE_TOKEN):
+        print("❌ Profiling not permitted")
+        return jsonify({"error": "Profiling not permitted"}), 403
+
+    tier, error = _requested_tier()
+    if error is not None:
+        return error
+    user_id, error = _requested_user()
+    if error is not None:
+        return error
+
+    response_format = ResponseFormat.from_request(request)
+    sampled = stack_sampler is not None and random.random() < PROFILE_SAMPLE_RATE
+    recorder = StageRecorder('analyze', track_memory=TRACK_MEMORY, trace_calls=profile,
+                             sampler=stack_sampler if sampled else None)
+    image_data = file.read()
+    with recorder.activate():
+        if single_flight is None or profile:
+            payload, status = _analyze_file(image_data, response_format, tier.name)
+        else:
+            # Ключ включает всё, от чего зависит тело ответа до выбора полей
+            key = ':'.join((hashlib.sha256(image_data).hexdigest(), tier.name,
+                            str(int(response_format.wants('formatted_report')))))
+            (payload, status), shared = single_flight.run(
+                key, lambda: _analyze_file(image_data, response_format, tier.name),
+                keep=lambda result: result[1] == 200 and result[0].get('analysis_type') in COALESCE_KEEP_TYPES)
+            # Результат общий для объединённых запросов - дальше меняется только копия
+            payload = dict(payload)
+            if shared is not None:
+                print(f"🔁 Coalesced with an identical request ({shared})")
+                payload['coalesced'] = shared
+    for path, entry in recorder.flat().items():
+        if path.count('/') <= 3:
+            print(f"⏱️ {path}: {entry}")
+    if user_id is not None and status == 200:
+        _record_trend(user_id, payload)
+
+    if profile:
+        payload['profile'] = recorder.report()
+    return response_format.render(payload, status)
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Queue face image analysis and return the job id immediately (202).
+    Same multipart fields as /analyze plus optional callback_url, which receives
+    a POST with the GET /jobs/<job_id> body once the job is finished. The callback
+    host must be listed in ML_JOB_CALLBACK_HOSTS; redirects are not followed
+    """
+    print("📨 Received request to /jobs")
+    if JOB_WORKERS <= 0:
+        return jsonify({"error": "Job queue disabled"}), 503
+    file, error = _uploaded_file()
+    if error is not None:
+        return error
+    tier, error = _requested_tier()
+    if error is not None:
+        return error
+    user_id, error = _requested_user()
+    if error is not None:
+        return error
+
+    callback_url = (request.args.get('callback_url') or request.form.get('callback_url') or '').strip() or None
+    if callback_url is not None:
+        callback_error = validate_callback_url(callback_url)
+        if callback_error is not None:
+            print(f"❌ {callback_error}")
+            return jsonify({"error": callback_error}), 400
+
+    # Поля и компактный режим фиксируются при постановке - по ним же собирается тело обратного вызова
+    response_format = ResponseFormat.from_request(request)
+    options = {'quality': tier.name, 'fields': sorted(response_format.fields), 'compact': response_format.compact,
+               'user_id': user_id}
+    workers = _get_job_workers()
+    try:
+        job_id = workers.queue.submit(file.read(), options, callback_url)
+    except QueueFull as e:
+        print(f"⚠️ Job queue is full: {e}")
+        return jsonify({"error": "Job queue is full"}), 503
+    workers.notify()
+    print(f"📥 Job {job_id} queued ({tier.name})")
+
+    response = response_format.encode({"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}, 202)
+    response.headers['Location'] = f"/jobs/{job_id}"
+    return response
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Job status (queued, running, done, failed) and, once finished, the standard /analyze payload in result"""
+    if JOB_WORKERS <= 0:
+        return jsonify({"error": "Job queue disabled"}), 503
+    job = _get_job_workers().queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return ResponseFormat.from_request(request).encode(_job_body(job))
+
+@app.route('/trends/<user_id>', methods=['GET'])
+def get_trend(user_id):
+    """Per-metric statistics and overall trend accumulated from the user's analyses"""
+    trend = _get_trend_store().get(user_id)
+    if trend is None:
+        return jsonify({"error": "No analyses for this user"}), 404
+    return jsonify({"user_id": user_id, "observations": trend.observations, **trend.report()})
+
+@app.route('/schema', methods=['GET'])
+def schema():
+    return jsonify(ResponseFormat.schema())
+
+@app.route('/tiers', methods=['GET'])
+def tiers():
+    """Quality tiers with their algorithm variants and the error table from tier_error.json, if present"""
+    return jsonify(describe_tiers())
+
+@app.route('/overlay/<analysis_id>', methods=['GET'])
+def overlay(analysis_id):
+    """
+    JPEG with face regions and metrics for a previous /analyze call.
+    Rendered on first request from cached landmarks, then served from the LRU cache
+    """
+    from FaceAnalyzer import FaceAnalyzer
+    jpeg = overlay_cache.get_jpeg(analysis_id, FaceAnalyzer().render_overlay)
+    if jpeg is None:
+        return jsonify({"error": "Overlay not found"}), 404
+    return Response(jpeg, mimetype='image/jpeg', headers={'Cache-Control': 'private, max-age=3600'})
+
+def _uploaded_file():
     if 'file' not in request.files:
         print("❌ No file in request")
-        return jsonify({"error": "No file provided"}), 400
+        return None, (jsonify({"error": "No file provided"}), 400)
 
     file = request.files['file']
     if file.filename == '':
         print("❌ Empty filename")
-        return jsonify({"error": "No file selected"}), 400
+        return None, (jsonify({"error": "No file selected"}), 400)
+    return file, None
+
+def _requested_tier():
+    # Уровень качества анализа: full (по умолчанию ML_QUALITY_TIER), balanced или fast
+    try:
+        return get_tier((request.args.get('quality') or request.form.get('quality') or '').strip() or None), None
+    except ValueError:
+        print("❌ Unknown quality tier")
+        return None, (jsonify({"error": "Unknown quality tier", "tiers": list(TIERS)}), 400)
+
+def _requested_user():
+    user_id = (request.args.get('user_id') or request.form.get('user_id') or '').strip() or None
+    if user_id is not None and len(user_id) > MAX_USER_ID_LENGTH:
+        print("❌ user_id is too long")
+        return None, (jsonify({"error": "user_id is too long"}), 400)
+    return user_id, None
+
+def _record_trend(user_id, payload):
+    # В тренд идут только полные анализы: упрощённый считает другой набор метрик
+    if payload.get('analysis_type') != 'full_analysis':
+        return
+    try:
+        trend = _get_trend_store().update(user_id, payload['metrics'], payload.get('overall_score'),
+                                          payload.get('analysis_id'))
+        print(f"📈 Trend for {user_id}: {trend.observations} analyses, {trend.overall_trend()}")
+    except sqlite3.Error as e:
+        # Ошибка хранилища трендов не должна отменять готовый анализ
+        print(f"❌ Trend store error: {e}")
+
+def _run_job(job):
+    options = job['options']
+    response_format = ResponseFormat(fields=options['fields'], compact=options['compact'])
+    # Задание ждёт свободный слот полного анализа, а не получает упрощённый
+    payload, status = _analyze_file(job['image'], response_format, options['quality'], shed=False)
+    if options.get('user_id') and status == 200:
+        _record_trend(options['user_id'], payload)
+    return payload, status
 
+def _job_body(job):
+    result = job['result']
+    if result is not None:
+        options = job['options']
+        result = ResponseFormat(fields=options['fields'], compact=options['compact']).select(result)
+    return {
+        "job_id": job['id'],
+        "status": job['status'],
+        "attempts": job['attempts'],
+        "created_at": iso_time(job['created_at']),
+        "updated_at": iso_time(job['updated_at']),
+        "finished_at": iso_time(job['finished_at']),
+        "error": job['error'],
+        "callback_status": job['callback_status'],
+        "result_status": job['result_status'],
+        "result": result
+    }
+
+def _analyze_file(image_data, response_format, quality_tier, shed=True):
     try:
         # Read and validate image
         print("🖼️ Reading image data...")
-        image_data = file.read()
-        nparr = np.frombuffer(image_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        with stage('decode'):
+            img = memory_budget.decode(image_data)
 
         if img is None:
             print("❌ Failed to decode image")
-            return jsonify({"error": "Invalid image format"}), 400
+            return {"error": "Invalid image format"}, 400
 
         print(f"🖼️ Image loaded successfully, shape: {img.shape}")
 
+        quality = None
+        if quality_gate.enabled:
+            with stage('quality'):
+                quality = quality_gate.check(img)
+            if quality_gate.should_reject(quality):
+                print(f"❌ Quality check failed: {[r['code'] for r in quality['reasons']]}")
+                return {
+                    "status": "rejected",
+                    "analysis_type": "quality_rejected",
+                    "quality": quality,
+                    "metrics": {}
+                }, 200
+
+        if full_analysis_slots is not None and not full_analysis_slots.acquire(blocking=not shed):
+            print("⚠️ Full analysis queue is saturated, falling back to simple analysis")
+            return _simple_analysis(img, response_format, 'load_shed', quality), 200
+
         # Try full analysis with mediapipe first, fallback to simple analysis
         try:
             print("🔄 Attempting full analysis with FaceAnalyzer...")
@@ -61,114 +365,159 @@ def analyze():
             from BatchAnalyzer import SkinHealthReport
             print("✅ FaceAnalyzer and SkinHealthReport imported successfully")
 
-            analyzer = FaceAnalyzer()
-            print("🔍 Starting face analysis...")
-            metrics, visualization = analyzer.analyze(img, visualize=False)
+            print(f"🔍 Starting face analysis ({quality_tier})...")
+            if ANALYSIS_PROCESSES > 0:
+                with stage('analysis_process'):
+                    metrics, landmarks_xy, analyzed_img = _get_analysis_pool().analyze(img, quality=quality_tier)
+            else:
+                analyzer = FaceAnalyzer()
+                metrics, landmarks_xy, analyzed_img = analyzer.analyze_with_landmarks(
+                    img, memory_budget=memory_budget, quality=quality_tier)
             print(f"✅ Analysis completed, metrics: {list(metrics.keys())}")
 
+            analysis_id = uuid.uuid4().hex
+            with stage('overlay_cache'):
+                overlay_cache.put(analysis_id, analyzed_img, landmarks_xy, metrics)
+
             report = SkinHealthReport.generate_report(metrics)
             print("✅ Report generated successfully")
 
-            # Create formatted report string
-            report_lines = []
-            report_lines.append("=== МЕТРИКИ АНАЛИЗА КОЖИ ===")
-            for key, value in sorted(metrics.items()):
-                report_lines.append(f"{key:20s}: {value:.3f}")
-
-            report_lines.append("\n=== ОБЩАЯ ОЦЕНКА ===")
-            report_lines.append(f"Оценка состояния кожи: {report.get('overall_score', 0):.2%}")
-
-            concerns = report.get('concerns', [])
-            if concerns:
-                report_lines.append("\n=== ВЫЯВЛЕННЫЕ ПРОБЛЕМЫ ===")
-                for concern in concerns:
-                    report_lines.append(f"  - {concern}")
-
-            recommendations = report.get('recommendations', [])
-            report_lines.append("\n=== РЕКОМЕНДАЦИИ ===")
-            for rec in recommendations:
-                report_lines.append(f"  - {rec}")
-
-            formatted_report = "\n".join(report_lines)
-
             print("📊 Returning full analysis results")
-            return jsonify({
+            payload = {
                 "status": "success",
                 "analysis_type": "full_analysis",
+                "analysis_id": analysis_id,
+                "quality_tier": quality_tier,
                 "metrics": metrics,
                 "report": report,
-                "formatted_report": formatted_report,
-                "overall_score": report.get('overall_score', 0)
-            })
+                "overall_score": report.get('overall_score', 0),
+                "memory": memory_budget.describe(img.shape[1], img.shape[0]),
+                "quality": quality
+            }
+            if response_format.wants('formatted_report'):
+                payload["formatted_report"] = _format_full_report(metrics, report)
+            return payload, 200
 
         except ImportError as e:
             print(f"❌ Full analysis failed (ImportError): {e}")
             print("📋 Traceback:")
             traceback.print_exc()
             # Fallback to simple analysis
-            from SimpleFaceAnalyzer import SimpleFaceAnalyzer
-            print("✅ SimpleFaceAnalyzer imported successfully")
-
-            analyzer = SimpleFaceAnalyzer()
-            metrics, visualization = analyzer.analyze(img, visualize=False)
-
-            # Генерируем упрощенный отчет
-            report_lines = []
-            report_lines.append("=== БАЗОВЫЙ АНАЛИЗ ИЗОБРАЖЕНИЯ ===")
-            report_lines.append("⚠️  Внимание: используется упрощенный анализ (mediapipe не установлен)")
-            report_lines.append("")
-
-            for key, value in sorted(metrics.items()):
-                report_lines.append(f"{key:25s}: {value:.3f}")
-
-            report_lines.append("\n=== ИНТЕРПРЕТАЦИЯ РЕЗУЛЬТАТОВ ===")
-            if metrics.get('brightness', 0) < 0.3:
-                report_lines.append("  - Изображение слишком темное")
-            elif metrics.get('brightness', 0) > 0.8:
-                report_lines.append("  - Изображение пересвечено")
-
-            if metrics.get('contrast', 0) < 0.3:
-                report_lines.append("  - Низкая контрастность")
-
-            if metrics.get('skin_tone_consistency', 0) < 0.4:
-                report_lines.append("  - Неравномерный тон кожи")
-
-            report_lines.append("\n=== РЕКОМЕНДАЦИИ ===")
-            report_lines.append("  - Установите mediapipe для полного анализа кожи")
-            report_lines.append("  - Убедитесь в хорошем освещении")
-            report_lines.append("  - Используйте камеру с высоким разрешением")
-
-            formatted_report = "\n".join(report_lines)
-
-            print("📊 Returning simple analysis results")
-            return jsonify({
-                "status": "success",
-                "analysis_type": "simple_analysis",
-                "metrics": metrics,
-                "formatted_report": formatted_report,
-                "note": "Install mediapipe for full facial analysis"
-            })
+            return _simple_analysis(img, response_format, 'mediapipe_unavailable', quality), 200
 
         except Exception as e:
             print(f"❌ Analysis error: {e}")
             print("📋 Traceback:")
             traceback.print_exc()
-            return jsonify({
+            return {
                 "status": "success",
                 "analysis_type": "analysis_error_fallback",
                 "formatted_report": f"Анализ завершен с ограничениями.\nОшибка: {str(e)}",
+                "message": str(e),
                 "metrics": {}
-            })
+            }, 200
+
+        finally:
+            if full_analysis_slots is not None:
+                full_analysis_slots.release()
 
     except Exception as e:
         print(f"❌ General error: {e}")
         print("📋 Traceback:")
         traceback.print_exc()
-        return jsonify({"error": f"Analysis failed: {str(e)}"}), 500
+        return {"error": f"Analysis failed: {str(e)}"}, 500
+
+SIMPLE_ANALYSIS_NOTES = {
+    'mediapipe_unavailable': "Install mediapipe for full facial analysis",
+    'load_shed': "Service is busy, simple analysis was performed"
+}
+
+def _simple_analysis(img, response_format, reason, quality):
+    from SimpleFaceAnalyzer import SimpleFaceAnalyzer
+
+    with stage('simple_analysis'):
+        metrics, _ = SimpleFaceAnalyzer().analyze(img, visualize=False)
+
+    print(f"📊 Returning simple analysis results ({reason})")
+    payload = {
+        "status": "success",
+        "analysis_type": "simple_analysis",
+        "degraded_reason": reason,
+        "metrics": metrics,
+        "quality": quality,
+        "note": SIMPLE_ANALYSIS_NOTES[reason]
+    }
+    if response_format.wants('formatted_report'):
+        payload["formatted_report"] = _format_simple_report(metrics, reason)
+    return payload
+
+def _format_full_report(metrics, report):
+    report_lines = []
+    report_lines.append("=== МЕТРИКИ АНАЛИЗА КОЖИ ===")
+    for key, value in sorted(metrics.items()):
+        report_lines.append(f"{key:20s}: {value:.3f}")
+
+    report_lines.append("\n=== ОБЩАЯ ОЦЕНКА ===")
+    report_lines.append(f"Оценка состояния кожи: {report.get('overall_score', 0):.2%}")
+
+    concerns = report.get('concerns', [])
+    if concerns:
+        report_lines.append("\n=== ВЫЯВЛЕННЫЕ ПРОБЛЕМЫ ===")
+        for concern in concerns:
+            report_lines.append(f"  - {concern}")
+
+    recommendations = report.get('recommendations', [])
+    report_lines.append("\n=== РЕКОМЕНДАЦИИ ===")
+    for rec in recommendations:
+        report_lines.append(f"  - {rec}")
+
+    return "\n".join(report_lines)
+
+def _format_simple_report(metrics, reason='mediapipe_unavailable'):
+    report_lines = []
+    report_lines.append("=== БАЗОВЫЙ АНАЛИЗ ИЗОБРАЖЕНИЯ ===")
+    if reason == 'load_shed':
+        report_lines.append("⚠️  Внимание: сервис перегружен, выполнен упрощенный анализ")
+    else:
+        report_lines.append("⚠️  Внимание: используется упрощенный анализ (mediapipe не установлен)")
+    report_lines.append("")
+
+    for key, value in sorted(metrics.items()):
+        report_lines.append(f"{key:25s}: {value:.3f}")
+
+    report_lines.append("\n=== ИНТЕРПРЕТАЦИЯ РЕЗУЛЬТАТОВ ===")
+    if metrics.get('brightness', 0) < 0.3:
+        report_lines.append("  - Изображение слишком темное")
+    elif metrics.get('brightness', 0) > 0.8:
+        report_lines.append("  - Изображение пересвечено")
+
+    if metrics.get('contrast', 0) < 0.3:
+        report_lines.append("  - Низкая контрастность")
+
+    if metrics.get('skin_tone_consistency', 0) < 0.4:
+        report_lines.append("  - Неравномерный тон кожи")
+
+    report_lines.append("\n=== РЕКОМЕНДАЦИИ ===")
+    if reason == 'load_shed':
+        report_lines.append("  - Повторите анализ позже для полного отчета")
+    else:
+        report_lines.append("  - Установите mediapipe для полного анализа кожи")
+    report_lines.append("  - Убедитесь в хорошем освещении")
+    report_lines.append("  - Используйте камеру с высоким разрешением")
+
+    return "\n".join(report_lines)
 
 if __name__ == '__main__':
     print("🚀 ML Service starting on http://localhost:5000")
     print("📊 Endpoints:")
     print("  GET  /health - Service health check")
     print("  POST /analyze - Analyze face image")
+    print("  GET  /schema - Response schema (metric order, fields, encodings)")
+    print("  GET  /tiers - Quality tiers and their error against full")
+    print("  GET  /overlay/<analysis_id> - Region overlay JPEG for a previous analysis")
+    print("  POST /jobs - Queue face image analysis, returns job id")
+    print("  GET  /jobs/<job_id> - Job status and analysis result")
+    print("  GET  /trends/<user_id> - Accumulated trend for analyses sent with user_id")
+    if TRACK_MEMORY:
+        print("⚠️ ML_TRACK_MEMORY=1: analyses run one at a time, use for diagnostics only")
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -158,7 +158,16 @@ export default function App() {
                                             {(() => {
                                                 try {
                                                     const data = JSON.parse(h.result)
-                                                    return `Состояние: ${Math.round(data.overall_score * 100)}щ`
+                                                    if (typeof data.overall_score === 'number') {
+                                                        return `Состояние: ${Math.round(data.overall_score * 100)}%`
+                                                    }
+                                                    if (data.analysis_type === 'quality_rejected') {
+                                                        return 'Снимок не принят'
+                                                    }
+                                                    if (data.analysis_type === 'simple_analysis') {
+                                                        return 'Упрощённый анализ'
+                                                    }
+                                                    return h.result.substring(0, 50) + '...'
                                                 } catch {
                                                     return h.result.substring(0, 50) + '...'
                                                 }
@@ -68,6 +68,11 @@ export async function uploadImage(file, onUploadProgress) {
     })
 }
 
+// Разметка лица рисуется ML-сервисом лениво и кэшируется; /api/** открыт, подходит для <img src>
+export function overlayUrl(analysisId) {
+    return `${API_BASE}/api/overlay/${encodeURIComponent(analysisId)}`
+}
+
 export async function getAiStatus() {
     if (MOCK_BACKEND) return { data: { ai_status: 'running' } }
     return axiosInstance.get('/api/status')
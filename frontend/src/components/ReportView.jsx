@@ -1,10 +1,13 @@
 // components/ReportView.jsx
 import React, { useEffect, useState } from 'react';
+import { overlayUrl } from '../api';
 
 const ReportView = ({ report }) => {
     const data = JSON.parse(report.result);
     const [animatedScore, setAnimatedScore] = useState(0);
     const [showDetails, setShowDetails] = useState(false);
+    const [showOverlay, setShowOverlay] = useState(false);
+    const [overlayFailed, setOverlayFailed] = useState(false);
     const [isAnimating, setIsAnimating] = useState(true);
 
     // Получаем цвет для диаграммы в зависимости от уровня здоровья
@@ -51,6 +54,24 @@ const ReportView = ({ report }) => {
         setShowDetails(!showDetails);
     };
 
+    // Снимок отклонён проверкой качества - вместо оценки показываем, что исправить
+    if (data.analysis_type === 'quality_rejected') {
+        return (
+            <div className="report-view">
+                <div className="overall-score-card">
+                    <h3>Снимок не подходит для анализа</h3>
+                    <div className="hint">Переснимите фото с учётом подсказок ниже</div>
+                </div>
+                <QualityReasons title="Что исправить" reasons={data.quality?.reasons || []} />
+            </div>
+        );
+    }
+
+    // Упрощённый анализ (перегрузка сервиса, нет mediapipe) и запасные ответы без общей оценки
+    if (typeof data.overall_score !== 'number') {
+        return <DegradedReport data={data} />;
+    }
+
     const scoreColor = getScoreColor(data.overall_score);
     const textColor = getTextColor(data.overall_score);
 
@@ -101,6 +122,11 @@ const ReportView = ({ report }) => {
                 </div>
             </div>
 
+            {/* Предупреждения проверки качества: анализ выполнен, но может быть неточным */}
+            {data.quality?.reasons?.length > 0 && (
+                <QualityReasons title="Качество снимка" reasons={data.quality.reasons} />
+            )}
+
             {/* Аккордеон с детальным анализом */}
             <div className="accordion-section">
                 <button
@@ -138,6 +164,29 @@ const ReportView = ({ report }) => {
                 </div>
             </div>
 
+            {/* Разметка лица: запрашивается только при раскрытии */}
+            {data.analysis_id && !overlayFailed && (
+                <div className="accordion-section">
+                    <button
+                        className={`accordion-header ${showOverlay ? 'active' : ''}`}
+                        onClick={() => setShowOverlay(!showOverlay)}
+                    >
+                        <span>Разметка лица</span>
+                        <span className="accordion-arrow">▼</span>
+                    </button>
+                    <div className={`accordion-content ${showOverlay ? 'show' : ''}`}>
+                        {showOverlay && (
+                            <img
+                                src={overlayUrl(data.analysis_id)}
+                                alt="Разметка лица"
+                                style={{ maxWidth: '100%', borderRadius: '8px' }}
+                                onError={() => setOverlayFailed(true)}
+                            />
+                        )}
+                    </div>
+                </div>
+            )}
+
             {/* Рекомендации */}
             <div className="recommendations-section">
                 <h4>Рекомендации по уходу</h4>
@@ -154,27 +203,108 @@ const ReportView = ({ report }) => {
     );
 };
 
+const QualityReasons = ({ title, reasons }) => (
+    <div className="recommendations-section">
+        <h4>{title}</h4>
+        <div className="recommendations-grid">
+            {reasons.map((reason, index) => (
+                <div key={index} className="recommendation-card">
+                    <div className="recommendation-icon">{reason.severity === 'reject' ? '⛔' : '⚠️'}</div>
+                    <div className="recommendation-text">{describeQualityReason(reason.code)}</div>
+                </div>
+            ))}
+        </div>
+    </div>
+);
+
+const DegradedReport = ({ data }) => {
+    // В упрощённом анализе есть и параметры снимка (яркость, контраст) - показываем только показатели кожи
+    const metrics = Object.entries(data.metrics || {}).filter(([key]) => key in METRIC_TRANSLATIONS);
+    return (
+        <div className="report-view">
+            <div className="overall-score-card">
+                <h3>{data.analysis_type === 'simple_analysis' ? 'Упрощённый анализ' : 'Анализ выполнен частично'}</h3>
+                <div className="hint">{describeDegradedReason(data)}</div>
+                {data.metrics?.face_detected === 0 && (
+                    <div className="hint">Лицо не найдено автоматически, оценка выполнена по центру кадра</div>
+                )}
+            </div>
+
+            {data.quality?.reasons?.length > 0 && (
+                <QualityReasons title="Качество снимка" reasons={data.quality.reasons} />
+            )}
+
+            {metrics.length > 0 && (
+                <div className="metrics-grid-detailed">
+                    {metrics.map(([key, value]) => (
+                        <div key={key} className="metric-card">
+                            <div className="metric-info">
+                                <span className="metric-name">{translateMetric(key)}</span>
+                                <span
+                                    className="metric-value-badge"
+                                    style={{ backgroundColor: getMetricColor(value) }}
+                                >
+                                    {Math.round(value * 100)}%
+                                </span>
+                            </div>
+                            <div className="metric-bar-detailed">
+                                <div
+                                    className="metric-fill-detailed"
+                                    style={{ width: `${value * 100}%`, backgroundColor: getMetricColor(value) }}
+                                />
+                            </div>
+                        </div>
+                    ))}
+                </div>
+            )}
+        </div>
+    );
+};
+
 // Вспомогательные функции
-function translateMetric(key) {
-    const translations = {
-        'pigmentation': 'Пигментация',
-        'texture_roughness': 'Неровность текстуры',
-        'puffiness': 'Отечность',
-        'pore_size': 'Размер пор',
-        'redness': 'Покраснение',
-        'dark_circles': 'Тёмные круги',
-        'mild_acne': 'Лёгкие акне',
-        'moderate_acne': 'Умеренные акне',
-        'severe_acne': 'Тяжёлые акне',
-        'wrinkles': 'Морщины',
-        'vascularity': 'Сосудистые проявления',
-        'paleness': 'Бледность',
-        'jaundice': 'Желтизна',
-        'oiliness': 'Жирность',
-        'acne_spots': 'Пятна от акне',
-        'cyanosis': 'Цианоз'
+function describeDegradedReason(data) {
+    if (data.degraded_reason === 'load_shed') {
+        return 'Сервис перегружен, поэтому выполнен упрощённый анализ. Повторите попытку позже для полного отчёта';
+    }
+    if (data.degraded_reason === 'mediapipe_unavailable') {
+        return 'Полный анализ сейчас недоступен, выполнен упрощённый анализ по цвету кожи';
+    }
+    return 'Не удалось выполнить полный анализ. Повторите попытку позже';
+}
+
+function describeQualityReason(code) {
+    const descriptions = {
+        'too_dark': 'Слишком темно — снимайте при хорошем освещении, лицом к источнику света',
+        'overexposed': 'Снимок пересвечен — уберите прямой яркий свет или вспышку',
+        'blurry': 'Снимок размыт — держите камеру неподвижно',
+        'no_face': 'Лицо не найдено — лицо должно быть в кадре целиком',
+        'face_too_small': 'Лицо слишком мелкое — поднесите камеру ближе',
+        'multiple_faces': 'В кадре несколько лиц — оставьте только одно'
     };
-    return translations[key] || key;
+    return descriptions[code] || code;
+}
+
+const METRIC_TRANSLATIONS = {
+    'pigmentation': 'Пигментация',
+    'texture_roughness': 'Неровность текстуры',
+    'puffiness': 'Отечность',
+    'pore_size': 'Размер пор',
+    'redness': 'Покраснение',
+    'dark_circles': 'Тёмные круги',
+    'mild_acne': 'Лёгкие акне',
+    'moderate_acne': 'Умеренные акне',
+    'severe_acne': 'Тяжёлые акне',
+    'wrinkles': 'Морщины',
+    'vascularity': 'Сосудистые проявления',
+    'paleness': 'Бледность',
+    'jaundice': 'Желтизна',
+    'oiliness': 'Жирность',
+    'acne_spots': 'Пятна от акне',
+    'cyanosis': 'Цианоз'
+};
+
+function translateMetric(key) {
+    return METRIC_TRANSLATIONS[key] || key;
 }
 
 function getMetricColor(value) {